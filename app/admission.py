@@ -0,0 +1,162 @@
+# app/admission.py - adaptacyjna kontrola dopuszczania obrazów do NCShot (opóźnienia, 5xx, pamięć VM)
+
+import logging
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+# memory_probe() -> {host: zajęta część pamięci VM 0..1}
+MemoryProbe = Callable[[], Dict[str, float]]
+
+
+def parse_meminfo(text: str) -> Optional[float]:
+    """Zajęta część pamięci z /proc/meminfo (1 - MemAvailable/MemTotal); None, gdy brak pól"""
+    values = {}
+    for line in text.splitlines():
+        name, _, rest = line.partition(":")
+        parts = rest.split()
+        if parts and parts[0].isdigit():
+            values[name.strip()] = int(parts[0])
+    total = values.get("MemTotal")
+    available = values.get("MemAvailable", values.get("MemFree"))
+    if not total or available is None:
+        return None
+    return max(0.0, min(1.0, 1 - available / total))
+
+
+class AdmissionController:
+    """
+    Globalny (dla wszystkich wsadów i zadań) limit obrazów jednocześnie wysłanych do NCShot,
+    regulowany jak okno przeciążeniowe AIMD:
+
+    - sukces z opóźnieniem poniżej `latency_target` powiększa limit o 1/limit (ok. +1 na pełne okno),
+    - bad_alloc/5xx, opóźnienie ponad cel albo pamięć VM powyżej `memory_high` zmniejsza go
+      `decrease_factor` razy (najwyżej raz na `cooldown` sekund, żeby jedna fala błędów nie zerowała okna).
+
+    Obrazy ponad limit czekają w kolejce (`slot()`), zamiast być odrzucane.
+    """
+
+    def __init__(self, min_limit: int = 1, max_limit: int = 8, initial: Optional[int] = None,
+                 latency_target: float = 10.0, memory_high: float = 0.85, decrease_factor: float = 0.5,
+                 cooldown: float = 5.0, window: int = 50):
+        self.min_limit = max(1, int(min_limit))
+        self.max_limit = max(self.min_limit, int(max_limit))
+        self.limit = float(min(self.max_limit, max(self.min_limit, initial or self.max_limit)))
+        self.latency_target = latency_target
+        self.memory_high = memory_high
+        self.decrease_factor = decrease_factor
+        self.cooldown = cooldown
+        self._cond = threading.Condition()
+        self._recent = deque(maxlen=max(1, window))
+        self._last_decrease = 0.0
+        self._stop = threading.Event()
+        self._sampler: Optional[threading.Thread] = None
+        self.in_flight = 0
+        self.waiting = 0
+        self.latency_ewma: Optional[float] = None
+        self.vm_memory: Dict[str, float] = {}
+        self.stats = {"admitted": 0, "queued": 0, "queue_time": 0.0, "increases": 0, "decreases": 0,
+                      "overloads": 0, "last_decrease_reason": None}
+
+    # ----- dopuszczanie -----
+    @contextmanager
+    def slot(self):
+        """Czeka, aż liczba obrazów w NCShot spadnie poniżej bieżącego limitu"""
+        started = time.monotonic()
+        with self._cond:
+            queued = self.in_flight >= int(self.limit)
+            if queued:
+                self.waiting += 1
+                self.stats["queued"] += 1
+                while self.in_flight >= int(self.limit):
+                    self._cond.wait()
+                self.waiting -= 1
+                self.stats["queue_time"] += time.monotonic() - started
+            self.in_flight += 1
+            self.stats["admitted"] += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self.in_flight -= 1
+                self._cond.notify()
+
+    # ----- sygnały -----
+    def record(self, latency: float, overloaded: bool = False) -> None:
+        """Wynik jednego żądania do NCShot: czas odpowiedzi i czy instancja była przeciążona"""
+        with self._cond:
+            self._recent.append(overloaded)
+            self.latency_ewma = latency if self.latency_ewma is None else 0.8 * self.latency_ewma + 0.2 * latency
+            if overloaded:
+                self.stats["overloads"] += 1
+                self._decrease("bad_alloc/5xx NCShot")
+            elif latency > self.latency_target:
+                self._decrease(f"opóźnienie NCShot {latency:.1f}s > {self.latency_target:g}s")
+            elif not self._memory_pressure() and self.limit < self.max_limit:
+                self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+                self.stats["increases"] += 1
+                self._cond.notify_all()
+
+    def update_memory(self, host: str, used: float) -> None:
+        with self._cond:
+            self.vm_memory[host] = used
+            if used >= self.memory_high:
+                self._decrease(f"pamięć VM {host} zajęta w {used:.0%}")
+
+    def _memory_pressure(self) -> bool:
+        return any(used >= self.memory_high for used in self.vm_memory.values())
+
+    def _decrease(self, reason: str) -> None:
+        now = time.monotonic()
+        if now - self._last_decrease < self.cooldown or self.limit <= self.min_limit:
+            return
+        previous = self.limit
+        self.limit = max(float(self.min_limit), self.limit * self.decrease_factor)
+        self._last_decrease = now
+        self.stats["decreases"] += 1
+        self.stats["last_decrease_reason"] = reason
+        logger.warning(f"🚦 Limit obrazów w NCShot {previous:.1f} -> {self.limit:.1f}: {reason}")
+
+    # ----- próbkowanie pamięci VM -----
+    def start_memory_sampler(self, probe: MemoryProbe, interval: float) -> None:
+        if interval <= 0 or (self._sampler and self._sampler.is_alive()):
+            return
+        self._stop.clear()
+        self._sampler = threading.Thread(target=self._sample_memory, args=(probe, interval),
+                                         name="ncshot-admission-memory", daemon=True)
+        self._sampler.start()
+
+    def _sample_memory(self, probe: MemoryProbe, interval: float) -> None:
+        while not self._stop.is_set():
+            try:
+                for host, used in probe().items():
+                    self.update_memory(host, used)
+            except Exception as e:
+                logger.warning(f"⚠ī¸ Nie udało się odczytać pamięci VM NCShot: {e}")
+            self._stop.wait(interval)
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._sampler:
+            self._sampler.join(timeout=5)
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._cond:
+            stats = dict(self.stats)
+            stats.update({
+                "limit": round(self.limit, 2),
+                "min_limit": self.min_limit,
+                "max_limit": self.max_limit,
+                "in_flight": self.in_flight,
+                "waiting": self.waiting,
+                "latency_ewma": self.latency_ewma,
+                "latency_target": self.latency_target,
+                "overload_rate": sum(self._recent) / len(self._recent) if self._recent else 0.0,
+                "vm_memory": dict(self.vm_memory),
+                "memory_high": self.memory_high,
+            })
+        return stats
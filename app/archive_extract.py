@@ -0,0 +1,93 @@
+# app/archive_extract.py - wyodrębnianie obrazu z archiwów 7z terminala w pamięci, w puli procesów
+
+import io
+import logging
+import multiprocessing
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Dict, Optional, Tuple
+
+import py7zr
+
+logger = logging.getLogger(__name__)
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.bif', '.zur')
+
+
+def extract_first_image(data: bytes) -> Optional[Tuple[str, Optional[bytes]]]:
+    """
+    Dekoduje w pamięci tylko pierwszy plik obrazu archiwum (bez katalogu tymczasowego
+    i bez wypakowywania pozostałych plików). Zwraca (nazwa, bajty) albo None, gdy archiwum
+    nie zawiera obrazu; bajty są None, gdy py7zr nie zwrócił treści pliku.
+    """
+    with py7zr.SevenZipFile(io.BytesIO(data), mode='r') as archive:
+        target = next((name for name in archive.getnames() if name.lower().endswith(IMAGE_EXTENSIONS)), None)
+        if target is None:
+            return None
+        member = archive.read(targets=[target]).get(target)
+        return target, member.read() if member is not None else None
+
+
+class ArchiveExtractor:
+    """
+    Pula procesów dekompresji archiwów 7z (LZMA nie zwalnia GIL - wątki nie dałyby równoległości).
+
+    Pula powstaje przy pierwszym archiwum i jest współdzielona przez kolejne pobrania;
+    `workers=0` wyodrębnia obrazy w bieżącym wątku. Procesy startują metodą "spawn" - fork
+    wielowątkowej aplikacji mógłby skopiować blokady trzymane przez inne wątki; funkcja
+    robocza i jej argumenty (bajty archiwum) są importowalne i serializowalne.
+    """
+
+    def __init__(self, workers: int = 2):
+        self.workers = max(0, int(workers))
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._lock = threading.Lock()
+        self._stats = {"archives": 0, "errors": 0}
+
+    @property
+    def max_in_flight(self) -> int:
+        """Archiwa pobrane i czekające na dekompresję (ogranicza pamięć pobranych danych)"""
+        return max(1, self.workers * 2)
+
+    def submit(self, data: bytes) -> Future:
+        with self._lock:
+            self._stats["archives"] += 1
+            if self.workers and self._executor is None:
+                self._executor = self._new_executor()
+            executor = self._executor
+        if executor is not None:
+            try:
+                return executor.submit(extract_first_image, data)
+            except BrokenProcessPool:
+                # Proces puli padł (np. OOM przy uszkodzonym archiwum) - nowa pula dla kolejnych archiwów
+                logger.warning("⚠ī¸ Pula dekompresji archiwów uszkodzona - tworzę nową")
+                with self._lock:
+                    if self._executor is executor:
+                        self._executor = self._new_executor()
+                    executor = self._executor
+                return executor.submit(extract_first_image, data)
+
+        future = Future()
+        try:
+            future.set_result(extract_first_image(data))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+    def _new_executor(self) -> ProcessPoolExecutor:
+        return ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context("spawn"))
+
+    def record_error(self) -> None:
+        with self._lock:
+            self._stats["errors"] += 1
+
+    def get_stats(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self._stats, workers=self.workers)
+
+    def shutdown(self) -> None:
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
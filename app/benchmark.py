@@ -0,0 +1,376 @@
+# app/benchmark.py - powtarzalne benchmarki potoku weryfikacji (end-to-end /ncshot/ i mikrobenchmarki)
+
+import argparse
+import base64
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+from app.fake_ncshot import FakeNcshotState, start_fake_ncshot
+from app.logic import process_ncshot_result_xml_enhanced
+from app.xml_tools import SAMPLE_NCSHOT_XML
+
+DEFAULT_OUTPUT_DIR = "cache/benchmarks"
+
+
+# ===== DANE WEJŚCIOWE =====
+def sample_package(rois: int = 2, location_id: str = "BENCH.1.001") -> Dict[str, Any]:
+    """Pakiet konfiguracji (kształt FullPackage) z `rois` prostokątnymi ROI"""
+    return {
+        "rois": [{"id": f"roi{n}", "points": [{"x": 100 + 50 * n, "y": 100}, {"x": 900 + 50 * n, "y": 100},
+                                               {"x": 900 + 50 * n, "y": 600}, {"x": 100 + 50 * n, "y": 600}],
+                  "angle": 0.0, "zoom": 1.0} for n in range(rois)],
+        "deployment": {"serialNumber": "BENCH", "locationId": location_id},
+    }
+
+
+def synthetic_jpeg(size: int, rng: random.Random) -> bytes:
+    """Bajty w ramie JPEG (SOI, segmenty COM, EOI) - przechodzą walidację aplikacji i zastępcy NCShot"""
+    body = bytearray(b"\xff\xd8")
+    remaining = max(0, size - 4)
+    while remaining > 0:
+        chunk = min(remaining, 60000)
+        body += b"\xff\xfe" + (chunk + 2).to_bytes(2, "big") + rng.randbytes(chunk)
+        remaining -= chunk + 4
+    return bytes(body + b"\xff\xd9")
+
+
+def uniquify_jpeg(jpeg: bytes, salt: str) -> bytes:
+    """Wstawia segment COM za SOI - inny SHA-256 obrazu (omija cache wyników), ten sam obraz"""
+    comment = salt.encode("utf-8")
+    return jpeg[:2] + b"\xff\xfe" + (len(comment) + 2).to_bytes(2, "big") + comment + jpeg[2:]
+
+
+class ImageSource:
+    """Obrazy benchmarku: prawdziwe JPEG z katalogu (cyklicznie) albo syntetyczne"""
+
+    def __init__(self, directory: Optional[str], image_kb: int, unique: bool, seed: int):
+        self.unique = unique
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._counter = 0
+        self._images = [p.read_bytes() for p in sorted(Path(directory).glob("*.jp*g"))] if directory else []
+        if directory and not self._images:
+            raise SystemExit(f"Brak plików JPEG w {directory}")
+        self._image_size = image_kb * 1024
+
+    def take(self, count: int) -> List[str]:
+        with self._lock:
+            images = []
+            for _ in range(count):
+                self._counter += 1
+                if self._images:
+                    data = self._images[self._counter % len(self._images)]
+                else:
+                    data = synthetic_jpeg(self._image_size, self._rng)
+                if self.unique:
+                    data = uniquify_jpeg(data, f"bench-{os.getpid()}-{self._counter}")
+                images.append("data:image/jpeg;base64," + base64.b64encode(data).decode("ascii"))
+        return images
+
+
+# ===== POMOCNICZE =====
+def percentile(values: List[float], pct: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = (len(ordered) - 1) * pct / 100
+    low = int(rank)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (rank - low)
+
+
+def latency_summary(values: List[float]) -> Dict[str, Optional[float]]:
+    return {"p50": percentile(values, 50), "p95": percentile(values, 95), "p99": percentile(values, 99),
+            "max": max(values, default=None), "mean": sum(values) / len(values) if values else None}
+
+
+def http_json(method: str, url: str, payload: Optional[Dict[str, Any]] = None,
+              timeout: float = 600.0) -> Dict[str, Any]:
+    data = json.dumps(payload).encode("utf-8") if payload is not None else None
+    request = urllib.request.Request(url, data=data, method=method,
+                                     headers={"Content-Type": "application/json"} if data else {})
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            return {"status": response.status, "body": json.loads(response.read() or b"null")}
+    except urllib.error.HTTPError as e:
+        body = e.read()
+        try:
+            body = json.loads(body)
+        except ValueError:
+            body = body.decode("utf-8", "replace")[:500]
+        return {"status": e.code, "body": body}
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+# ===== END-TO-END /ncshot/ =====
+def run_ncshot_job(app_url: str, payload: Dict[str, Any], timeout: float = 3600.0) -> Dict[str, Any]:
+    """
+    Wsad przez /ncshot/jobs/ (bez limitu obrazów): zgłoszenie, strumień NDJSON do zdarzenia
+    końcowego. Zwraca {"status", "body"} jak http_json - `body.results._stats` ze statystykami zadania.
+    """
+    submitted = http_json("POST", f"{app_url}/ncshot/jobs/", payload)
+    if submitted["status"] != 200:
+        return submitted
+    job = submitted["body"]
+    final = None
+    with urllib.request.urlopen(f"{app_url}{job['stream_url']}", timeout=timeout) as stream:
+        for line in stream:
+            event = json.loads(line)
+            if event["type"] in ("done", "failed", "cancelled"):
+                final = event
+                break
+    if final is None or final["type"] != "done":
+        return {"status": 500, "body": {"job_id": job["job_id"], "final_event": final}}
+    return {"status": 200, "body": {"results": {"_stats": final["stats"] or {}}}}
+
+
+def run_ncshot_scenario(app_url: str, source: ImageSource, batch_size: int, concurrency: int, repeat: int,
+                        fake_url: Optional[str], sync_limit: int) -> Dict[str, Any]:
+    """
+    `concurrency` klientów wysyła po `repeat` wsadów z `batch_size` obrazami: synchronicznie
+    przez /ncshot/ do `sync_limit` obrazów, większe jako zadania /ncshot/jobs/
+    """
+    package = sample_package()
+    mode = "sync" if batch_size <= sync_limit else "job"
+    fake_before = http_json("GET", f"{fake_url}/_stats")["body"] if fake_url else None
+    latencies, statuses, rss_peaks, errors = [], {}, [], []
+    images_ok = images_failed = 0
+    lock = threading.Lock()
+
+    def client(_: int) -> None:
+        nonlocal images_ok, images_failed
+        for _ in range(repeat):
+            payload = {"package": package, "image_files": source.take(batch_size)}
+            started = time.perf_counter()
+            if mode == "sync":
+                response = http_json("POST", f"{app_url}/ncshot/", payload)
+            else:
+                response = run_ncshot_job(app_url, payload)
+            elapsed = time.perf_counter() - started
+            stats = (response["body"] or {}).get("results", {}).get("_stats", {}) \
+                if isinstance(response["body"], dict) else {}
+            with lock:
+                statuses[response["status"]] = statuses.get(response["status"], 0) + 1
+                if response["status"] == 200:
+                    latencies.append(elapsed)
+                    images_ok += stats.get("processed", 0)
+                    images_failed += stats.get("failed", 0)
+                    memory = stats.get("memory") or (stats.get("last_chunk") or {}).get("memory") or {}
+                    if memory.get("rss_peak"):
+                        rss_peaks.append(memory["rss_peak"])
+                elif len(errors) < 5:
+                    errors.append(response["body"])
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(client, range(concurrency)))
+    wall_time = time.perf_counter() - started
+
+    result = {
+        "batch_size": batch_size,
+        "mode": mode,
+        "concurrency": concurrency,
+        "requests": sum(statuses.values()),
+        "statuses": {str(status): count for status, count in statuses.items()},
+        "images_ok": images_ok,
+        "images_failed": images_failed,
+        "wall_time": wall_time,
+        "images_per_s": images_ok / wall_time if wall_time else 0.0,
+        "request_latency": latency_summary(latencies),
+        "peak_rss": max(rss_peaks, default=None),
+        "errors": errors,
+    }
+    if fake_url:
+        fake_after = http_json("GET", f"{fake_url}/_stats")["body"]
+        result["ncshot"] = {
+            "token_leaks": fake_after["outstanding_tokens"] - fake_before["outstanding_tokens"],
+            "leaked_tokens_total": fake_after["leaked_tokens"],
+            "bad_alloc": fake_after["bad_alloc"] - fake_before["bad_alloc"],
+            "peak_outstanding_tokens": fake_after["peak_outstanding_tokens"],
+        }
+    return result
+
+
+def run_ncshot_benchmarks(args: argparse.Namespace) -> List[Dict[str, Any]]:
+    fake_server = None
+    fake_url = args.fake_url
+    if args.start_fake:
+        fake_server = start_fake_ncshot(args.fake_host, args.fake_port, latency=args.fake_latency,
+                                        latency_jitter=args.fake_latency_jitter, vehicles=args.fake_vehicles,
+                                        max_tokens=args.fake_max_tokens, seed=args.seed)
+        fake_url = f"http://{args.fake_host}:{fake_server.server_address[1]}"
+        print(f"🧪 Zastępca NCShot: {fake_url} (aplikacja musi kierować do niego ruch NCShot)", file=sys.stderr)
+
+    source = ImageSource(args.images, args.image_kb, unique=not args.allow_cache, seed=args.seed)
+    health = http_json("GET", f"{args.app_url}/health/", timeout=30)
+    if health["status"] != 200:
+        raise SystemExit(f"Aplikacja pod {args.app_url} nie odpowiada: {health}")
+    sync_limit = health["body"].get("limits", {}).get("max_images_per_batch") or 20
+
+    scenarios = []
+    try:
+        for batch_size in args.batch_sizes:
+            for concurrency in args.concurrency:
+                endpoint = "/ncshot/" if batch_size <= sync_limit else "/ncshot/jobs/"
+                print(f"▶ī¸ {endpoint}: {batch_size} obrazów x {concurrency} klientów x {args.repeat}", file=sys.stderr)
+                scenario = run_ncshot_scenario(args.app_url, source, batch_size, concurrency, args.repeat, fake_url,
+                                               sync_limit)
+                failed = {status: count for status, count in scenario["statuses"].items() if status != "200"}
+                if failed:
+                    # Odpowiedzi z błędem to nie pomiar - nie zapisuj ich jako wyniku
+                    raise SystemExit(f"⚠ī¸ Scenariusz {batch_size}x{concurrency}: odpowiedzi z błędem {failed}, "
+                                     f"np. {scenario['errors'][:1]}")
+                latency = scenario["request_latency"]
+                print(f"   {scenario['images_per_s']:.2f} obrazów/s, p50 {latency['p50'] or 0:.3f}s, "
+                      f"p95 {latency['p95'] or 0:.3f}s, statusy {scenario['statuses']}", file=sys.stderr)
+                scenarios.append(scenario)
+    finally:
+        if fake_server:
+            fake_server.shutdown()
+    return scenarios
+
+
+# ===== MIKROBENCHMARKI =====
+def time_call(func: Callable[[], Any], iterations: int) -> Dict[str, Any]:
+    func()  # rozgrzewka
+    samples = []
+    for _ in range(iterations):
+        started = time.perf_counter()
+        func()
+        samples.append((time.perf_counter() - started) * 1e6)
+    return {"iterations": iterations, "mean_us": sum(samples) / len(samples),
+            "p50_us": percentile(samples, 50), "p95_us": percentile(samples, 95)}
+
+
+def run_micro_benchmarks(iterations: int) -> Dict[str, Any]:
+    results = {}
+    large_xml = FakeNcshotState(vehicles=10).build_xml(b"bench", "00000001")
+    results["process_ncshot_result_xml_enhanced.sample"] = time_call(
+        lambda: process_ncshot_result_xml_enhanced(SAMPLE_NCSHOT_XML), iterations)
+    results["process_ncshot_result_xml_enhanced.10_vehicles"] = time_call(
+        lambda: process_ncshot_result_xml_enhanced(large_xml), iterations)
+
+    try:
+        from app.main import FullPackage, build_roi_config_ini, build_scene_xml
+    except Exception as e:  # brak zależności aplikacji (fastapi, paramiko...) albo konfiguracji
+        reason = f"{type(e).__name__}: {e}"
+        print(f"⚠ī¸ Pomijam benchmarki app.main: {reason}", file=sys.stderr)
+        results["build_roi_config_ini"] = results["build_scene_xml"] = {"skipped": reason}
+        return results
+
+    for rois in (1, 4):
+        package = FullPackage.model_validate(sample_package(rois=rois))
+        results[f"build_roi_config_ini.{rois}_roi"] = time_call(lambda: build_roi_config_ini(package), iterations)
+        results[f"build_scene_xml.{rois}_roi"] = time_call(lambda: build_scene_xml(package), iterations)
+    return results
+
+
+# ===== PORÓWNANIE =====
+def compare_results(baseline_path: str, current_path: str) -> int:
+    """Zestawia dwa pliki wyników (np. z dwóch commitów): mikrobenchmarki i scenariusze /ncshot/"""
+    with open(baseline_path, encoding="utf-8") as f:
+        baseline = json.load(f)
+    with open(current_path, encoding="utf-8") as f:
+        current = json.load(f)
+    print(f"📊 {baseline['meta'].get('commit')} -> {current['meta'].get('commit')}")
+
+    for name, entry in current.get("micro", {}).items():
+        before = baseline.get("micro", {}).get(name, {})
+        if "mean_us" in entry and "mean_us" in before:
+            change = (entry["mean_us"] - before["mean_us"]) / before["mean_us"] * 100
+            print(f"   {name}: {before['mean_us']:.1f} -> {entry['mean_us']:.1f} µs ({change:+.1f}%)")
+
+    previous = {(s["batch_size"], s["concurrency"]): s for s in baseline.get("ncshot", [])}
+    for scenario in current.get("ncshot", []):
+        before = previous.get((scenario["batch_size"], scenario["concurrency"]))
+        if not before:
+            continue
+        print(f"   /ncshot/ {scenario['batch_size']}x{scenario['concurrency']}: "
+              f"{before['images_per_s']:.2f} -> {scenario['images_per_s']:.2f} obrazów/s, "
+              f"p95 {before['request_latency']['p95'] or 0:.3f} -> {scenario['request_latency']['p95'] or 0:.3f}s")
+    return 0
+
+
+# ===== CLI =====
+def int_list(value: str) -> List[int]:
+    return [int(part) for part in value.split(",") if part.strip()]
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m app.benchmark", description="Benchmarki potoku NCShot")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    def add_common(sub: argparse.ArgumentParser) -> None:
+        sub.add_argument("-o", "--output", help=f"plik JSON wyników (domyślnie {DEFAULT_OUTPUT_DIR}/<commit>-<czas>.json)")
+        sub.add_argument("--iterations", type=int, default=200, help="iteracje mikrobenchmarków")
+        sub.add_argument("--seed", type=int, default=1)
+
+    micro = commands.add_parser("micro", help="mikrobenchmarki parsera XML i generatorów INI/XML sceny")
+    add_common(micro)
+
+    for name, help_text in (("ncshot", "end-to-end /ncshot/ na działającej aplikacji"),
+                            ("all", "mikrobenchmarki + end-to-end")):
+        sub = commands.add_parser(name, help=help_text)
+        add_common(sub)
+        sub.add_argument("--app-url", default="http://127.0.0.1:8000")
+        sub.add_argument("--batch-sizes", type=int_list, default=[1, 5, 20, 50, 200])
+        sub.add_argument("--concurrency", type=int_list, default=[1, 4])
+        sub.add_argument("--repeat", type=int, default=3, help="żądania na klienta w scenariuszu")
+        sub.add_argument("--images", help="katalog z prawdziwymi JPEG (domyślnie obrazy syntetyczne)")
+        sub.add_argument("--image-kb", type=int, default=200, help="rozmiar obrazów syntetycznych")
+        sub.add_argument("--allow-cache", action="store_true", help="nie unikalizuj obrazów (trafienia cache)")
+        sub.add_argument("--fake-url", help="adres zastępcy NCShot (statystyki tokenów i bad_alloc)")
+        sub.add_argument("--start-fake", action="store_true", help="uruchom zastępcę NCShot w tym procesie")
+        sub.add_argument("--fake-host", default="127.0.0.1")
+        sub.add_argument("--fake-port", type=int, default=5543)
+        sub.add_argument("--fake-latency", type=float, default=0.15)
+        sub.add_argument("--fake-latency-jitter", type=float, default=0.05)
+        sub.add_argument("--fake-vehicles", type=int, default=1)
+        sub.add_argument("--fake-max-tokens", type=int, default=16)
+
+    compare = commands.add_parser("compare", help="porównanie dwóch plików wyników")
+    compare.add_argument("baseline")
+    compare.add_argument("current")
+
+    args = parser.parse_args(argv)
+    if args.command == "compare":
+        return compare_results(args.baseline, args.current)
+
+    commit = git_commit()
+    report = {"meta": {"commit": commit, "created_at": datetime.now().isoformat(), "python": sys.version.split()[0],
+                       "platform": platform.platform(), "cpus": os.cpu_count(), "command": args.command,
+                       "args": {k: v for k, v in vars(args).items() if k != "command"}}}
+    if args.command in ("micro", "all"):
+        report["micro"] = run_micro_benchmarks(args.iterations)
+    if args.command in ("ncshot", "all"):
+        report["ncshot"] = run_ncshot_benchmarks(args)
+
+    output = args.output or os.path.join(DEFAULT_OUTPUT_DIR, f"{commit or 'nocommit'}-{datetime.now():%Y%m%d-%H%M%S}.json")
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+    print(f"✅ Wyniki zapisane: {output}", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
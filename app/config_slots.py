@@ -0,0 +1,91 @@
+# app/config_slots.py - nazwane sloty konfiguracji NCShot per (lokalizacja, hash INI)
+
+import logging
+import re
+import threading
+import time
+from collections import Counter
+from typing import Any, Dict, List
+
+from app.config_state import NcshotConfigTracker
+
+logger = logging.getLogger(__name__)
+
+
+class NcshotConfigSlotManager:
+    """
+    Przydziela każdej parze (lokalizacja, hash INI) własny slot konfiguracji NCShot
+    (`/config/<slot>`, obrazy do `/<slot>?...`) zamiast wspólnego `tmp`.
+
+    Dzięki temu wsady dla różnych lokalizacji nie nadpisują sobie konfiguracji.
+    Liczba slotów na instancję jest ograniczona do `max_slots`; nadmiarowe sloty są
+    eksmitowane w kolejności LRU, ale nigdy gdy są używane przez wsad w tym procesie
+    albo były używane w ciągu ostatnich `min_idle` sekund (np. przez inny worker).
+    """
+
+    def __init__(self, tracker: NcshotConfigTracker, max_slots: int = 8, min_idle: float = 900.0):
+        self.tracker = tracker
+        self.max_slots = max(1, int(max_slots))
+        self.min_idle = min_idle
+        self._leases = Counter()
+        self._lock = threading.Lock()
+        self._stats = {"acquired": 0, "evicted": 0}
+
+    @staticmethod
+    def slot_name(location_id: str, ini_hash: str) -> str:
+        """Nazwa slotu bezpieczna jako nazwa pliku .ini i ścieżka URL"""
+        location = re.sub(r"[^A-Za-z0-9_-]+", "_", location_id or "").strip("_")[:40] or "loc"
+        return f"nc_{location}_{ini_hash[:12]}"
+
+    def acquire(self, instance: str, location_id: str, ini_hash: str) -> str:
+        """Rezerwuje slot na czas wsadu; zwraca jego nazwę"""
+        slot = self.slot_name(location_id, ini_hash)
+        with self._lock:
+            self._leases[(instance, slot)] += 1
+            self._stats["acquired"] += 1
+        self.tracker.touch(instance, slot)
+        return slot
+
+    def release(self, instance: str, slot: str) -> None:
+        with self._lock:
+            self._leases[(instance, slot)] -= 1
+            if self._leases[(instance, slot)] <= 0:
+                del self._leases[(instance, slot)]
+        self.tracker.touch(instance, slot)
+
+    def plan_eviction(self, instance: str, keep: str) -> List[str]:
+        """
+        Wybiera sloty do usunięcia, tak aby po dodaniu `keep` nie przekroczyć `max_slots`.
+        Nie zmienia stanu - sloty usuwa z rejestru `commit_eviction()` po udanym wgraniu `keep`.
+        """
+        slots = self.tracker.slots(instance)
+        slots.pop(keep, None)
+        excess = len(slots) + 1 - self.max_slots
+        if excess <= 0:
+            return []
+
+        now = time.time()
+        with self._lock:
+            leased = {slot for (inst, slot) in self._leases if inst == instance}
+        candidates = sorted(
+            (entry.get("last_used", entry.get("pushed_at", 0)), slot)
+            for slot, entry in slots.items()
+            if slot not in leased and now - entry.get("last_used", entry.get("pushed_at", 0)) > self.min_idle
+        )
+        return [slot for _, slot in candidates[:excess]]
+
+    def commit_eviction(self, instance: str, victims: List[str]) -> None:
+        """Usuwa z rejestru stanu sloty eksmitowane po potwierdzonym wgraniu nowej konfiguracji"""
+        for slot in victims:
+            self.tracker.forget(instance, slot)
+        with self._lock:
+            self._stats["evicted"] += len(victims)
+        if victims:
+            logger.info(f"🧹 Eksmisja slotów konfiguracji NCShot {instance}: {victims}")
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._stats)
+            stats["leased"] = [f"{instance}/{slot}" for (instance, slot) in self._leases]
+        stats.update({"max_slots": self.max_slots, "min_idle": self.min_idle})
+        return stats
@@ -0,0 +1,228 @@
+# app/config_state.py - śledzenie konfiguracji wysłanych do instancji NCShot
+
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Optional, Tuple
+
+try:
+    import fcntl
+except ImportError:  # Windows - blokada tylko w obrębie procesu
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+
+class NcshotConfigTracker:
+    """
+    Pamięta hash ostatniej konfiguracji INI wysłanej do każdego slotu każdej instancji NCShot.
+
+    Stan jest trzymany w pliku JSON (z blokadą flock), więc wszystkie workery uvicorn
+    widzą tę samą wiedzę o tym, co jest aktualnie załadowane w NCShot. Wpis traci ważność
+    po `ttl` sekundach lub po `invalidate()` (np. gdy NCShot zgłosi błąd 5xx/bad_alloc).
+
+    Sprawdzenia przy każdym obrazie (`is_current`) czytają kopię stanu z pamięci, odświeżaną
+    po zmianie pliku albo po `cache_ttl` sekundach, a czasy użycia slotów (`touch`) trafiają
+    do pliku zbiorczo co `flush_interval` sekund - bez zapisu pliku pod blokadą na obraz.
+    """
+
+    def __init__(self, state_file: str, ttl: float = 600.0, cache_ttl: float = 1.0, flush_interval: float = 5.0):
+        self.state_file = state_file
+        self.ttl = ttl
+        self.cache_ttl = cache_ttl
+        self.flush_interval = flush_interval
+        self._lock = threading.Lock()
+        self._file_lock = threading.Lock()
+        self._snapshot: Optional[Dict[str, Any]] = None
+        self._snapshot_key: Optional[Tuple[int, int, int]] = None
+        self._snapshot_at = 0.0
+        self._touches: Dict[Tuple[str, str], float] = {}
+        self._stop = threading.Event()
+        self._flusher: Optional[threading.Thread] = None
+        self._stats = {"pushes": 0, "skips": 0, "invalidations": 0, "time_saved_total": 0.0,
+                       "state_reads": 0, "state_writes": 0, "touch_flushes": 0}
+        directory = os.path.dirname(state_file)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def _file_key(self) -> Optional[Tuple[int, int, int]]:
+        try:
+            st = os.stat(self.state_file)
+        except FileNotFoundError:
+            return None
+        return st.st_ino, st.st_mtime_ns, st.st_size
+
+    def _read_state(self) -> Dict[str, Any]:
+        """
+        Stan tylko do odczytu: kopia z pamięci, gdy plik się nie zmienił i nie minęło `cache_ttl`
+        sekund; inaczej odczyt pod blokadą współdzieloną (workery czytają równolegle)
+        """
+        key = self._file_key()
+        with self._lock:
+            if (self._snapshot is not None and key == self._snapshot_key
+                    and time.monotonic() - self._snapshot_at < self.cache_ttl):
+                return self._snapshot
+        with open(self.state_file, "a+", encoding="utf-8") as f:
+            if fcntl:
+                fcntl.flock(f, fcntl.LOCK_SH)
+            try:
+                f.seek(0)
+                key = self._file_key()
+                content = f.read()
+            finally:
+                if fcntl:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+        try:
+            state = json.loads(content) if content.strip() else {}
+        except ValueError:
+            state = {}
+        with self._lock:
+            self._snapshot, self._snapshot_key, self._snapshot_at = state, key, time.monotonic()
+            self._stats["state_reads"] += 1
+        return state
+
+    @contextmanager
+    def _locked_state(self):
+        """Otwiera plik stanu z wyłączną blokadą i zapisuje go po wyjściu z bloku"""
+        with self._file_lock:
+            with open(self.state_file, "a+", encoding="utf-8") as f:
+                if fcntl:
+                    fcntl.flock(f, fcntl.LOCK_EX)
+                try:
+                    f.seek(0)
+                    content = f.read()
+                    try:
+                        state = json.loads(content) if content.strip() else {}
+                    except ValueError:
+                        logger.warning(f"⚠ī¸ Uszkodzony plik stanu konfiguracji {self.state_file} - resetuję")
+                        state = {}
+                    before = json.dumps(state, sort_keys=True)
+                    yield state
+                    if json.dumps(state, sort_keys=True) != before:
+                        f.seek(0)
+                        f.truncate()
+                        json.dump(state, f)
+                        f.flush()
+                        with self._lock:
+                            self._snapshot = None
+                            self._stats["state_writes"] += 1
+                finally:
+                    if fcntl:
+                        fcntl.flock(f, fcntl.LOCK_UN)
+
+    def is_current(self, instance: str, slot: str, ini_hash: str) -> bool:
+        """Czy slot instancji ma już załadowaną konfigurację o podanym hashu"""
+        entry = self._read_state().get(instance, {}).get(slot)
+        if not entry or entry.get("hash") != ini_hash:
+            return False
+        if time.time() - entry.get("pushed_at", 0) > self.ttl:
+            return False
+        return True
+
+    def record_skip(self, instance: str, slot: str) -> float:
+        """Rejestruje pominięte wysyłanie; zwraca zaoszczędzony czas (koszt ostatniego wysłania)"""
+        entry = self._read_state().get(instance, {}).get(slot, {})
+        saved = float(entry.get("push_cost", 0.0))
+        with self._lock:
+            self._stats["skips"] += 1
+            self._stats["time_saved_total"] += saved
+        return saved
+
+    def mark_pushed(self, instance: str, slot: str, ini_hash: str, push_cost: float) -> None:
+        now = time.time()
+        with self._locked_state() as state:
+            state.setdefault(instance, {})[slot] = {
+                "hash": ini_hash,
+                "pushed_at": now,
+                "last_used": now,
+                "push_cost": push_cost,
+            }
+        with self._lock:
+            self._stats["pushes"] += 1
+
+    def touch(self, instance: str, slot: str) -> None:
+        """Aktualizuje czas ostatniego użycia slotu (dla eksmisji LRU) - zapis do pliku zbiorczo w `flush()`"""
+        with self._lock:
+            self._touches[(instance, slot)] = time.time()
+
+    def flush(self) -> int:
+        """Zapisuje zebrane czasy użycia slotów jednym zapisem pliku; zwraca liczbę wpisów"""
+        with self._lock:
+            touches, self._touches = self._touches, {}
+        if not touches:
+            return 0
+        with self._locked_state() as state:
+            for (instance, slot), used in touches.items():
+                entry = state.get(instance, {}).get(slot)
+                if entry is not None:
+                    entry["last_used"] = max(used, entry.get("last_used", 0))
+        with self._lock:
+            self._stats["touch_flushes"] += 1
+        return len(touches)
+
+    def start(self) -> None:
+        if self._flusher and self._flusher.is_alive():
+            return
+        self._stop.clear()
+        self._flusher = threading.Thread(target=self._run, name="ncshot-config-state-flush", daemon=True)
+        self._flusher.start()
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.flush_interval):
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"⚠ī¸ Błąd zapisu stanu slotów konfiguracji NCShot: {e}")
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._flusher:
+            self._flusher.join(timeout=self.flush_interval + 1)
+        self.flush()
+
+    def slots(self, instance: str) -> Dict[str, Dict[str, Any]]:
+        """Sloty konfiguracji znane dla instancji: {nazwa: wpis} (z niezapisanymi jeszcze czasami użycia)"""
+        self.flush()
+        with self._locked_state() as state:
+            return {slot: dict(entry) for slot, entry in state.get(instance, {}).items()}
+
+    def invalidate(self, instance: str, slot: Optional[str] = None) -> None:
+        """
+        Oznacza konfigurację slotu (lub wszystkich slotów instancji) jako nieaktualną -
+        następny wsad wgra ją ponownie. Wpisy zostają w rejestrze na potrzeby eksmisji.
+        """
+        with self._locked_state() as state:
+            slots = state.get(instance, {})
+            for name in ([slot] if slot else list(slots)):
+                if name in slots:
+                    slots[name]["pushed_at"] = 0
+        with self._lock:
+            self._stats["invalidations"] += 1
+        logger.info(f"♻ī¸ Unieważniono stan konfiguracji NCShot {instance}{'/' + slot if slot else ''}")
+
+    def forget(self, instance: str, slot: str) -> None:
+        """Usuwa slot z rejestru (po eksmisji z NCShot)"""
+        with self._locked_state() as state:
+            state.get(instance, {}).pop(slot, None)
+
+    def get_stats(self) -> Dict[str, Any]:
+        state = self._read_state()
+        instances = {
+            instance: {
+                slot: {
+                    "hash": entry.get("hash", "")[:12],
+                    "age": time.time() - entry.get("pushed_at", 0),
+                    "idle": time.time() - entry.get("last_used", entry.get("pushed_at", 0)),
+                }
+                for slot, entry in slots.items()
+            }
+            for instance, slots in state.items()
+        }
+        with self._lock:
+            stats = dict(self._stats)
+            stats["pending_touches"] = len(self._touches)
+        stats.update({"ttl": self.ttl, "instances": instances})
+        return stats
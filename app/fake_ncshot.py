@@ -0,0 +1,298 @@
+# app/fake_ncshot.py - lokalny zastępca NCShot do benchmarków i testów potoku bez maszyny wirtualnej
+
+import argparse
+import hashlib
+import io
+import json
+import logging
+import random
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional
+from urllib.parse import parse_qs, urlsplit
+
+try:
+    from PIL import Image, ImageDraw
+except ImportError:  # Pillow opcjonalny - bez niego wycinki tablic to same znaczniki JPEG
+    Image = None
+
+logger = logging.getLogger(__name__)
+
+PLATE_LETTERS = "ABCDEFGHJKLMNPRSTUVWXYZ"
+
+
+class FakeNcshotState:
+    """
+    Stan zastępcy NCShot: wgrane konfiguracje, wydane tokeny i liczniki.
+
+    Token trzymany dłużej niż `token_ttl` sekund liczy się jako wyciek. Gdy liczba
+    trzymanych tokenów osiągnie `max_tokens`, PUT obrazu kończy się `std::bad_alloc`
+    (jak prawdziwy NCShot przy wyczerpanej pamięci); `bad_alloc_rate` wstrzykuje ten
+    błąd losowo niezależnie od obciążenia.
+    """
+
+    def __init__(self, latency: float = 0.0, latency_jitter: float = 0.0, latency_per_mb: float = 0.0,
+                 plate_latency: float = 0.0, vehicles: int = 1, xml_template: Optional[str] = None,
+                 max_tokens: int = 16, bad_alloc_rate: float = 0.0, token_ttl: float = 30.0,
+                 seed: Optional[int] = None):
+        self.latency = latency
+        self.latency_jitter = latency_jitter
+        self.latency_per_mb = latency_per_mb
+        self.plate_latency = plate_latency
+        self.vehicles = vehicles
+        self.xml_template = xml_template
+        self.max_tokens = max_tokens
+        self.bad_alloc_rate = bad_alloc_rate
+        self.token_ttl = token_ttl
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.configs: Dict[str, bytes] = {}
+        self.tokens: Dict[str, Dict[str, Any]] = {}
+        self._next_token = 1
+        self.stats = {"images": 0, "bad_alloc": 0, "tokens_issued": 0, "tokens_released": 0,
+                      "unknown_token_releases": 0, "plates_served": 0, "config_pushes": 0,
+                      "peak_outstanding_tokens": 0, "in_flight": 0, "peak_in_flight": 0}
+
+    # ----- opóźnienia -----
+    def sleep_for_image(self, size: int) -> None:
+        delay = self.latency + self.latency_per_mb * size / (1024 * 1024)
+        if self.latency_jitter:
+            with self._lock:
+                delay += self._random.uniform(0, self.latency_jitter)
+        if delay > 0:
+            time.sleep(delay)
+
+    # ----- tokeny -----
+    def should_bad_alloc(self) -> bool:
+        with self._lock:
+            if len(self.tokens) >= self.max_tokens:
+                return True
+            return self.bad_alloc_rate > 0 and self._random.random() < self.bad_alloc_rate
+
+    def issue_token(self, vehicles: int) -> str:
+        with self._lock:
+            token = f"{self._next_token:08d}"
+            self._next_token += 1
+            self.tokens[token] = {"issued_at": time.monotonic(), "vehicles": vehicles}
+            self.stats["tokens_issued"] += 1
+            self.stats["peak_outstanding_tokens"] = max(self.stats["peak_outstanding_tokens"], len(self.tokens))
+        return token
+
+    def release_token(self, token: str) -> bool:
+        with self._lock:
+            if self.tokens.pop(token, None) is None:
+                self.stats["unknown_token_releases"] += 1
+                return False
+            self.stats["tokens_released"] += 1
+            return True
+
+    def token_vehicles(self, token: str) -> Optional[int]:
+        with self._lock:
+            entry = self.tokens.get(token)
+            return entry["vehicles"] if entry else None
+
+    def count(self, key: str, amount: int = 1) -> None:
+        with self._lock:
+            self.stats[key] += amount
+            if key == "in_flight":
+                self.stats["peak_in_flight"] = max(self.stats["peak_in_flight"], self.stats["in_flight"])
+
+    def get_stats(self) -> Dict[str, Any]:
+        now = time.monotonic()
+        with self._lock:
+            stats = dict(self.stats)
+            ages = [now - entry["issued_at"] for entry in self.tokens.values()]
+            stats.update({
+                "outstanding_tokens": len(self.tokens),
+                "leaked_tokens": sum(1 for age in ages if age > self.token_ttl),
+                "oldest_token_age": max(ages, default=0.0),
+                "configs": sorted(self.configs),
+            })
+        return stats
+
+    # ----- treść odpowiedzi -----
+    def plate_symbol(self, image: bytes, n: int) -> str:
+        """Deterministyczny numer tablicy z treści obrazu (ten sam obraz = ten sam wynik)"""
+        digest = hashlib.sha256(image + bytes([n])).digest()
+        letters = "".join(PLATE_LETTERS[b % len(PLATE_LETTERS)] for b in digest[:2])
+        return f"W{letters}{int.from_bytes(digest[2:5], 'big') % 100000:05d}"
+
+    def build_xml(self, image: bytes, token: str) -> str:
+        if self.xml_template is not None:
+            return self.xml_template.replace("{token}", token)
+        now = time.time()
+        exdata = []
+        for n in range(1, self.vehicles + 1):
+            exdata.append(f"""  <exdata>
+    <data name="plate" source="anpr"><value name="country">PL</value><value name="symbol">{self.plate_symbol(image, n)}</value>
+      <value name="level">{80 + n % 20}.5</value><value name="position">{100 * n},200,{100 * n + 120},230</value>
+      <value name="doubleline">0</value></data>
+    <data name="vehicle" source="mmr"><value name="direction">1</value><value name="speed">{40 + n}</value>
+      <value name="manufacturer">Skoda</value><value name="model">Octavia</value><value name="color">silver</value>
+      <value name="mmrpatternindex">{n}</value><value name="mmrpatterndivergence">0.{n}</value></data>
+  </exdata>""")
+        return (f'<?xml version="1.0" encoding="UTF-8"?>\n<result>\n'
+                f'  <timestamp><date>{time.strftime("%Y-%m-%d", time.localtime(now))}</date>'
+                f'<time>{time.strftime("%H:%M:%S", time.localtime(now))}</time><ms>{int(now * 1000) % 1000}</ms></timestamp>\n'
+                + "\n".join(exdata) + "\n</result>")
+
+    def plate_jpeg(self, token: str, number: int) -> bytes:
+        text = f"{token}/{number}"
+        if Image is not None:
+            image = Image.new("RGB", (160, 40), "white")
+            ImageDraw.Draw(image).text((8, 12), text, fill="black")
+            out = io.BytesIO()
+            image.save(out, "JPEG", quality=80)
+            return out.getvalue()
+        # SOI + segment COM z opisem + EOI - wystarcza walidacji nagłówka/końcówki JPEG
+        comment = text.encode("ascii").ljust(256, b" ")
+        return b"\xff\xd8\xff\xfe" + (len(comment) + 2).to_bytes(2, "big") + comment + b"\xff\xd9"
+
+
+class FakeNcshotHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive jak w prawdziwym NCShot (pula połączeń klienta)
+    server_version = "FakeNCShot/1.0"
+    state: FakeNcshotState = None
+
+    def log_message(self, format: str, *args: Any) -> None:
+        logger.debug("%s - %s", self.address_string(), format % args)
+
+    def _send(self, status: int, body: bytes = b"", content_type: str = "text/plain",
+              headers: Optional[Dict[str, str]] = None) -> None:
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _body(self) -> bytes:
+        return self.rfile.read(int(self.headers.get("Content-Length") or 0))
+
+    def do_GET(self) -> None:
+        url = urlsplit(self.path)
+        query = {key: values[0] for key, values in parse_qs(url.query).items()}
+        if url.path == "/":
+            self._send(200, b"NCShot (fake)")
+        elif url.path == "/vehicleplate":
+            self._plate(query.get("token", ""), query.get("number", "1"))
+        elif url.path == "/release":
+            released = self.state.release_token(query.get("token", ""))
+            self._send(200 if released else 404, b"released" if released else b"unknown token")
+        elif url.path == "/_stats":
+            self._send(200, json.dumps(self.state.get_stats()).encode("utf-8"), "application/json")
+        else:
+            self._send(404, b"not found")
+
+    def do_PUT(self) -> None:
+        url = urlsplit(self.path)
+        body = self._body()
+        if url.path.startswith("/config/"):
+            name = url.path[len("/config/"):]
+            with self.state._lock:
+                self.state.configs[name] = body
+            self.state.count("config_pushes")
+            self._send(200, b"OK")
+            return
+
+        slot = url.path.strip("/")
+        if slot != "tmp" and slot not in self.state.configs:
+            self._send(400, f"unknown configuration: {slot}".encode("utf-8"))
+            return
+        self._image(body)
+
+    def do_DELETE(self) -> None:
+        url = urlsplit(self.path)
+        if url.path.startswith("/config/"):
+            with self.state._lock:
+                removed = self.state.configs.pop(url.path[len("/config/"):], None)
+            self._send(200 if removed is not None else 404)
+        else:
+            self._send(404, b"not found")
+
+    def _image(self, image: bytes) -> None:
+        state = self.state
+        state.count("in_flight")
+        try:
+            state.sleep_for_image(len(image))
+            if state.should_bad_alloc():
+                state.count("bad_alloc")
+                self._send(500, b"std::bad_alloc")
+                return
+            token = state.issue_token(state.vehicles)
+            state.count("images")
+            xml_content = state.build_xml(image, token).encode("utf-8")
+            self._send(200, xml_content, "text/xml", {"ncshot-token": token})
+        finally:
+            state.count("in_flight", -1)
+
+    def _plate(self, token: str, number: str) -> None:
+        vehicles = self.state.token_vehicles(token)
+        try:
+            index = int(number)
+        except ValueError:
+            index = 0
+        if vehicles is None or not 1 <= index <= vehicles:
+            self._send(404, b"no such plate")
+            return
+        if self.state.plate_latency:
+            time.sleep(self.state.plate_latency)
+        self.state.count("plates_served")
+        self._send(200, self.state.plate_jpeg(token, index), "image/jpeg")
+
+
+def start_fake_ncshot(host: str = "127.0.0.1", port: int = 0, **state_kwargs) -> ThreadingHTTPServer:
+    """Uruchamia zastępcę NCShot w wątku tła; port 0 = wolny port (server.server_address[1])"""
+    state = FakeNcshotState(**state_kwargs)
+    handler = type("BoundFakeNcshotHandler", (FakeNcshotHandler,), {"state": state})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    server.state = state
+    threading.Thread(target=server.serve_forever, name="fake-ncshot", daemon=True).start()
+    return server
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m app.fake_ncshot", description="Lokalny zastępca NCShot")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=5543)
+    parser.add_argument("--latency", type=float, default=0.15, help="czas rozpoznania obrazu (s)")
+    parser.add_argument("--latency-jitter", type=float, default=0.05, help="losowy dodatek do czasu rozpoznania (s)")
+    parser.add_argument("--latency-per-mb", type=float, default=0.0, help="dodatkowy czas na MB obrazu (s)")
+    parser.add_argument("--plate-latency", type=float, default=0.0, help="czas wydania wycinka tablicy (s)")
+    parser.add_argument("--vehicles", type=int, default=1, help="liczba pojazdów w generowanym XML")
+    parser.add_argument("--xml-file", help="stała odpowiedź XML ({token} zastępowany tokenem)")
+    parser.add_argument("--max-tokens", type=int, default=16, help="trzymane tokeny, od których PUT zwraca bad_alloc")
+    parser.add_argument("--bad-alloc-rate", type=float, default=0.0, help="udział losowych błędów bad_alloc")
+    parser.add_argument("--token-ttl", type=float, default=30.0, help="wiek tokenu liczonego jako wyciek (s)")
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    xml_template = None
+    if args.xml_file:
+        with open(args.xml_file, encoding="utf-8") as f:
+            xml_template = f.read()
+
+    server = start_fake_ncshot(args.host, args.port, latency=args.latency, latency_jitter=args.latency_jitter,
+                               latency_per_mb=args.latency_per_mb, plate_latency=args.plate_latency,
+                               vehicles=args.vehicles, xml_template=xml_template, max_tokens=args.max_tokens,
+                               bad_alloc_rate=args.bad_alloc_rate, token_ttl=args.token_ttl, seed=args.seed)
+    logger.info(f"🧪 Zastępca NCShot nasłuchuje na http://{args.host}:{server.server_address[1]} "
+                f"(statystyki: GET /_stats)")
+    try:
+        while True:
+            time.sleep(10)
+            stats = server.state.get_stats()
+            logger.info(f"📊 obrazy={stats['images']} bad_alloc={stats['bad_alloc']} "
+                        f"tokeny={stats['outstanding_tokens']} wycieki={stats['leaked_tokens']}")
+    except KeyboardInterrupt:
+        server.shutdown()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
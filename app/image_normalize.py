@@ -0,0 +1,152 @@
+# app/image_normalize.py - normalizacja obrazów dla NCShot po stronie serwera (rozdzielczość, JPEG, bez EXIF)
+
+import io
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Tuple
+
+from app.result_cache import sha256_hex
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # Pillow opcjonalny - bez niego obrazy trafiają do NCShot bez zmian
+    Image = None
+
+logger = logging.getLogger(__name__)
+
+JPEG_SOI = b"\xff\xd8"
+
+
+def _has_metadata(data: bytes) -> bool:
+    """Czy JPEG ma segmenty APP1..APP15 (EXIF, XMP, ICC...) przed danymi obrazu"""
+    pos = 2
+    while pos + 4 <= len(data) and data[pos] == 0xFF:
+        marker = data[pos + 1]
+        if marker == 0xDA:  # początek skanu - koniec nagłówków
+            return False
+        if 0xE1 <= marker <= 0xEF:
+            return True
+        pos += 2 + int.from_bytes(data[pos + 2:pos + 4], "big")
+    return False
+
+
+class ImageNormalizer:
+    """
+    Sprowadza obrazy do postaci oczekiwanej przez NCShot: JPEG, dłuższy bok najwyżej `max_dim`
+    pikseli (0 = bez skalowania), orientacja z EXIF zastosowana, metadane usunięte.
+
+    `resize=False` zachowuje wymiary obrazu (np. gdy ROI są zapisane w pikselach pełnej
+    rozdzielczości kamery) - obraz jest wtedy tylko obracany i oczyszczany z metadanych.
+
+    Obraz, który już spełnia te warunki, jest zwracany bez ponownego kodowania (bez straty jakości).
+    Wyniki są trzymane w LRU kluczowanym SHA-256 treści wejściowej (limit `cache_bytes`),
+    a dekodowanie i skalowanie (Pillow zwalnia GIL) działa w puli `workers` wątków.
+    """
+
+    def __init__(self, max_dim: int = 2560, quality: int = 90, workers: int = 2, cache_bytes: int = 64 * 1024 * 1024):
+        self.max_dim = max_dim
+        self.quality = quality
+        self.cache_bytes = cache_bytes
+        self._executor = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="image-normalize")
+        self._lock = threading.Lock()
+        self._cache: "OrderedDict[str, bytes]" = OrderedDict()
+        self._cache_size = 0
+        self._stats = {"normalized": 0, "passthrough": 0, "resized": 0, "cache_hits": 0, "errors": 0,
+                       "bytes_in": 0, "bytes_out": 0}
+        if Image is None:
+            logger.warning("⚠ī¸ Brak Pillow - normalizacja obrazów dla NCShot wyłączona")
+
+    @property
+    def enabled(self) -> bool:
+        return Image is not None
+
+    # ----- normalizacja -----
+    def normalize(self, data: bytes, resize: bool = True) -> bytes:
+        """Normalizuje obraz w puli wątków (wywołanie blokuje do wyniku)"""
+        return self._executor.submit(self._normalize_cached, data, resize).result()
+
+    def normalize_many(self, images: List[bytes], resize: bool = True) -> List[bytes]:
+        """Normalizuje obrazy równolegle; kolejność wyników jak wejścia"""
+        return list(self._executor.map(self._normalize_cached, images, [resize] * len(images)))
+
+    def _normalize_cached(self, data: bytes, resize: bool = True) -> bytes:
+        if not self.enabled:
+            return data
+        key = sha256_hex(data) + ("" if resize else ":full")
+        with self._lock:
+            cached = self._cache.get(key)
+            if cached is not None:
+                self._cache.move_to_end(key)
+                self._stats["cache_hits"] += 1
+                return cached
+
+        try:
+            result, info = self._normalize(data, resize)
+        except Exception as e:
+            # Nieczytelny obraz zostaje bez zmian - odrzuci go walidacja albo NCShot
+            logger.warning(f"⚠ī¸ Nie udało się znormalizować obrazu ({len(data)} bajtów): {e}")
+            with self._lock:
+                self._stats["errors"] += 1
+            return data
+
+        with self._lock:
+            self._stats["normalized" if result is not data else "passthrough"] += 1
+            self._stats["resized"] += info["resized"]
+            self._stats["bytes_in"] += len(data)
+            self._stats["bytes_out"] += len(result)
+            if len(result) <= self.cache_bytes:
+                self._cache[key] = result
+                self._cache_size += len(result)
+                while self._cache_size > self.cache_bytes:
+                    _, evicted = self._cache.popitem(last=False)
+                    self._cache_size -= len(evicted)
+        if result is not data:
+            logger.info(f"🗜ī¸ Obraz znormalizowany: {info['size'][0]}x{info['size'][1]} -> "
+                        f"{info['out_size'][0]}x{info['out_size'][1]}, {len(data)} -> {len(result)} bajtów")
+        return result
+
+    def _normalize(self, data: bytes, resize: bool = True) -> Tuple[bytes, Dict[str, Any]]:
+        with Image.open(io.BytesIO(data)) as image:
+            size = image.size
+            target = self._target_size(size) if resize else size
+            is_jpeg = image.format == "JPEG" and data.startswith(JPEG_SOI)
+            rotated = image.getexif().get(0x0112, 1) not in (1, None)
+            if is_jpeg and target == size and not rotated and not _has_metadata(data):
+                return data, {"resized": False, "size": size, "out_size": size}
+
+            if target != size and is_jpeg:
+                # Dekodowanie JPEG od razu w zmniejszonej skali (DCT) - szybciej i mniej pamięci
+                image.draft("RGB", target)
+            image = ImageOps.exif_transpose(image)
+            # Wymiary po obrocie z EXIF (np. 90°) - limit liczony od dłuższego boku jak wyżej
+            target = self._target_size(image.size) if resize else image.size
+            if image.mode != "RGB":
+                image = image.convert("RGB")
+            if image.size != target:
+                image = image.resize(target, Image.LANCZOS)
+
+            out = io.BytesIO()
+            # Bez exif=/icc_profile= - zapis JPEG bez metadanych
+            image.save(out, format="JPEG", quality=self.quality)
+            return out.getvalue(), {"resized": max(image.size) < max(size), "size": size, "out_size": image.size}
+
+    def _target_size(self, size: Tuple[int, int]) -> Tuple[int, int]:
+        width, height = size
+        longest = max(width, height)
+        if not self.max_dim or longest <= self.max_dim:
+            return size
+        scale = self.max_dim / longest
+        return max(1, round(width * scale)), max(1, round(height * scale))
+
+    # ----- stan -----
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._stats)
+            stats.update({"enabled": self.enabled, "max_dim": self.max_dim, "quality": self.quality,
+                          "cache_entries": len(self._cache), "cache_bytes": self._cache_size})
+        return stats
+
+    def shutdown(self) -> None:
+        self._executor.shutdown(wait=False, cancel_futures=True)
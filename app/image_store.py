@@ -0,0 +1,193 @@
+# app/image_store.py - magazyn obrazów galerii po stronie serwera (adresowany treścią)
+
+import json
+import logging
+import os
+import re
+import tempfile
+import threading
+import time
+from collections import Counter
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional
+
+from app.result_cache import sha256_hex
+
+logger = logging.getLogger(__name__)
+
+IMAGE_ID_RE = re.compile(r"^[0-9a-f]{64}$")
+
+
+class ImageStore:
+    """
+    Obrazy galerii zapisane na dysku pod identyfikatorem = SHA-256 treści.
+
+    Każdy obraz to `<id[:2]>/<id>.jpg` z metadanymi w `<id>.json` (nazwa pliku, źródło,
+    rozmiar, czasy). Indeks w pamięci jest odtwarzany ze sidecarów przy starcie i przy
+    chybieniu, więc obrazy zapisane przez inne workery uvicorn też są widoczne.
+    Po przekroczeniu `max_bytes` usuwane są najdawniej używane obrazy, z pominięciem obrazów
+    przypiętych (`pin`) przez wsady i zadania NCShot, które jeszcze ich nie przetworzyły.
+    """
+
+    def __init__(self, directory: str, max_bytes: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._index: Dict[str, Dict[str, Any]] = {}
+        self._pins = Counter()
+        self._stats = {"stored": 0, "deduplicated": 0, "evictions": 0}
+        os.makedirs(directory, exist_ok=True)
+        self._scan()
+
+    @staticmethod
+    def is_valid_id(image_id: str) -> bool:
+        return bool(IMAGE_ID_RE.match(image_id or ""))
+
+    def _image_path(self, image_id: str) -> Path:
+        return Path(self.directory) / image_id[:2] / f"{image_id}.jpg"
+
+    def _meta_path(self, image_id: str) -> Path:
+        return Path(self.directory) / image_id[:2] / f"{image_id}.json"
+
+    def _scan(self) -> None:
+        for meta_path in Path(self.directory).glob("*/*.json"):
+            meta = self._load_meta(meta_path.stem)
+            if meta:
+                self._index[meta["id"]] = meta
+        logger.info(f"🖼ī¸ Magazyn obrazów: {len(self._index)} obrazów w {self.directory}")
+
+    def _load_meta(self, image_id: str) -> Optional[Dict[str, Any]]:
+        try:
+            with open(self._meta_path(image_id), encoding="utf-8") as f:
+                meta = json.load(f)
+            if not self._image_path(image_id).is_file():
+                return None
+            return meta
+        except (OSError, ValueError):
+            return None
+
+    def _write_meta(self, meta: Dict[str, Any]) -> None:
+        path = self._meta_path(meta["id"])
+        fd, tmp_path = tempfile.mkstemp(prefix=".tmp-", dir=path.parent)
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(meta, f)
+        os.replace(tmp_path, path)
+
+    # ----- zapis / odczyt -----
+    def put(self, data: bytes, filename: str, source: str = "disk", **extra: Any) -> Dict[str, Any]:
+        """Zapisuje obraz (lub zwraca istniejący o tej samej treści); zwraca metadane z `id`"""
+        image_id = sha256_hex(data)
+        existing = self.get_meta(image_id)
+        if existing:
+            with self._lock:
+                self._stats["deduplicated"] += 1
+            return existing
+
+        path = self._image_path(image_id)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(prefix=".tmp-", dir=path.parent)
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+        now = time.time()
+        meta = dict(extra, id=image_id, filename=filename, source=source, size=len(data),
+                    created_at=now, last_used=now)
+        self._write_meta(meta)
+        with self._lock:
+            self._index[image_id] = meta
+            self._stats["stored"] += 1
+        self._evict(keep=image_id)
+        return meta
+
+    def get_meta(self, image_id: str) -> Optional[Dict[str, Any]]:
+        if not self.is_valid_id(image_id):
+            return None
+        with self._lock:
+            meta = self._index.get(image_id)
+        if meta is None:
+            # Mógł zostać zapisany przez inny worker
+            meta = self._load_meta(image_id)
+            if meta:
+                with self._lock:
+                    self._index[image_id] = meta
+        return meta
+
+    def get_path(self, image_id: str) -> Optional[Path]:
+        """Ścieżka pliku obrazu (oznacza obraz jako użyty) albo None, gdy nie istnieje"""
+        meta = self.get_meta(image_id)
+        if not meta:
+            return None
+        path = self._image_path(image_id)
+        if not path.is_file():
+            self._forget(image_id)
+            return None
+        meta["last_used"] = time.time()
+        return path
+
+    def pin(self, image_id: str) -> Optional[Path]:
+        """
+        Jak `get_path`, ale chroni obraz przed eksmisją do `unpin` (wywołań może być wiele -
+        licznik odwołań); None, gdy obraz nie istnieje (wtedy nic nie zostaje przypięte)
+        """
+        with self._lock:
+            self._pins[image_id] += 1
+        path = self.get_path(image_id)
+        if path is None:
+            self.unpin([image_id])
+        return path
+
+    def unpin(self, image_ids: Iterable[str]) -> None:
+        with self._lock:
+            for image_id in image_ids:
+                self._pins[image_id] -= 1
+                if self._pins[image_id] <= 0:
+                    del self._pins[image_id]
+
+    def list_images(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            images = [dict(meta) for meta in self._index.values()]
+        return sorted(images, key=lambda meta: meta["created_at"])
+
+    def delete(self, image_id: str) -> bool:
+        if not self.get_meta(image_id):
+            return False
+        self._forget(image_id)
+        return True
+
+    def _forget(self, image_id: str) -> None:
+        with self._lock:
+            self._index.pop(image_id, None)
+        for path in (self._image_path(image_id), self._meta_path(image_id)):
+            try:
+                path.unlink()
+            except FileNotFoundError:
+                pass
+
+    # ----- eksmisja -----
+    def _evict(self, keep: str) -> None:
+        with self._lock:
+            total = sum(meta["size"] for meta in self._index.values())
+            if total <= self.max_bytes:
+                return
+            victims = []
+            for image_id, meta in sorted(self._index.items(), key=lambda kv: kv[1]["last_used"]):
+                if total <= self.max_bytes:
+                    break
+                if image_id == keep or image_id in self._pins:
+                    continue
+                victims.append(image_id)
+                total -= meta["size"]
+        for image_id in victims:
+            self._forget(image_id)
+            with self._lock:
+                self._stats["evictions"] += 1
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._stats)
+            stats["images"] = len(self._index)
+            stats["pinned"] = len(self._pins)
+            stats["size_bytes"] = sum(meta["size"] for meta in self._index.values())
+        stats.update({"directory": self.directory, "max_bytes": self.max_bytes})
+        return stats
@@ -0,0 +1,165 @@
+# app/log_setup.py - nieblokujące logowanie (kolejka + wątek zapisu), rekordy JSON, id korelacji
+
+import contextvars
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import threading
+import uuid
+from datetime import datetime
+from typing import Any, Dict, Optional
+
+# Id korelacji bieżącego żądania HTTP / zadania NCShot (dziedziczone przez copy_context())
+correlation_id: contextvars.ContextVar[str] = contextvars.ContextVar("correlation_id", default="-")
+
+# Standardowe atrybuty LogRecord - wszystko inne to pola z `extra=` dołączane do JSON
+_RECORD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime"}
+
+_listener: Optional[logging.handlers.QueueListener] = None
+
+
+def new_correlation_id() -> str:
+    return uuid.uuid4().hex[:12]
+
+
+def bind_correlation_id(value: Optional[str] = None) -> contextvars.Token:
+    """Ustawia id korelacji w bieżącym kontekście; zwraca token do `correlation_id.reset()`"""
+    return correlation_id.set(value or new_correlation_id())
+
+
+class ContextFilter(logging.Filter):
+    """Dopisuje do rekordu id korelacji i kategorię (w wątku, który loguje)"""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.correlation_id = correlation_id.get()
+        if not hasattr(record, "category"):
+            record.category = "app"
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Przepuszcza co n-ty rekord DEBUG/INFO z kategorii o ustawionym próbkowaniu
+    (np. {"ssh": 0.2} = co piąty). Ostrzeżenia i błędy nie są nigdy próbkowane.
+    """
+
+    def __init__(self, rates: Dict[str, float]):
+        super().__init__()
+        self.every = {category: max(1, round(1 / rate)) for category, rate in rates.items() if rate > 0}
+        self.muted = {category for category, rate in rates.items() if rate <= 0}
+        self._counters: Dict[str, int] = {}
+        self._dropped: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING:
+            return True
+        category = getattr(record, "category", "app")
+        if category not in self.every and category not in self.muted:
+            return True
+        with self._lock:
+            count = self._counters.get(category, 0)
+            self._counters[category] = count + 1
+            keep = category not in self.muted and count % self.every[category] == 0
+            if not keep:
+                self._dropped[category] = self._dropped.get(category, 0) + 1
+        return keep
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"seen": dict(self._counters), "dropped": dict(self._dropped)}
+
+
+class JsonFormatter(logging.Formatter):
+    """Jeden rekord = jedna linia JSON (pola `extra=` trafiają do rekordu)"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.fromtimestamp(record.created).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "category": getattr(record, "category", "app"),
+            "correlation_id": getattr(record, "correlation_id", "-"),
+            "thread": record.threadName,
+            "msg": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRS and key not in entry:
+                entry[key] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Formatowanie wiadomości w wątku logującym (argumenty mogą się zmienić),
+        # ale bez kopiowania rekordu i bez kosztu formatterów - te działają w wątku zapisu
+        record.msg = record.getMessage()
+        record.args = None
+        record.exc_text = logging.Formatter().formatException(record.exc_info) if record.exc_info else None
+        record.exc_info = None
+        return record
+
+
+def parse_sampling(spec: str) -> Dict[str, float]:
+    """Parsuje próbkowanie kategorii w formacie `kategoria=udział,...`, np. `ssh=0.2,batch=0.25`"""
+    rates = {}
+    for item in (part.strip() for part in (spec or "").split(",")):
+        if not item:
+            continue
+        category, _, rate = item.partition("=")
+        rates[category.strip()] = float(rate) if rate else 1.0
+    return rates
+
+
+def setup_logging(level: str = "DEBUG", log_file: str = "ncpyvisual.log", max_bytes: int = 20 * 1024 * 1024,
+                  backup_count: int = 5, json_console: bool = False,
+                  sampling: Optional[Dict[str, float]] = None) -> SamplingFilter:
+    """
+    Konfiguruje logger główny: wywołania logowania tylko wkładają rekord do kolejki,
+    a zapis na konsolę i do rotowanego pliku JSON wykonuje wątek QueueListener.
+    Zwraca filtr próbkowania (statystyki do /health/).
+    """
+    global _listener
+    shutdown_logging()
+
+    console = logging.StreamHandler()
+    console.setFormatter(JsonFormatter() if json_console else logging.Formatter(
+        "%(asctime)s - %(levelname)s - [%(correlation_id)s] %(message)s"))
+    handlers = [console]
+    if log_file:
+        directory = os.path.dirname(log_file)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        file_handler = logging.handlers.RotatingFileHandler(log_file, maxBytes=max_bytes,
+                                                            backupCount=backup_count, encoding="utf-8")
+        file_handler.setFormatter(JsonFormatter())
+        handlers.append(file_handler)
+
+    sampler = SamplingFilter(sampling or {})
+    queue_handler = _QueueHandler(queue.SimpleQueue())
+    queue_handler.addFilter(ContextFilter())
+    queue_handler.addFilter(sampler)
+
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    root.setLevel(level)
+
+    _listener = logging.handlers.QueueListener(queue_handler.queue, *handlers, respect_handler_level=True)
+    _listener.start()
+    return sampler
+
+
+def shutdown_logging() -> None:
+    """Zatrzymuje wątek zapisu po opróżnieniu kolejki (wywoływane przy zamykaniu aplikacji)"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
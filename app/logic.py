@@ -1,192 +1,561 @@
 # app/logic.py - ULEPSZONA WERSJA z najlepszymi elementami ze starszej aplikacji
 
 import xml.etree.ElementTree as ET
+import io
+import itertools
 import json
 import logging
+import os
 import re
+import threading
+import time
 import traceback
-from typing import Dict, Any, List, Optional, Tuple
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from typing import Dict, Any, Iterable, Iterator, List, NamedTuple, Optional, Tuple
 from datetime import datetime
 
+try:
+    from lxml import etree as lxml_etree
+except ImportError:  # lxml opcjonalny - parser stdlib daje ten sam wynik
+    lxml_etree = None
+
 logger = logging.getLogger(__name__)
 
-def safe_float_parse(value: str, default: float = 0.0) -> float:
-    """Bezpieczne parsowanie float z domyślną wartością"""
+# ===== ANOMALIE PARSOWANIA =====
+# Niesparsowane pola są liczone per parsowanie (result["metadata"]["anomalies"]) zamiast
+# logowania każdej wartości - przy zaszumionych XML formatowanie logów dominowało czas parsowania.
+
+class RateLimitedLog:
+    """Przepuszcza co najwyżej jeden komunikat na klucz w oknie `interval` sekund (0 = każdy)"""
+
+    __slots__ = ("interval", "_last", "_suppressed", "_lock")
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self._last: Dict[str, float] = {}
+        self._suppressed: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def allow(self, key: str) -> Optional[int]:
+        """Zwraca liczbę pominiętych od ostatniego logu komunikatów albo None, gdy log jest wstrzymany"""
+        if self.interval <= 0:
+            return 0
+        now = time.monotonic()
+        with self._lock:
+            if now - self._last.get(key, -self.interval) < self.interval:
+                self._suppressed[key] = self._suppressed.get(key, 0) + 1
+                return None
+            self._last[key] = now
+            return self._suppressed.pop(key, 0)
+
+_anomaly_log = RateLimitedLog(interval=60.0)
+
+def set_anomaly_log_interval(seconds: float) -> None:
+    """Okno ograniczania logów anomalii (liczone od nowa); 0 = loguj każdą niesparsowaną wartość (jak dawniej)"""
+    with _anomaly_log._lock:
+        _anomaly_log.interval = seconds
+        _anomaly_log._last.clear()
+        _anomaly_log._suppressed.clear()
+
+def get_anomaly_log_interval() -> float:
+    return _anomaly_log.interval
+
+class ParseAnomalies:
+    """Liczniki niesparsowanych pól jednego dokumentu NCShot (z kilkoma przykładami wartości)"""
+
+    __slots__ = ("total", "fields", "samples")
+
+    MAX_SAMPLES = 5
+
+    def __init__(self):
+        self.total = 0
+        self.fields: Dict[str, int] = {}
+        self.samples: List[Dict[str, str]] = []
+
+    def record(self, kind: str, field: str, value: Any, default: Any) -> None:
+        self.total += 1
+        self.fields[field] = self.fields.get(field, 0) + 1
+        if len(self.samples) < self.MAX_SAMPLES:
+            self.samples.append({"field": field, "type": kind, "value": str(value)[:40]})
+        if _anomaly_log.interval <= 0:
+            logger.warning(f"Nie można sparsować jako {kind}: {value}, używam domyślnej: {default}")
+
+    def log_summary(self) -> None:
+        if not self.total:
+            return
+        suppressed = _anomaly_log.allow("document")
+        if suppressed is not None and _anomaly_log.interval > 0:
+            more = f" (+{suppressed} dokumentów z anomaliami bez logu)" if suppressed else ""
+            logger.warning(f"⚠ī¸ Niesparsowane pola w odpowiedzi NCShot: {self.fields}{more}")
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"bad_fields": self.total, "fields": dict(self.fields), "samples": list(self.samples)}
+
+def _report_bad_value(kind: str, field: str, value: Any, default: Any,
+                      anomalies: Optional[ParseAnomalies]) -> None:
+    if anomalies is not None:
+        anomalies.record(kind, field, value, default)
+        return
+    suppressed = _anomaly_log.allow(kind)
+    if suppressed is not None:
+        more = f" (+{suppressed} pominiętych)" if suppressed else ""
+        logger.warning(f"Nie można sparsować jako {kind}: {value}, używam domyślnej: {default}{more}")
+
+def safe_float_parse(value: str, default: float = 0.0, field: str = "",
+                     anomalies: Optional[ParseAnomalies] = None) -> float:
+    """Bezpieczne parsowanie float z domyślną wartością (błędy liczone w `anomalies`)"""
     try:
         return float(value) if value else default
     except (ValueError, TypeError):
-        logger.warning(f"Nie można sparsować jako float: {value}, używam domyślnej: {default}")
+        _report_bad_value("float", field, value, default, anomalies)
         return default
 
-def safe_int_parse(value: str, default: int = 0) -> int:
-    """Bezpieczne parsowanie int z domyślną wartością"""
+def safe_int_parse(value: str, default: int = 0, field: str = "",
+                   anomalies: Optional[ParseAnomalies] = None) -> int:
+    """Bezpieczne parsowanie int z domyślną wartością (błędy liczone w `anomalies`)"""
     try:
         return int(value) if value else default
     except (ValueError, TypeError):
-        logger.warning(f"Nie można sparsować jako int: {value}, używam domyślnej: {default}")
+        _report_bad_value("int", field, value, default, anomalies)
         return default
 
-def process_ncshot_result_xml_enhanced(xml_content: str) -> Dict[str, Any]:
+def debug_xml_structure(xml_content: str, root: Optional[ET.Element] = None) -> None:
     """
-    Rozszerzony parser XML z NCShot - zgodny ze starą aplikacją
+    Debuguje strukturę XML dla lepszego zrozumienia danych z NCShot
+    (`root` - już sparsowany dokument, żeby nie parsować XML ponownie)
+    """
+    try:
+        if root is None:
+            root = ET.fromstring(xml_content)
+        logger.info("🔍 === DEBUGOWANIE STRUKTURY XML ===")
+        logger.info(f"📄 Długość XML: {len(xml_content)} znaków")
+        logger.info(f"📋 Root element: {root.tag}")
+
+        def log_element(element, level=0):
+            indent = "  " * level
+            attrs = f" {element.attrib}" if element.attrib else ""
+            text = f" = '{element.text.strip()}'" if element.text and element.text.strip() else ""
+            logger.info(f"{indent}📋 {element.tag}{attrs}{text}")
+
+            for child in element:
+                log_element(child, level + 1)
+
+        log_element(root)
+
+        # DODATKOWE - sprawdź czy są jakiekolwiek elementy z tekstem
+        logger.info("🔍 === SZUKANIE TEKSTU W XML ===")
+        all_texts = []
+        for elem in root.iter():
+            if elem.text and elem.text.strip():
+                all_texts.append(f"{elem.tag}: {elem.text.strip()}")
+
+        logger.info(f"🔍 Znalezione teksty ({len(all_texts)}):")
+        for text in all_texts:
+            logger.info(f"  📄 {text}")
+
+        # Szukaj wszystkich wartości w elementach value
+        logger.info("🔍 === WSZYSTKIE ELEMENTY VALUE ===")
+        value_elements = root.findall(".//value")
+        for i, value in enumerate(value_elements):
+            name_attr = value.get("name", "no-name")
+            text_content = value.text if value.text else "no-text"
+            logger.info(f"  🔍 Value {i+1}: name='{name_attr}' text='{text_content}'")
+
+        logger.info("🔍 === KONIEC DEBUGOWANIA XML ===")
+
+    except Exception as e:
+        logger.error(f"⚠ī¸ Błąd debugowania XML: {e}")
+        # Zapisz surowy XML do logów
+        logger.error(f"📄 Surowy XML (pierwsze 1000 znaków): {xml_content[:1000]}")
+
+# ===== REKORDY WYNIKU NCSHOT =====
+# Kompaktowe obiekty ze __slots__ zamiast zagnieżdżonych słowników - klucze nie są powtarzane
+# w każdej tablicy wsadu, a słownikowa projekcja JSON powstaje dopiero przy serializacji.
+
+class PlateVariant:
+    """Wariant rozpoznania tablicy (<data name="plate...">)"""
+
+    __slots__ = ("country", "symbol", "level", "position", "prefix", "type", "doubleline",
+                 "source", "data_name", "confidence")
+
+    def __init__(self, data_values: Dict[str, str], source: str, data_name: str,
+                 anomalies: Optional[ParseAnomalies] = None):
+        self.country = data_values.get("country", "").strip()
+        self.symbol = data_values.get("symbol", "").strip()
+        self.level = safe_float_parse(data_values.get("level", "0"), field="plate.level", anomalies=anomalies)
+        self.position = data_values.get("position", "").strip()
+        self.prefix = data_values.get("prefix", "").strip()
+        self.type = data_values.get("type", "").strip()
+        self.doubleline = safe_int_parse(data_values.get("doubleline", "0"), field="plate.doubleline",
+                                         anomalies=anomalies)
+        self.source = source
+        self.data_name = data_name
+        self.confidence = self.level / 100.0
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {name: getattr(self, name) for name in PlateVariant.__slots__}
+
+
+class VehicleInfo:
+    """Dane pojazdu z MMR (<data name="vehicle">)"""
+
+    __slots__ = ("direction", "speed", "estimated_speed", "type", "manufacturer", "model", "color",
+                 "mmr_pattern_index", "mmr_pattern_divergence", "source", "confidence")
+
+    def __init__(self, data_values: Dict[str, str], source: str, anomalies: Optional[ParseAnomalies] = None):
+        self.direction = safe_int_parse(data_values.get("direction", "0"), field="vehicle.direction",
+                                        anomalies=anomalies)
+        self.speed = safe_float_parse(data_values.get("speed", "0"), field="vehicle.speed", anomalies=anomalies)
+        self.estimated_speed = safe_float_parse(data_values.get("estimatedspeed", "0"),
+                                                field="vehicle.estimatedspeed", anomalies=anomalies)
+        self.type = data_values.get("type", "").strip()
+        self.manufacturer = data_values.get("manufacturer", "").strip()
+        self.model = data_values.get("model", "").strip()
+        self.color = data_values.get("color", "").strip()
+        self.mmr_pattern_index = safe_int_parse(data_values.get("mmrpatternindex", "0"),
+                                                field="vehicle.mmrpatternindex", anomalies=anomalies)
+        self.mmr_pattern_divergence = safe_float_parse(data_values.get("mmrpatterndivergence", "0"),
+                                                       field="vehicle.mmrpatterndivergence", anomalies=anomalies)
+        self.source = source
+        # Oblicz confidence na podstawie divergence
+        divergence = self.mmr_pattern_divergence
+        self.confidence = max(0.1, 1.0 / (1.0 + divergence)) if divergence > 0 else 0.8
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {name: getattr(self, name) for name in VehicleInfo.__slots__}
+
+
+class NcshotVehicle:
+    """Pojazd z jednego <exdata>: warianty tablic, dane MMR, parametry i sygnatura"""
+
+    __slots__ = ("exdata_index", "plates", "vehicle_info", "parameters", "signature")
+
+    def __init__(self, exdata_index: int):
+        self.exdata_index = exdata_index
+        self.plates: List[PlateVariant] = []  # Lista wariantów tablic dla tego pojazdu
+        self.vehicle_info: Optional[VehicleInfo] = None
+        self.parameters: Dict[str, str] = {}
+        self.signature: Optional[str] = None
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "exdata_index": self.exdata_index,
+            "plates": [plate.to_dict() for plate in self.plates],
+            "vehicle_info": self.vehicle_info.to_dict() if self.vehicle_info else {},
+            "parameters": self.parameters,
+            "signature": self.signature
+        }
+
+
+class DetailedPlate:
+    """
+    Tablica z danymi pojazdu - widok na PlateVariant i NcshotVehicle bez kopiowania pól;
+    `with_image()` dokłada obraz tablicy (detailed_plates_with_images).
     """
-    result = {
-        "plates": [],
-        "vehicles": [],
-        "timestamp": None,
-        "processing_parameters": {},
-        "radar_data": {},
-        "signature": None,
-        "processing_successful": False,
-        "error": None,
-        "metadata": {
+
+    __slots__ = ("plate", "vehicle", "plate_image", "has_image")
+
+    def __init__(self, plate: PlateVariant, vehicle: NcshotVehicle,
+                 plate_image: Optional[str] = None, has_image: Optional[bool] = None):
+        self.plate = plate
+        self.vehicle = vehicle
+        self.plate_image = plate_image
+        self.has_image = has_image
+
+    def with_image(self, plate_image: Optional[str]) -> "DetailedPlate":
+        return DetailedPlate(self.plate, self.vehicle, plate_image, bool(plate_image))
+
+    def to_dict(self) -> Dict[str, Any]:
+        data = self.plate.to_dict()
+        info = self.vehicle.vehicle_info
+        if info:
+            data.update({
+                "vehicle_manufacturer": info.manufacturer,
+                "vehicle_model": info.model,
+                "vehicle_color": info.color,
+                "vehicle_type": info.type,
+                "vehicle_speed": info.speed,
+                "mmr_divergence": info.mmr_pattern_divergence
+            })
+        data["exdata_index"] = self.vehicle.exdata_index
+        if self.has_image is not None:
+            data["plate_image"] = self.plate_image
+            data["has_image"] = self.has_image
+        return data
+
+
+class NcshotResult:
+    """
+    Wynik parsowania odpowiedzi NCShot. Podsumowanie i słownikowa projekcja JSON
+    (`to_dict()`, kształt zgodny z dotychczasowym wynikiem) są liczone leniwie raz.
+    """
+
+    __slots__ = ("plates", "vehicles", "timestamp", "radar_data", "signature", "processing_successful",
+                 "error", "error_details", "metadata", "exdata_count", "_summary", "_json")
+
+    def __init__(self, xml_length: int):
+        self.plates: List[PlateVariant] = []
+        self.vehicles: List[NcshotVehicle] = []
+        self.timestamp: Optional[Dict[str, str]] = None
+        self.radar_data: Dict[str, str] = {}
+        self.signature: Optional[str] = None
+        self.processing_successful = False
+        self.error: Optional[str] = None
+        self.error_details: Optional[Dict[str, Any]] = None
+        self.metadata = {
             "processed_at": datetime.now().isoformat(),
-            "xml_length": len(xml_content),
+            "xml_length": xml_length,
             "parser_version": "3.2.0-enhanced"
         }
-    }
+        self.exdata_count: Optional[int] = None  # None = dokument nie został sparsowany
+        self._summary = None
+        self._json = None
+
+    @property
+    def summary(self) -> Optional[Dict[str, Any]]:
+        """Szczegółowe podsumowanie - jak w starej aplikacji (brak przy błędzie parsowania)"""
+        if self._summary is None and self.exdata_count is not None:
+            self._summary = {
+                "plates_detected": len(self.plates),
+                "vehicles_detected": len(self.vehicles),
+                "has_signature": bool(self.signature),
+                "has_timestamp": bool(self.timestamp),
+                "has_radar_data": bool(self.radar_data),
+                "processing_successful": self.processing_successful,
+                "best_plate_confidence": max((p.confidence for p in self.plates), default=0.0),
+                "plate_variants_total": sum(len(v.plates) for v in self.vehicles),
+                "exdata_count": self.exdata_count
+            }
+        return self._summary
+
+    def to_dict(self) -> Dict[str, Any]:
+        if self._json is None:
+            result = {
+                "plates": [plate.to_dict() for plate in self.plates],
+                "vehicles": [vehicle.to_dict() for vehicle in self.vehicles],
+                "timestamp": self.timestamp,
+                "processing_parameters": {},
+                "radar_data": self.radar_data,
+                "signature": self.signature,
+                "processing_successful": self.processing_successful,
+                "error": self.error,
+                "metadata": self.metadata
+            }
+            if self.error_details is not None:
+                result["error_details"] = self.error_details
+            if self.summary is not None:
+                result["summary"] = self.summary
+            self._json = result
+        return self._json
+
+# ===== BACKENDY PARSERA XML =====
+# Czytnik zwraca neutralną strukturę dokumentu, z której wspólny kod buduje wynik -
+# dzięki temu oba backendy dają identyczny wynik (sprawdzane przez `python -m app.xml_tools parity`
+# i tests/test_xml_parity.py).
+
+class NcshotXmlDocument(NamedTuple):
+    root_tag: str
+    timestamp: Optional[Tuple[Optional[str], Optional[str], Optional[str]]]  # teksty date/time/ms
+    exdata: List[List[Tuple[str, str, Dict[str, str]]]]  # [(name, source, wartości) dla każdego <data>]
+
+XML_PARSE_ERRORS: Tuple[type, ...] = (ET.ParseError,)
+if lxml_etree is not None:
+    XML_PARSE_ERRORS += (lxml_etree.XMLSyntaxError,)
+
+_XML_DECLARED_ENCODING_RE = re.compile(r"""^\s*<\?xml[^>]*encoding=["']([^"']+)["']""")
+
+def _data_values(data_elem) -> Dict[str, str]:
+    """Wartości <value name="..."> bezpośrednio w elemencie <data>"""
+    data_values = {}
+    for value_elem in data_elem.findall("value"):
+        value_name = value_elem.get("name", "").strip()
+        value_text = value_elem.text.strip() if value_elem.text else ""
+        if value_name:
+            data_values[value_name] = value_text
+    return data_values
+
+def _timestamp_texts(timestamp_elem) -> Tuple[Optional[str], Optional[str], Optional[str]]:
+    texts = []
+    for tag in ("date", "time", "ms"):
+        elem = timestamp_elem.find(tag)
+        texts.append(elem.text if elem is not None else None)
+    return tuple(texts)
+
+def read_ncshot_xml_etree(xml_content: str, root: Optional[ET.Element] = None) -> NcshotXmlDocument:
+    """Backend stdlib: cały dokument w pamięci (xml.etree.ElementTree)"""
+    if root is None:
+        root = ET.fromstring(xml_content)
+    timestamp_elem = root.find("timestamp")
+    exdata = [
+        [(data_elem.get("name", "").strip(), data_elem.get("source", "").strip(), _data_values(data_elem))
+         for data_elem in exdata_elem.findall("data")]
+        for exdata_elem in root.findall("exdata")
+    ]
+    return NcshotXmlDocument(root.tag, _timestamp_texts(timestamp_elem) if timestamp_elem is not None else None, exdata)
+
+def read_ncshot_xml_lxml(xml_content: str) -> NcshotXmlDocument:
+    """
+    Backend lxml: strumieniowy iterparse - każdy <exdata> jest odczytywany po zamknięciu
+    i od razu czyszczony, więc w pamięci nie rośnie całe drzewo dokumentu.
+    """
+    source = xml_content.encode("utf-8") if isinstance(xml_content, str) else xml_content
+    timestamp = None
+    exdata = []
+    context = lxml_etree.iterparse(io.BytesIO(source), events=("end",), tag=("exdata", "timestamp"),
+                                   remove_comments=True, remove_pis=True, resolve_entities=False)
+    for _, elem in context:
+        parent = elem.getparent()
+        # Tylko bezpośrednie dzieci korzenia (jak root.findall()); zagnieżdżone zostają w drzewie rodzica
+        if parent is None or parent.getparent() is not None:
+            continue
+        if elem.tag == "exdata":
+            exdata.append([(data_elem.get("name", "").strip(), data_elem.get("source", "").strip(),
+                            _data_values(data_elem))
+                           for data_elem in elem.findall("data")])
+        elif timestamp is None:
+            timestamp = _timestamp_texts(elem)
+        elem.clear()
+        while elem.getprevious() is not None:
+            del parent[0]
+    root_tag = context.root.tag
+    return NcshotXmlDocument(root_tag, timestamp, exdata)
+
+_XML_BACKENDS = {"stdlib": read_ncshot_xml_etree}
+if lxml_etree is not None:
+    _XML_BACKENDS["lxml"] = read_ncshot_xml_lxml
+
+# "auto": typowe odpowiedzi NCShot (kilka-kilkadziesiąt KB) szybciej parsuje stdlib,
+# strumieniowe lxml opłaca się dopiero przy dużych dokumentach (mniejsze zużycie pamięci)
+_xml_backend = "auto"
+_xml_stream_threshold = 1024 * 1024
+
+def set_xml_parser_backend(name: str, stream_threshold: Optional[int] = None) -> str:
+    """
+    Wybiera backend parsera: "lxml", "stdlib" albo "auto" (lxml dla dokumentów
+    większych niż `stream_threshold` bajtów). Zwraca faktycznie ustawiony backend.
+    """
+    global _xml_backend, _xml_stream_threshold
+    if name not in _XML_BACKENDS and name != "auto":
+        logger.warning(f"⚠ī¸ Backend parsera XML '{name}' niedostępny - używam stdlib")
+        name = "stdlib"
+    _xml_backend = name
+    if stream_threshold is not None:
+        _xml_stream_threshold = stream_threshold
+    return name
+
+def get_xml_parser_backend() -> str:
+    return _xml_backend
+
+def available_xml_parser_backends() -> List[str]:
+    return sorted(_XML_BACKENDS)
+
+def read_ncshot_xml(xml_content: str, backend: Optional[str] = None) -> NcshotXmlDocument:
+    backend = backend or _xml_backend
+    if backend == "auto":
+        backend = "lxml" if "lxml" in _XML_BACKENDS and len(xml_content) > _xml_stream_threshold else "stdlib"
+    if backend == "lxml":
+        # Zadeklarowane kodowanie inne niż UTF-8 dotyczy oryginalnych bajtów, nie napisu
+        declared = _XML_DECLARED_ENCODING_RE.match(xml_content)
+        if declared and declared.group(1).lower().replace("_", "-") not in ("utf-8", "utf8"):
+            backend = "stdlib"
+    return _XML_BACKENDS[backend](xml_content)
+
+def parse_ncshot_result(xml_content: str, debug: bool = False, backend: Optional[str] = None) -> NcshotResult:
+    """
+    Rozszerzony parser XML z NCShot - zgodny ze starą aplikacją
+
+    Jedyne miejsce parsowania odpowiedzi NCShot: szczegółowe tablice
+    (`extract_detailed_plates`) i podsumowanie tekstowe (`format_ncshot_summary_enhanced`)
+    są wyliczane z tego wyniku bez ponownego parsowania XML.
+    `debug=True` dodatkowo loguje strukturę dokumentu (jak /debug-xml/).
+    `backend` wymusza backend parsera ("lxml"/"stdlib"/"auto"), domyślnie set_xml_parser_backend().
+    """
+    result = NcshotResult(len(xml_content))
+    anomalies = ParseAnomalies()
 
     try:
         if not xml_content or not xml_content.strip():
-            result["error"] = "Pusta zawartość XML"
+            result.error = "Pusta zawartość XML"
             return result
 
-        root = ET.fromstring(xml_content)
-        result["metadata"]["root_tag"] = root.tag
+        if debug:
+            # Debugowanie potrzebuje całego drzewa - zawsze stdlib
+            root = ET.fromstring(xml_content)
+            debug_xml_structure(xml_content, root)
+            document = read_ncshot_xml_etree(xml_content, root)
+        else:
+            document = read_ncshot_xml(xml_content, backend)
+        result.metadata["root_tag"] = document.root_tag
 
         # Parsuj timestamp - jak w starej aplikacji
-        timestamp_elem = root.find("timestamp")
-        if timestamp_elem is not None:
+        if document.timestamp is not None:
             try:
-                date_elem = timestamp_elem.find("date")
-                time_elem = timestamp_elem.find("time")
-                ms_elem = timestamp_elem.find("ms")
-
-                if all(e is not None and e.text for e in [date_elem, time_elem, ms_elem]):
-                    result["timestamp"] = {
-                        "date": date_elem.text.strip(),
-                        "time": time_elem.text.strip(),
-                        "ms": ms_elem.text.strip()
+                if all(document.timestamp):
+                    date_text, time_text, ms_text = document.timestamp
+                    result.timestamp = {
+                        "date": date_text.strip(),
+                        "time": time_text.strip(),
+                        "ms": ms_text.strip()
                     }
             except Exception as e:
                 logger.warning(f"Błąd parsowania timestamp: {e}")
 
         # Parsuj exdata - DOKŁADNIE jak w starej aplikacji
-        exdata_elements = root.findall("exdata")
-        result["metadata"]["exdata_count"] = len(exdata_elements)
-
-        for exdata_idx, exdata_elem in enumerate(exdata_elements):
-            vehicle_data = {
-                "exdata_index": exdata_idx,
-                "plates": [],  # Lista wariantów płytek dla tego pojazdu
-                "vehicle_info": {},
-                "parameters": {},
-                "signature": None
-            }
+        result.metadata["exdata_count"] = len(document.exdata)
 
-            for data_elem in exdata_elem.findall("data"):
+        for exdata_idx, data_items in enumerate(document.exdata):
+            vehicle = NcshotVehicle(exdata_idx)
+
+            for data_name, data_source, data_values in data_items:
                 try:
-                    data_name = data_elem.get("name", "").strip()
-                    data_source = data_elem.get("source", "").strip()
-
-                    # Zbierz wszystkie wartości
-                    data_values = {}
-                    for value_elem in data_elem.findall("value"):
-                        value_name = value_elem.get("name", "").strip()
-                        value_text = value_elem.text.strip() if value_elem.text else ""
-                        if value_name:
-                            data_values[value_name] = value_text
-
-                    # PARSOWANIE PŁYTEK - jak w PhotoDescription.py
+                    # PARSOWANIE TABLIC - jak w PhotoDescription.py
                     if "plate" in data_name and "trace" not in data_name and data_values:
-                        plate_variant = {
-                            "country": data_values.get("country", "").strip(),
-                            "symbol": data_values.get("symbol", "").strip(),
-                            "level": safe_float_parse(data_values.get("level", "0")),
-                            "position": data_values.get("position", "").strip(),
-                            "prefix": data_values.get("prefix", "").strip(),
-                            "type": data_values.get("type", "").strip(),
-                            "doubleline": safe_int_parse(data_values.get("doubleline", "0")),
-                            "source": data_source,
-                            "data_name": data_name,
-                            "confidence": safe_float_parse(data_values.get("level", "0")) / 100.0
-                        }
-
-                        # Dodaj do listy wariantów płytek dla tego pojazdu
-                        vehicle_data["plates"].append(plate_variant)
-
-                        # Dodaj też do głównej listy płytek (dla kompatybilności)
-                        result["plates"].append(plate_variant)
+                        plate_variant = PlateVariant(data_values, data_source, data_name, anomalies)
+
+                        # Dodaj do listy wariantów tablic dla tego pojazdu
+                        vehicle.plates.append(plate_variant)
+
+                        # Dodaj też do głównej listy tablic (dla kompatybilności)
+                        result.plates.append(plate_variant)
 
                     # PARSOWANIE POJAZDU - jak w starej aplikacji
                     elif data_name == "vehicle" and data_values:
-                        vehicle_info = {
-                            "direction": safe_int_parse(data_values.get("direction", "0")),
-                            "speed": safe_float_parse(data_values.get("speed", "0")),
-                            "estimated_speed": safe_float_parse(data_values.get("estimatedspeed", "0")),
-                            "type": data_values.get("type", "").strip(),
-                            "manufacturer": data_values.get("manufacturer", "").strip(),
-                            "model": data_values.get("model", "").strip(),
-                            "color": data_values.get("color", "").strip(),
-                            "mmr_pattern_index": safe_int_parse(data_values.get("mmrpatternindex", "0")),
-                            "mmr_pattern_divergence": safe_float_parse(data_values.get("mmrpatterndivergence", "0")),
-                            "source": data_source
-                        }
-
-                        # Oblicz confidence na podstawie divergence
-                        divergence = vehicle_info["mmr_pattern_divergence"]
-                        if divergence > 0:
-                            confidence = max(0.1, 1.0 / (1.0 + divergence))
-                        else:
-                            confidence = 0.8
-                        vehicle_info["confidence"] = confidence
-
-                        vehicle_data["vehicle_info"] = vehicle_info
+                        vehicle.vehicle_info = VehicleInfo(data_values, data_source, anomalies)
 
                     # PARSOWANIE PARAMETRÓW
                     elif data_name == "parameters":
-                        vehicle_data["parameters"] = data_values
+                        vehicle.parameters = data_values
 
                     # PARSOWANIE SYGNATURY
                     elif data_name == "neuralnet" and "signature" in data_values:
-                        vehicle_data["signature"] = data_values["signature"]
-                        result["signature"] = data_values["signature"]
+                        vehicle.signature = data_values["signature"]
+                        result.signature = data_values["signature"]
 
                     # PARSOWANIE DANYCH RADARU
                     elif data_name == "zur" or "radar" in data_source:
-                        result["radar_data"].update(data_values)
+                        result.radar_data.update(data_values)
 
                 except Exception as e:
                     logger.warning(f"Błąd parsowania elementu data: {e}")
                     continue
 
             # Dodaj dane pojazdu do wyników
-            if vehicle_data["plates"] or vehicle_data["vehicle_info"] or vehicle_data["signature"]:
-                result["vehicles"].append(vehicle_data)
+            if vehicle.plates or vehicle.vehicle_info or vehicle.signature:
+                result.vehicles.append(vehicle)
 
         # Określ czy przetwarzanie było udane
-        result["processing_successful"] = bool(result["plates"] or result["vehicles"] or result["signature"])
-
-        # Stwórz szczegółowe podsumowanie - jak w starej aplikacji
-        result["summary"] = {
-            "plates_detected": len(result["plates"]),
-            "vehicles_detected": len(result["vehicles"]),
-            "has_signature": bool(result["signature"]),
-            "has_timestamp": bool(result["timestamp"]),
-            "has_radar_data": bool(result["radar_data"]),
-            "processing_successful": result["processing_successful"],
-            "best_plate_confidence": max([p["confidence"] for p in result["plates"]], default=0.0),
-            "plate_variants_total": sum([len(v["plates"]) for v in result["vehicles"]]),
-            "exdata_count": len(exdata_elements)
-        }
+        result.processing_successful = bool(result.plates or result.vehicles or result.signature)
+        result.exdata_count = len(document.exdata)
+        result.metadata["anomalies"] = anomalies.to_dict()
+        anomalies.log_summary()
 
         return result
 
-    except ET.ParseError as e:
+    except XML_PARSE_ERRORS as e:
         error_msg = f"Błąd parsowania XML: {str(e)}"
         logger.error(error_msg)
-        result["error"] = error_msg
-        result["error_details"] = {
+        result.error = error_msg
+        result.error_details = {
             "error_type": "xml_parse_error",
             "xml_preview": xml_content[:200] + "..." if len(xml_content) > 200 else xml_content
         }
@@ -195,92 +564,81 @@ def process_ncshot_result_xml_enhanced(xml_content: str) -> Dict[str, Any]:
     except Exception as e:
         error_msg = f"Błąd przetwarzania danych XML: {str(e)}"
         logger.error(error_msg)
-        result["error"] = error_msg
-        result["error_details"] = {
+        result.error = error_msg
+        result.error_details = {
             "error_type": type(e).__name__,
             "traceback": traceback.format_exc()
         }
         return result
 
+def process_ncshot_result_xml_enhanced(xml_content: str, debug: bool = False,
+                                       backend: Optional[str] = None) -> Dict[str, Any]:
+    """Wynik parse_ncshot_result jako słownik (kształt JSON zwracany przez API)"""
+    return parse_ncshot_result(xml_content, debug, backend).to_dict()
+
+def extract_detailed_plates(result: NcshotResult) -> List[DetailedPlate]:
+    """Szczegółowe dane tablic (z danymi pojazdu) z wyniku parse_ncshot_result - bez kopiowania"""
+    return [DetailedPlate(plate, vehicle) for vehicle in result.vehicles for plate in vehicle.plates]
+
 def extract_detailed_plates_from_xml(xml_content: str) -> List[Dict[str, Any]]:
-    """Wyciąga szczegółowe dane płytek z XML w formacie zgodnym ze starą aplikacją"""
-    result = process_ncshot_result_xml_enhanced(xml_content)
+    """Wyciąga szczegółowe dane tablic z XML w formacie zgodnym ze starą aplikacją"""
+    return [plate.to_dict() for plate in extract_detailed_plates(parse_ncshot_result(xml_content))]
 
-    detailed_plates = []
-    for vehicle in result.get("vehicles", []):
-        for plate in vehicle.get("plates", []):
-            # Dodaj informacje o pojeździe do płytki
-            enhanced_plate = plate.copy()
-            if vehicle.get("vehicle_info"):
-                enhanced_plate.update({
-                    "vehicle_manufacturer": vehicle["vehicle_info"].get("manufacturer", ""),
-                    "vehicle_model": vehicle["vehicle_info"].get("model", ""),
-                    "vehicle_color": vehicle["vehicle_info"].get("color", ""),
-                    "vehicle_type": vehicle["vehicle_info"].get("type", ""),
-                    "vehicle_speed": vehicle["vehicle_info"].get("speed", 0),
-                    "mmr_divergence": vehicle["vehicle_info"].get("mmr_pattern_divergence", 0)
-                })
-
-            enhanced_plate["exdata_index"] = vehicle["exdata_index"]
-            detailed_plates.append(enhanced_plate)
-
-    return detailed_plates
-
-def format_ncshot_summary_enhanced(ncshot_result: Dict[str, Any]) -> str:
+def format_ncshot_summary_enhanced(ncshot_result: NcshotResult) -> str:
     """Formatuje podsumowanie wyników NCShot w stylu starej aplikacji"""
-    if not ncshot_result.get("processing_successful"):
-        summary = "⚠ Przetwarzanie nieudane\n"
-        error = ncshot_result.get("error", "Nieznany błąd")
+    if not ncshot_result.processing_successful:
+        summary = "⚠ī¸ Przetwarzanie nieudane\n"
+        error = ncshot_result.error
         summary += f"🔍 Błąd: {error}\n"
         return summary
 
     summary = "📊 WYNIKI NCSHOT:\n"
 
     # Statystyki główne
-    plates_count = ncshot_result["summary"]["plates_detected"]
-    vehicles_count = ncshot_result["summary"]["vehicles_detected"]
-    variants_count = ncshot_result["summary"]["plate_variants_total"]
+    plates_count = ncshot_result.summary["plates_detected"]
+    vehicles_count = ncshot_result.summary["vehicles_detected"]
+    variants_count = ncshot_result.summary["plate_variants_total"]
 
     summary += f"   🚗 Pojazdy: {vehicles_count}\n"
-    summary += f"   🷏ī¸ Płytki główne: {plates_count}\n"
-    summary += f"   🔄 Warianty płytek: {variants_count}\n"
+    summary += f"   🷏ī¸ Tablice główne: {plates_count}\n"
+    summary += f"   🔄 Warianty tablic: {variants_count}\n"
 
     # Najlepsze rozpoznanie
-    best_conf = ncshot_result["summary"]["best_plate_confidence"]
+    best_conf = ncshot_result.summary["best_plate_confidence"]
     if best_conf > 0:
         conf_icon = "🎯" if best_conf > 0.7 else "⚡" if best_conf > 0.4 else "⚠ī¸"
         summary += f"   {conf_icon} Najlepsze rozpoznanie: {best_conf*100:.1f}%\n"
 
     # Szczegóły pojazdów
-    if ncshot_result["vehicles"]:
+    if ncshot_result.vehicles:
         summary += "\n🚙 SZCZEGÓŁY POJAZDÓW:\n"
-        for i, vehicle in enumerate(ncshot_result["vehicles"][:3]):  # Pokaż max 3
+        for i, vehicle in enumerate(ncshot_result.vehicles[:3]):  # Pokaż max 3
             summary += f"   Pojazd {i+1}:\n"
 
             # Info o pojeździe
-            if vehicle["vehicle_info"]:
-                info = vehicle["vehicle_info"]
-                summary += f"      • {info.get('manufacturer', 'N/A')} {info.get('model', 'N/A')}\n"
-                summary += f"      • Kolor: {info.get('color', 'N/A')}\n"
-                if info.get('speed', 0) > 0:
-                    summary += f"      • Prędkość: {info['speed']:.1f} km/h\n"
-
-            # Najlepszy wariant płytki
-            if vehicle["plates"]:
-                best_plate = max(vehicle["plates"], key=lambda p: p["confidence"])
-                conf_icon = "✅" if best_plate["confidence"] > 0.7 else "⚡" if best_plate["confidence"] > 0.4 else "⚠ī¸"
-                summary += f"      {conf_icon} {best_plate['symbol']} ({best_plate['country']}) - {best_plate['level']:.0f}%\n"
+            if vehicle.vehicle_info:
+                info = vehicle.vehicle_info
+                summary += f"      • {info.manufacturer} {info.model}\n"
+                summary += f"      • Kolor: {info.color}\n"
+                if info.speed > 0:
+                    summary += f"      • Prędkość: {info.speed:.1f} km/h\n"
+
+            # Najlepszy wariant tablicy
+            if vehicle.plates:
+                best_plate = max(vehicle.plates, key=lambda p: p.confidence)
+                conf_icon = "✅" if best_plate.confidence > 0.7 else "⚡" if best_plate.confidence > 0.4 else "⚠ī¸"
+                summary += f"      {conf_icon} {best_plate.symbol} ({best_plate.country}) - {best_plate.level:.0f}%\n"
 
     # Timestamp
-    if ncshot_result.get("timestamp"):
-        ts = ncshot_result["timestamp"]
+    if ncshot_result.timestamp:
+        ts = ncshot_result.timestamp
         summary += f"\n⏰ Czas: {ts['date']} {ts['time']}.{ts['ms']}\n"
 
     return summary
 
 # Funkcje pomocnicze dla przyszłego użycia
 def extract_plates_from_xml(xml_content: str) -> List[Dict[str, Any]]:
-    """Wyciąga tylko dane płytek z XML"""
+    """Wyciąga tylko dane tablic z XML"""
     result = process_ncshot_result_xml_enhanced(xml_content)
     return result.get("plates", [])
 
@@ -294,6 +652,89 @@ def process_ncshot_result_xml(xml_content: str) -> Dict[str, Any]:
     """Główna funkcja parsowania XML - używa rozszerzonej wersji"""
     return process_ncshot_result_xml_enhanced(xml_content)
 
+# ===== ZGODNOŚĆ BACKENDÓW PARSERA =====
+def _comparable_result(result: Dict[str, Any]) -> Dict[str, Any]:
+    """Wynik bez pól zależnych od czasu i treści komunikatów błędów parsera"""
+    comparable = dict(result, metadata={k: v for k, v in result["metadata"].items() if k != "processed_at"})
+    if comparable.get("error"):
+        comparable["error"] = True
+        comparable["error_details"] = {"error_type": result.get("error_details", {}).get("error_type")}
+    return comparable
+
+def compare_xml_parser_backends(xml_content: str) -> Optional[str]:
+    """Parsuje XML backendem lxml i stdlib; zwraca opis różnicy albo None, gdy wyniki są identyczne"""
+    if "lxml" not in _XML_BACKENDS:
+        return "lxml niedostępny"
+    stdlib_result = _comparable_result(process_ncshot_result_xml_enhanced(xml_content, backend="stdlib"))
+    lxml_result = _comparable_result(process_ncshot_result_xml_enhanced(xml_content, backend="lxml"))
+    if stdlib_result == lxml_result:
+        return None
+    differing = sorted(key for key in set(stdlib_result) | set(lxml_result)
+                       if stdlib_result.get(key) != lxml_result.get(key))
+    return f"różne pola: {', '.join(differing)}"
+
+# ===== PARSOWANIE WSADOWE (PULA PROCESÓW) =====
+def _parse_chunk(chunk: List[Tuple[int, str]], backend: Optional[str]) -> List[Tuple[int, Dict[str, Any]]]:
+    return [(index, process_ncshot_result_xml_enhanced(xml_content, backend=backend)) for index, xml_content in chunk]
+
+def _chunked(xml_iterable: Iterable[str], chunk_size: int) -> Iterator[List[Tuple[int, str]]]:
+    chunk = []
+    for index, xml_content in enumerate(xml_iterable):
+        chunk.append((index, xml_content))
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+def parse_many(xml_iterable: Iterable[str], workers: Optional[int] = None, chunk_size: int = 16,
+               ordered: bool = True, backend: Optional[str] = None) -> Iterator[Tuple[int, Dict[str, Any]]]:
+    """
+    Parsuje wiele odpowiedzi NCShot na puli procesów (np. ponowna analiza archiwum po zmianie parsera).
+
+    Zwraca generator par (indeks w `xml_iterable`, wynik jak process_ncshot_result_xml).
+    `ordered=True` - w kolejności wejścia, `ordered=False` - w miarę ukończenia paczek.
+    Wejście jest czytane leniwie: paczek po `chunk_size` dokumentów w locie i ukończonych, ale
+    czekających na wcześniejszą paczkę (tryb ordered), jest łącznie najwyżej 2 * workers.
+    `workers=1` parsuje w bieżącym procesie.
+    """
+    workers = workers or os.cpu_count() or 1
+    chunk_size = max(1, chunk_size)
+    backend = backend or get_xml_parser_backend()
+    chunks = enumerate(_chunked(xml_iterable, chunk_size))
+
+    if workers <= 1:
+        for _, chunk in chunks:
+            yield from _parse_chunk(chunk, backend)
+        return
+
+    window = workers * 2
+    pending = {}  # numer paczki -> wyniki czekające na wcześniejsze paczki (tryb ordered)
+    next_chunk = 0
+    with ProcessPoolExecutor(max_workers=workers, initializer=set_xml_parser_backend,
+                             initargs=(backend, _xml_stream_threshold)) as executor:
+        in_flight = {}
+
+        def refill() -> None:
+            # Jak okno silnika wsadu: nowa paczka tylko w miejsce wydanej
+            for number, chunk in itertools.islice(chunks, max(0, window - len(in_flight) - len(pending))):
+                in_flight[executor.submit(_parse_chunk, chunk, backend)] = number
+
+        refill()
+        while in_flight:
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                number = in_flight.pop(future)
+                if ordered:
+                    pending[number] = future.result()
+                else:
+                    yield from future.result()
+
+            while next_chunk in pending:
+                yield from pending.pop(next_chunk)
+                next_chunk += 1
+            refill()
+
 if __name__ == "__main__":
     # Testy jednostkowe
     print("🧪 Uruchamianie testów logic.py...")
@@ -305,4 +746,4 @@ if __name__ == "__main__":
     print(f"   Status: {result['processing_successful']}")
     print(f"   Błąd: {result['error']}")
 
-    print("\n🎉 Testy zakończone pomyślnie!")
+    print("\n🎉 Testy zakończone pomyślnie! (narzędzia parsera: python -m app.xml_tools)")
@@ -1,23 +1,46 @@
-from fastapi import FastAPI, Request, HTTPException
-from fastapi.responses import HTMLResponse, StreamingResponse, JSONResponse, Response
+from fastapi import FastAPI, Request, HTTPException, UploadFile, File, Form
+from fastapi.responses import HTMLResponse, StreamingResponse, JSONResponse, Response, FileResponse
 from fastapi.templating import Jinja2Templates
 from fastapi.exceptions import RequestValidationError
-from pydantic import BaseModel
-from typing import List, Dict, Any, Optional, Tuple
+from fastapi.concurrency import run_in_threadpool
+from pydantic import BaseModel, ValidationError
+from typing import List, Dict, Any, Optional, Set, Tuple, Callable, Union
 import xml.etree.ElementTree as ET
 from xml.dom import minidom
 import io, zipfile, time, os, stat, base64, tempfile, re, logging, traceback, subprocess, sys
+import http.client
 import configparser
 import paramiko
-import py7zr
 import json
-import http.client as httplib
 import warnings
 from pathlib import Path
 import shutil
 from datetime import datetime
 import hashlib
 import uuid
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from collections import deque
+from contextlib import contextmanager
+
+from app.ncshot_client import NcshotClient
+from app.ncshot_backends import NcshotBackend, NcshotBackendRegistry, parse_backends
+from app.ncshot_batch import NcshotBatchEngine
+from app.ncshot_jobs import NcshotJobManager, NcshotJob, FINISHED_STATES
+from app.result_cache import NcshotResultCache, sha256_hex
+from app.config_state import NcshotConfigTracker
+from app.config_slots import NcshotConfigSlotManager
+from app.token_leases import TokenLeaseRegistry
+from app.admission import AdmissionController, parse_meminfo
+from app.image_store import ImageStore
+from app.image_normalize import ImageNormalizer
+from app.archive_extract import ArchiveExtractor
+from app.logic import parse_ncshot_result, extract_detailed_plates, format_ncshot_summary_enhanced
+from app.logic import DetailedPlate, NcshotResult
+from app.logic import set_xml_parser_backend, get_xml_parser_backend, set_anomaly_log_interval
+from app.metrics import REGISTRY, Counter, StageTimings, timed, instrumented
+from app.memory_monitor import MemoryMonitor, current_rss, start_tracemalloc, tracemalloc_snapshot
+from app.log_setup import setup_logging, shutdown_logging, parse_sampling, bind_correlation_id, correlation_id
 
 # Ignoruj ostrzeżenia o TripleDES
 warnings.filterwarnings("ignore", message=".*TripleDES.*", category=UserWarning)
@@ -37,18 +60,102 @@ VM_PASS = os.getenv("VM_HOST_PASS")
 # Konfiguracja ncshot
 NCSHOT_HOST = VM_HOST
 NCSHOT_PORT = int(os.getenv("NCSHOT_PORT", "5543"))
+# Dodatkowe instancje NCShot: "host[:port][*waga],..." (puste = tylko NCSHOT_HOST:NCSHOT_PORT)
+NCSHOT_BACKENDS = os.getenv("NCSHOT_BACKENDS", "")
+# Czas wyłączenia instancji po bad_alloc/5xx/braku odpowiedzi (circuit breaker)
+NCSHOT_BREAKER_COOLDOWN = int(os.getenv("NCSHOT_BREAKER_COOLDOWN", "60"))
+# Liczba obrazów przetwarzanych jednocześnie i limit jednocześnie trzymanych tokenów NCShot
+NCSHOT_BATCH_WINDOW = int(os.getenv("NCSHOT_BATCH_WINDOW", "3"))
+NCSHOT_MAX_TOKENS = int(os.getenv("NCSHOT_MAX_TOKENS", str(NCSHOT_BATCH_WINDOW)))
+# Wycinki tablic jednego tokenu pobierane równolegle (limit per token) i maks. czas trzymania tokenu na tablice
+NCSHOT_PLATE_CONCURRENCY = int(os.getenv("NCSHOT_PLATE_CONCURRENCY", "3"))
+NCSHOT_PLATE_DEADLINE = float(os.getenv("NCSHOT_PLATE_DEADLINE", "10"))
+NCSHOT_POOL_SIZE = int(os.getenv("NCSHOT_POOL_SIZE",
+                                 str(max(4, NCSHOT_BATCH_WINDOW * NCSHOT_PLATE_CONCURRENCY + 1))))
+# Połączenie keep-alive bezczynne dłużej (sekundy) jest zamykane zamiast ponownie używane
+NCSHOT_POOL_MAX_IDLE = float(os.getenv("NCSHOT_POOL_MAX_IDLE", "30"))
+# Zadania NCShot w tle: liczba równoległych wsadów i czas przechowywania zakończonych zadań
+NCSHOT_JOB_WORKERS = int(os.getenv("NCSHOT_JOB_WORKERS", "2"))
+NCSHOT_JOB_TTL = int(os.getenv("NCSHOT_JOB_TTL", "3600"))
+# Wyniki obrazów zadań zapisywane na dysk (NDJSON), zadania przetwarzane porcjami po NCSHOT_JOB_CHUNK_SIZE
+# obrazów (bez limitu liczby obrazów); synchroniczne /ncshot/ zwraca wszystko naraz, więc ma limit
+NCSHOT_JOB_RESULTS_DIR = os.getenv("NCSHOT_JOB_RESULTS_DIR", "cache/ncshot_jobs")
+NCSHOT_JOB_CHUNK_SIZE = int(os.getenv("NCSHOT_JOB_CHUNK_SIZE", "20"))
+NCSHOT_MAX_SYNC_IMAGES = int(os.getenv("NCSHOT_MAX_SYNC_IMAGES", "20"))
+# Cache wyników NCShot (0 MB = wyłączony)
+NCSHOT_CACHE_DIR = os.getenv("NCSHOT_CACHE_DIR", "cache/ncshot_results")
+NCSHOT_CACHE_MAX_MB = int(os.getenv("NCSHOT_CACHE_MAX_MB", "512"))
+# Stan konfiguracji wgranych do NCShot (wspólny dla workerów) i czas jego ważności
+NCSHOT_CONFIG_STATE_FILE = os.getenv("NCSHOT_CONFIG_STATE_FILE", "cache/ncshot_config_state.json")
+NCSHOT_CONFIG_STATE_TTL = int(os.getenv("NCSHOT_CONFIG_STATE_TTL", "600"))
+# Nazwane sloty konfiguracji w NCShot: maks. liczba na instancję i minimalny czas bezczynności przed eksmisją
+NCSHOT_CONFIG_SLOTS = int(os.getenv("NCSHOT_CONFIG_SLOTS", "8"))
+NCSHOT_CONFIG_SLOT_MIN_IDLE = int(os.getenv("NCSHOT_CONFIG_SLOT_MIN_IDLE", "900"))
+# Dzierżawy tokenów NCShot (wspólne dla workerów): maks. czas trzymania tokenu i ponawianie zwolnień w tle
+NCSHOT_LEASE_STATE_FILE = os.getenv("NCSHOT_LEASE_STATE_FILE", "cache/ncshot_token_leases.json")
+NCSHOT_LEASE_MAX_AGE = float(os.getenv("NCSHOT_LEASE_MAX_AGE", "120"))
+NCSHOT_LEASE_RETRY_MAX = float(os.getenv("NCSHOT_LEASE_RETRY_MAX", "60"))
+# Adaptacyjny limit obrazów w NCShot (wspólny dla wsadów): granice (0 = tokeny x instancje), docelowe
+# opóźnienie, próg zajętości pamięci VM, próbkowanie pamięci przez SSH (0 = wyłączone) i maks. czas
+# oczekiwania obrazu na zamknięcie breakera, zanim wsad zostanie przerwany
+NCSHOT_ADMISSION_MIN = int(os.getenv("NCSHOT_ADMISSION_MIN", "1"))
+NCSHOT_ADMISSION_MAX = int(os.getenv("NCSHOT_ADMISSION_MAX", "0"))
+NCSHOT_ADMISSION_LATENCY_TARGET = float(os.getenv("NCSHOT_ADMISSION_LATENCY_TARGET", "10"))
+NCSHOT_ADMISSION_MEMORY_HIGH = float(os.getenv("NCSHOT_ADMISSION_MEMORY_HIGH", "0.85"))
+NCSHOT_ADMISSION_VM_INTERVAL = float(os.getenv("NCSHOT_ADMISSION_VM_INTERVAL", "30"))
+NCSHOT_ADMISSION_MAX_WAIT = float(os.getenv("NCSHOT_ADMISSION_MAX_WAIT", "120"))
+
+# Katalog na obrazy przesłane jako multipart (pliki tymczasowe wsadu)
+NCSHOT_UPLOAD_DIR = os.getenv("NCSHOT_UPLOAD_DIR", "cache/ncshot_uploads")
+
+# Magazyn obrazów galerii (obrazy wysyłane raz, dalej referencje po id)
+IMAGE_STORE_DIR = os.getenv("IMAGE_STORE_DIR", "cache/images")
+IMAGE_STORE_MAX_MB = int(os.getenv("IMAGE_STORE_MAX_MB", "2048"))
+
+# Normalizacja obrazów przy zapisie do magazynu (z dysku i z terminala): dłuższy bok w pikselach
+# (0 = bez skalowania), jakość JPEG, wątki i cache wyników wg SHA treści
+IMAGE_NORMALIZE = os.getenv("IMAGE_NORMALIZE", "1") == "1"
+IMAGE_NORMALIZE_MAX_DIM = int(os.getenv("IMAGE_NORMALIZE_MAX_DIM", "2560"))
+IMAGE_NORMALIZE_QUALITY = int(os.getenv("IMAGE_NORMALIZE_QUALITY", "90"))
+IMAGE_NORMALIZE_WORKERS = int(os.getenv("IMAGE_NORMALIZE_WORKERS", "2"))
+IMAGE_NORMALIZE_CACHE_MB = int(os.getenv("IMAGE_NORMALIZE_CACHE_MB", "64"))
+# Procesy dekompresji archiwów 7z z terminala (0 = w wątku żądania)
+ARCHIVE_EXTRACT_WORKERS = int(os.getenv("ARCHIVE_EXTRACT_WORKERS", str(min(4, os.cpu_count() or 1))))
+
+# Backend parsera XML NCShot: auto (lxml strumieniowo dla dużych odpowiedzi), lxml albo stdlib
+NCSHOT_XML_PARSER = os.getenv("NCSHOT_XML_PARSER", "auto")
+NCSHOT_XML_STREAM_BYTES = int(os.getenv("NCSHOT_XML_STREAM_BYTES", str(1024 * 1024)))
+NCSHOT_ANOMALY_LOG_INTERVAL = float(os.getenv("NCSHOT_ANOMALY_LOG_INTERVAL", "60"))
+
+# Pamięć wsadu: gc.collect() dopiero po wzroście RSS o tyle MB (0 = nigdy), tracemalloc od startu
+NCSHOT_GC_THRESHOLD_MB = int(os.getenv("NCSHOT_GC_THRESHOLD_MB", "256"))
+NCSHOT_TRACEMALLOC = os.getenv("NCSHOT_TRACEMALLOC", "0") == "1"
+
+# Kopiowanie konfiguracji INI na VM przez SSH przed PUT /config (0 = tylko HTTP, np. dla app.fake_ncshot)
+NCSHOT_CONFIG_VIA_SSH = os.getenv("NCSHOT_CONFIG_VIA_SSH", "1") == "1"
+
+# Flagi rozpoznawania przekazywane do NCShot przy wysyłaniu obrazu
+NCSHOT_IMAGE_FLAGS = "anpr=1&mmr=1&diagnostic=1"
 
 if not VM_PASS:
     logging.warning("⚠ī¸ Brak VM_HOST_PASS w zmiennych środowiskowych!")
 
-logging.basicConfig(
-    level=logging.DEBUG,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.StreamHandler(),
-        logging.FileHandler('ncpyvisual.log')
-    ]
-)
+# Logowanie: zapis w osobnym wątku (QueueListener), plik JSON z rotacją, próbkowanie kategorii
+# "ssh" (stdout komend) i "batch" (linie per obraz/tablica) - ostrzeżenia i błędy zawsze w całości
+LOG_LEVEL = os.getenv("LOG_LEVEL", "DEBUG")
+LOG_FILE = os.getenv("LOG_FILE", "ncpyvisual.log")
+LOG_MAX_MB = int(os.getenv("LOG_MAX_MB", "20"))
+LOG_BACKUPS = int(os.getenv("LOG_BACKUPS", "5"))
+LOG_JSON_CONSOLE = os.getenv("LOG_JSON_CONSOLE", "0") == "1"
+LOG_SAMPLING = os.getenv("LOG_SAMPLING", "ssh=0.2,batch=0.2")
+
+log_sampler = setup_logging(level=LOG_LEVEL, log_file=LOG_FILE, max_bytes=LOG_MAX_MB * 1024 * 1024,
+                            backup_count=LOG_BACKUPS, json_console=LOG_JSON_CONSOLE,
+                            sampling=parse_sampling(LOG_SAMPLING))
+
+# Kategorie logów gorącej ścieżki (próbkowane wg LOG_SAMPLING)
+SSH_LOG = {"category": "ssh"}
+BATCH_LOG = {"category": "batch"}
 
 # Konfiguracja limitów obrazów (POPRAWIONE LIMITY)
 MAX_IMAGE_SIZE = 5 * 1024 * 1024  # 5MB maksymalny rozmiar obrazu
@@ -56,6 +163,75 @@ MIN_IMAGE_SIZE = 1024  # 1KB minimalny rozmiar dla obrazów głównych
 MAX_PLATE_SIZE = 500 * 1024  # 500KB maksymalny rozmiar tablicy
 MIN_PLATE_SIZE = 50  # 50 bajtów minimalny rozmiar tablicy
 
+# Instancje NCShot - cały ruch HTTP do NCShot idzie przez pule keep-alive instancji
+ncshot_backends = NcshotBackendRegistry(parse_backends(NCSHOT_BACKENDS, NCSHOT_HOST, NCSHOT_PORT,
+                                                       pool_size=NCSHOT_POOL_SIZE,
+                                                       pool_max_idle=NCSHOT_POOL_MAX_IDLE,
+                                                       breaker_cooldown=NCSHOT_BREAKER_COOLDOWN))
+ncshot_client = ncshot_backends.primary.client
+ncshot_jobs = NcshotJobManager(workers=NCSHOT_JOB_WORKERS, ttl=NCSHOT_JOB_TTL, results_dir=NCSHOT_JOB_RESULTS_DIR)
+result_cache = NcshotResultCache(NCSHOT_CACHE_DIR, NCSHOT_CACHE_MAX_MB * 1024 * 1024)
+config_tracker = NcshotConfigTracker(NCSHOT_CONFIG_STATE_FILE, ttl=NCSHOT_CONFIG_STATE_TTL)
+config_slots = NcshotConfigSlotManager(config_tracker, max_slots=NCSHOT_CONFIG_SLOTS,
+                                       min_idle=NCSHOT_CONFIG_SLOT_MIN_IDLE)
+image_store = ImageStore(IMAGE_STORE_DIR, IMAGE_STORE_MAX_MB * 1024 * 1024)
+image_normalizer = ImageNormalizer(max_dim=IMAGE_NORMALIZE_MAX_DIM, quality=IMAGE_NORMALIZE_QUALITY,
+                                   workers=IMAGE_NORMALIZE_WORKERS,
+                                   cache_bytes=IMAGE_NORMALIZE_CACHE_MB * 1024 * 1024)
+archive_extractor = ArchiveExtractor(ARCHIVE_EXTRACT_WORKERS)
+
+def release_ncshot_token(backend_name: str, token: str) -> bool:
+    """Zwalnia token w instancji NCShot; 404 oznacza, że instancja już go nie zna (np. po restarcie)"""
+    backend = ncshot_backends.get(backend_name)
+    if backend is None:
+        logging.warning(f"⚠ī¸ Token {token} należy do nieznanej instancji {backend_name} - pomijam")
+        return True
+    resp = backend.client.get(f"/release?token={token}", operation="release")
+    return resp.status in (200, 404)
+
+token_leases = TokenLeaseRegistry(NCSHOT_LEASE_STATE_FILE, release_ncshot_token,
+                                  max_age=NCSHOT_LEASE_MAX_AGE, retry_max=NCSHOT_LEASE_RETRY_MAX)
+admission = AdmissionController(min_limit=NCSHOT_ADMISSION_MIN,
+                                max_limit=NCSHOT_ADMISSION_MAX or NCSHOT_MAX_TOKENS * len(ncshot_backends.backends),
+                                latency_target=NCSHOT_ADMISSION_LATENCY_TARGET,
+                                memory_high=NCSHOT_ADMISSION_MEMORY_HIGH)
+set_xml_parser_backend(NCSHOT_XML_PARSER, NCSHOT_XML_STREAM_BYTES)
+set_anomaly_log_interval(NCSHOT_ANOMALY_LOG_INTERVAL)
+
+# Metryki Prometheus (/metrics) - czasy etapów są w app.metrics, tu liczniki wyników NCShot
+NCSHOT_IMAGES = REGISTRY.register(Counter(
+    "ncpyvisual_ncshot_images_total", "Obrazy przetworzone przez NCShot wg statusu", ["status"]))
+NCSHOT_CACHE_HITS = REGISTRY.register(Counter(
+    "ncpyvisual_ncshot_cache_hits_total", "Obrazy obsłużone z cache wyników NCShot"))
+PLATE_DEADLINE_HITS = REGISTRY.register(Counter(
+    "ncpyvisual_ncshot_plate_deadline_total", "Tokeny zwolnione przed pobraniem wszystkich tablic (termin)"))
+
+def collect_ncshot_backend_metrics() -> List[str]:
+    """Stan instancji NCShot i pul połączeń w chwili odczytu /metrics"""
+    lines = ["# HELP ncpyvisual_ncshot_outstanding_tokens Tokeny NCShot trzymane przez instancję",
+             "# TYPE ncpyvisual_ncshot_outstanding_tokens gauge",
+             "# HELP ncpyvisual_ncshot_available Instancja NCShot dostępna (breaker zamknięty)",
+             "# TYPE ncpyvisual_ncshot_available gauge",
+             "# HELP ncpyvisual_ncshot_pool_in_use Połączenia z puli keep-alive w użyciu",
+             "# TYPE ncpyvisual_ncshot_pool_in_use gauge"]
+    for backend in ncshot_backends.backends:
+        label = f'{{backend="{backend.name}"}}'
+        lines.append(f"ncpyvisual_ncshot_outstanding_tokens{label} {backend.outstanding}")
+        lines.append(f"ncpyvisual_ncshot_available{label} {int(backend.available)}")
+        lines.append(f"ncpyvisual_ncshot_pool_in_use{label} {backend.client.get_stats()['in_use']}")
+    stats = admission.get_stats()
+    for name, documentation in (("limit", "Bieżący limit obrazów jednocześnie w NCShot (kontrola dopuszczania)"),
+                                ("in_flight", "Obrazy dopuszczone do NCShot"),
+                                ("waiting", "Obrazy czekające w kolejce na dopuszczenie")):
+        lines += [f"# HELP ncpyvisual_ncshot_admission_{name} {documentation}",
+                  f"# TYPE ncpyvisual_ncshot_admission_{name} gauge",
+                  f"ncpyvisual_ncshot_admission_{name} {stats[name]}"]
+    return lines
+
+REGISTRY.add_collector(collect_ncshot_backend_metrics)
+if NCSHOT_TRACEMALLOC:
+    start_tracemalloc()
+
 # 🔧 NOWA FUNKCJA: Zabezpieczenie JSON serializacji
 def ensure_json_serializable(obj):
     """Konwertuje bytes na string żeby można było serializować do JSON"""
@@ -68,6 +244,9 @@ def ensure_json_serializable(obj):
         return {k: ensure_json_serializable(v) for k, v in obj.items()}
     elif isinstance(obj, list):
         return [ensure_json_serializable(item) for item in obj]
+    elif hasattr(obj, "to_dict"):
+        # Rekordy wyniku NCShot (app.logic) - projekcja JSON liczona dopiero tutaj
+        return ensure_json_serializable(obj.to_dict())
     else:
         return obj
 
@@ -97,12 +276,24 @@ class FullPackage(BaseModel):
 
 class NcshotRequest(BaseModel):
     package: FullPackage
-    image_files: List[str]
+    image_files: List[str] = []
+    image_ids: List[str] = []  # obrazy z magazynu galerii (po image_files)
 
 # ===== APP =====
 app = FastAPI(title="NCPyVisual Web Professional")
 templates = Jinja2Templates(directory="app/templates")
 
+@app.middleware("http")
+async def correlation_id_middleware(request: Request, call_next):
+    """Id korelacji żądania (z nagłówka X-Request-ID lub nowe) w każdym logu i w odpowiedzi"""
+    token = bind_correlation_id(request.headers.get("x-request-id"))
+    try:
+        response = await call_next(request)
+        response.headers["X-Request-ID"] = correlation_id.get()
+        return response
+    finally:
+        correlation_id.reset(token)
+
 @app.exception_handler(RequestValidationError)
 async def validation_exception_handler(request: Request, exc: RequestValidationError):
     logging.error(f"⚠ī¸ Błąd walidacji dla {request.url.path}:")
@@ -118,344 +309,6 @@ async def validation_exception_handler(request: Request, exc: RequestValidationE
         }
     )
 
-# ===== ULEPSZONE FUNKCJE PARSOWANIA XML (ze starszej wersji) =====
-def safe_float_parse(value: str, default: float = 0.0) -> float:
-    """Bezpieczne parsowanie float z domyślną wartością"""
-    try:
-        return float(value) if value else default
-    except (ValueError, TypeError):
-        logging.warning(f"Nie można sparsować jako float: {value}, używam domyślnej: {default}")
-        return default
-
-def safe_int_parse(value: str, default: int = 0) -> int:
-    """Bezpieczne parsowanie int z domyślną wartością"""
-    try:
-        return int(value) if value else default
-    except (ValueError, TypeError):
-        logging.warning(f"Nie można sparsować jako int: {value}, używam domyślnej: {default}")
-        return default
-
-def debug_xml_structure(xml_content: str) -> None:
-    """
-    Debuguje strukturę XML dla lepszego zrozumienia danych z NCShot
-    """
-    try:
-        root = ET.fromstring(xml_content)
-        logging.info("🔍 === DEBUGOWANIE STRUKTURY XML ===")
-        logging.info(f"📄 Długość XML: {len(xml_content)} znaków")
-        logging.info(f"📋 Root element: {root.tag}")
-
-        def log_element(element, level=0):
-            indent = "  " * level
-            attrs = f" {element.attrib}" if element.attrib else ""
-            text = f" = '{element.text.strip()}'" if element.text and element.text.strip() else ""
-            logging.info(f"{indent}📋 {element.tag}{attrs}{text}")
-
-            for child in element:
-                log_element(child, level + 1)
-
-        log_element(root)
-
-        # DODATKOWE - sprawdź czy są jakiekolwiek elementy z tekstem
-        logging.info("🔍 === SZUKANIE TEKSTU W XML ===")
-        all_texts = []
-        for elem in root.iter():
-            if elem.text and elem.text.strip():
-                all_texts.append(f"{elem.tag}: {elem.text.strip()}")
-
-        logging.info(f"🔍 Znalezione teksty ({len(all_texts)}):")
-        for text in all_texts:
-            logging.info(f"  📄 {text}")
-
-        # Szukaj wszystkich wartości w elementach value
-        logging.info("🔍 === WSZYSTKIE ELEMENTY VALUE ===")
-        value_elements = root.findall(".//value")
-        for i, value in enumerate(value_elements):
-            name_attr = value.get("name", "no-name")
-            text_content = value.text if value.text else "no-text"
-            logging.info(f"  🔍 Value {i+1}: name='{name_attr}' text='{text_content}'")
-
-        logging.info("🔍 === KONIEC DEBUGOWANIA XML ===")
-
-    except Exception as e:
-        logging.error(f"⚠ī¸ Błąd debugowania XML: {e}")
-        # Zapisz surowy XML do logów
-        logging.error(f"📄 Surowy XML (pierwsze 1000 znaków): {xml_content[:1000]}")
-
-def process_ncshot_result_xml_enhanced(xml_content: str) -> Dict[str, Any]:
-    """
-    Rozszerzony parser XML z NCShot - zgodny ze starą aplikacją
-    """
-    result = {
-        "plates": [],
-        "vehicles": [],
-        "timestamp": None,
-        "processing_parameters": {},
-        "radar_data": {},
-        "signature": None,
-        "processing_successful": False,
-        "error": None,
-        "metadata": {
-            "processed_at": datetime.now().isoformat(),
-            "xml_length": len(xml_content),
-            "parser_version": "3.0.0-enhanced"
-        }
-    }
-
-    try:
-        if not xml_content or not xml_content.strip():
-            result["error"] = "Pusta zawartość XML"
-            return result
-
-        # DEBUGOWANIE - pokaż całą strukturę XML
-        debug_xml_structure(xml_content)
-
-        root = ET.fromstring(xml_content)
-        result["metadata"]["root_tag"] = root.tag
-
-        # Parsuj timestamp - jak w starej aplikacji
-        timestamp_elem = root.find("timestamp")
-        if timestamp_elem is not None:
-            try:
-                date_elem = timestamp_elem.find("date")
-                time_elem = timestamp_elem.find("time")
-                ms_elem = timestamp_elem.find("ms")
-
-                if all(e is not None and e.text for e in [date_elem, time_elem, ms_elem]):
-                    result["timestamp"] = {
-                        "date": date_elem.text.strip(),
-                        "time": time_elem.text.strip(),
-                        "ms": ms_elem.text.strip()
-                    }
-            except Exception as e:
-                logging.warning(f"Błąd parsowania timestamp: {e}")
-
-        # Parsuj exdata - DOKŁADNIE jak w starej aplikacji
-        exdata_elements = root.findall("exdata")
-        result["metadata"]["exdata_count"] = len(exdata_elements)
-
-        for exdata_idx, exdata_elem in enumerate(exdata_elements):
-            vehicle_data = {
-                "exdata_index": exdata_idx,
-                "plates": [],  # Lista wariantów tablic dla tego pojazdu
-                "vehicle_info": {},
-                "parameters": {},
-                "signature": None
-            }
-
-            for data_elem in exdata_elem.findall("data"):
-                try:
-                    data_name = data_elem.get("name", "").strip()
-                    data_source = data_elem.get("source", "").strip()
-
-                    logging.info(f"    🔍 Przetwarzam data: name='{data_name}', source='{data_source}'")
-
-                    # Zbierz wszystkie wartości
-                    data_values = {}
-                    for value_elem in data_elem.findall("value"):
-                        value_name = value_elem.get("name", "").strip()
-                        value_text = value_elem.text.strip() if value_elem.text else ""
-                        if value_name:
-                            data_values[value_name] = value_text
-
-                    logging.info(f"    📋 Wszystkie wartości w {data_name}: {data_values}")
-
-                    # PARSOWANIE TABLIC - jak w PhotoDescription.py
-                    if "plate" in data_name and "trace" not in data_name and data_values:
-                        logging.info(f"    🎯 Znaleziono element tablicy: {data_name}")
-
-                        plate_variant = {
-                            "country": data_values.get("country", "").strip(),
-                            "symbol": data_values.get("symbol", "").strip(),
-                            "level": safe_float_parse(data_values.get("level", "0")),
-                            "position": data_values.get("position", "").strip(),
-                            "prefix": data_values.get("prefix", "").strip(),
-                            "type": data_values.get("type", "").strip(),
-                            "doubleline": safe_int_parse(data_values.get("doubleline", "0")),
-                            "source": data_source,
-                            "data_name": data_name,
-                            "confidence": safe_float_parse(data_values.get("level", "0")) / 100.0
-                        }
-
-                        if plate_variant["symbol"]:
-                            logging.info(f"    ✅ Znaleziono tekst tablicy: {plate_variant['symbol']}")
-                        if plate_variant["country"]:
-                            logging.info(f"    ✅ Znaleziono kraj: {plate_variant['country']}")
-                        if plate_variant["level"]:
-                            logging.info(f"    ✅ Znaleziono pewność: {plate_variant['level']}%")
-
-                        # Dodaj do listy wariantów tablic dla tego pojazdu
-                        vehicle_data["plates"].append(plate_variant)
-
-                        # Dodaj też do głównej listy tablic (dla kompatybilności)
-                        result["plates"].append(plate_variant)
-
-                    # PARSOWANIE POJAZDU - jak w starej aplikacji
-                    elif data_name == "vehicle" and data_values:
-                        logging.info(f"    🚗 Znaleziono informacje o pojeździe")
-
-                        vehicle_info = {
-                            "direction": safe_int_parse(data_values.get("direction", "0")),
-                            "speed": safe_float_parse(data_values.get("speed", "0")),
-                            "estimated_speed": safe_float_parse(data_values.get("estimatedspeed", "0")),
-                            "type": data_values.get("type", "").strip(),
-                            "manufacturer": data_values.get("manufacturer", "").strip(),
-                            "model": data_values.get("model", "").strip(),
-                            "color": data_values.get("color", "").strip(),
-                            "mmr_pattern_index": safe_int_parse(data_values.get("mmrpatternindex", "0")),
-                            "mmr_pattern_divergence": safe_float_parse(data_values.get("mmrpatterndivergence", "0")),
-                            "source": data_source
-                        }
-
-                        # Oblicz confidence na podstawie divergence
-                        divergence = vehicle_info["mmr_pattern_divergence"]
-                        if divergence > 0:
-                            confidence = max(0.1, 1.0 / (1.0 + divergence))
-                        else:
-                            confidence = 0.8
-                        vehicle_info["confidence"] = confidence
-
-                        vehicle_data["vehicle_info"] = vehicle_info
-
-                        for key, value in vehicle_info.items():
-                            if value and key != "confidence":
-                                logging.info(f"    ✅ Pojazd {key}: {value}")
-
-                    # PARSOWANIE PARAMETRÓW
-                    elif data_name == "parameters":
-                        vehicle_data["parameters"] = data_values
-
-                    # PARSOWANIE SYGNATURY
-                    elif data_name == "neuralnet" and "signature" in data_values:
-                        vehicle_data["signature"] = data_values["signature"]
-                        result["signature"] = data_values["signature"]
-
-                    # PARSOWANIE DANYCH RADARU
-                    elif data_name == "zur" or "radar" in data_source:
-                        result["radar_data"].update(data_values)
-
-                except Exception as e:
-                    logging.warning(f"Błąd parsowania elementu data: {e}")
-                    continue
-
-            # Dodaj dane pojazdu do wyników
-            if vehicle_data["plates"] or vehicle_data["vehicle_info"] or vehicle_data["signature"]:
-                result["vehicles"].append(vehicle_data)
-
-        # Określ czy przetwarzanie było udane
-        result["processing_successful"] = bool(result["plates"] or result["vehicles"] or result["signature"])
-
-        # Stwórz szczegółowe podsumowanie - jak w starej aplikacji
-        result["summary"] = {
-            "plates_detected": len(result["plates"]),
-            "vehicles_detected": len(result["vehicles"]),
-            "has_signature": bool(result["signature"]),
-            "has_timestamp": bool(result["timestamp"]),
-            "has_radar_data": bool(result["radar_data"]),
-            "processing_successful": result["processing_successful"],
-            "best_plate_confidence": max([p["confidence"] for p in result["plates"]], default=0.0),
-            "plate_variants_total": sum([len(v["plates"]) for v in result["vehicles"]]),
-            "exdata_count": len(exdata_elements)
-        }
-
-        return result
-
-    except ET.ParseError as e:
-        error_msg = f"Błąd parsowania XML: {str(e)}"
-        logging.error(error_msg)
-        result["error"] = error_msg
-        result["error_details"] = {
-            "error_type": "xml_parse_error",
-            "xml_preview": xml_content[:200] + "..." if len(xml_content) > 200 else xml_content
-        }
-        return result
-
-    except Exception as e:
-        error_msg = f"Błąd przetwarzania danych XML: {str(e)}"
-        logging.error(error_msg)
-        result["error"] = error_msg
-        result["error_details"] = {
-            "error_type": type(e).__name__,
-            "traceback": traceback.format_exc()
-        }
-        return result
-
-def extract_detailed_plates_from_xml(xml_content: str) -> List[Dict[str, Any]]:
-    """Wyciąga szczegółowe dane tablic z XML w formacie zgodnym ze starą aplikacją"""
-    result = process_ncshot_result_xml_enhanced(xml_content)
-
-    detailed_plates = []
-    for vehicle in result.get("vehicles", []):
-        for plate in vehicle.get("plates", []):
-            # Dodaj informacje o pojeździe do tablicy
-            enhanced_plate = plate.copy()
-            if vehicle.get("vehicle_info"):
-                enhanced_plate.update({
-                    "vehicle_manufacturer": vehicle["vehicle_info"].get("manufacturer", ""),
-                    "vehicle_model": vehicle["vehicle_info"].get("model", ""),
-                    "vehicle_color": vehicle["vehicle_info"].get("color", ""),
-                    "vehicle_type": vehicle["vehicle_info"].get("type", ""),
-                    "vehicle_speed": vehicle["vehicle_info"].get("speed", 0),
-                    "mmr_divergence": vehicle["vehicle_info"].get("mmr_pattern_divergence", 0)
-                })
-
-            enhanced_plate["exdata_index"] = vehicle["exdata_index"]
-            detailed_plates.append(enhanced_plate)
-
-    return detailed_plates
-
-def format_ncshot_summary_enhanced(ncshot_result: Dict[str, Any]) -> str:
-    """Formatuje podsumowanie wyników NCShot w stylu starej aplikacji"""
-    if not ncshot_result.get("processing_successful"):
-        summary = "⚠ī¸ Przetwarzanie nieudane\n"
-        error = ncshot_result.get("error", "Nieznany błąd")
-        summary += f"🔍 Błąd: {error}\n"
-        return summary
-
-    summary = "📊 WYNIKI NCSHOT:\n"
-
-    # Statystyki główne
-    plates_count = ncshot_result["summary"]["plates_detected"]
-    vehicles_count = ncshot_result["summary"]["vehicles_detected"]
-    variants_count = ncshot_result["summary"]["plate_variants_total"]
-
-    summary += f"   🚗 Pojazdy: {vehicles_count}\n"
-    summary += f"   🷏ī¸ Tablice główne: {plates_count}\n"
-    summary += f"   🔄 Warianty tablic: {variants_count}\n"
-
-    # Najlepsze rozpoznanie
-    best_conf = ncshot_result["summary"]["best_plate_confidence"]
-    if best_conf > 0:
-        conf_icon = "🎯" if best_conf > 0.7 else "⚡" if best_conf > 0.4 else "⚠ī¸"
-        summary += f"   {conf_icon} Najlepsze rozpoznanie: {best_conf*100:.1f}%\n"
-
-    # Szczegóły pojazdów
-    if ncshot_result["vehicles"]:
-        summary += "\n🚙 SZCZEGÓŁY POJAZDÓW:\n"
-        for i, vehicle in enumerate(ncshot_result["vehicles"][:3]):  # Pokaż max 3
-            summary += f"   Pojazd {i+1}:\n"
-
-            # Info o pojeździe
-            if vehicle["vehicle_info"]:
-                info = vehicle["vehicle_info"]
-                summary += f"      • {info.get('manufacturer', 'N/A')} {info.get('model', 'N/A')}\n"
-                summary += f"      • Kolor: {info.get('color', 'N/A')}\n"
-                if info.get('speed', 0) > 0:
-                    summary += f"      • Prędkość: {info['speed']:.1f} km/h\n"
-
-            # Najlepszy wariant tablicy
-            if vehicle["plates"]:
-                best_plate = max(vehicle["plates"], key=lambda p: p["confidence"])
-                conf_icon = "✅" if best_plate["confidence"] > 0.7 else "⚡" if best_plate["confidence"] > 0.4 else "⚠ī¸"
-                summary += f"      {conf_icon} {best_plate['symbol']} ({best_plate['country']}) - {best_plate['level']:.0f}%\n"
-
-    # Timestamp
-    if ncshot_result.get("timestamp"):
-        ts = ncshot_result["timestamp"]
-        summary += f"\n⏰ Czas: {ts['date']} {ts['time']}.{ts['ms']}\n"
-
-    return summary
-
 # ===== ULEPSZONA FUNKCJA GENEROWANIA INI (ZASTĄPIONA) =====
 def build_roi_config_ini(package: FullPackage) -> str:
     """
@@ -604,14 +457,22 @@ def validate_image_data(image_data: bytes, image_index: int, is_plate: bool = Fa
     logging.info(f"✅ {'Tablica' if is_plate else 'Obraz'} {image_index}: walidacja przeszła pomyślnie ({len(image_data)} bajtów)")
     return True
 
-def optimize_image_for_ncshot(image_data: bytes) -> bytes:
-    """Optymalizuje obraz dla NCShot (jeśli potrzeba)"""
-    # Jeśli obraz jest za duży, możemy w przyszłości dodać kompresję
-    # Na razie tylko zwracamy oryginalny
-    return image_data
+@instrumented("image_normalize")
+def optimize_image_for_ncshot(image_data: bytes, resize: bool = True) -> bytes:
+    """
+    Normalizuje obraz dla NCShot (skalowanie do IMAGE_NORMALIZE_MAX_DIM, JPEG, bez EXIF).
+
+    Wywoływane przy zapisie do magazynu galerii, a nie przed PUT do NCShot: ROI są rysowane
+    na obrazie z galerii, więc NCShot musi dostać obraz o tych samych wymiarach.
+    `resize=False` dla obrazów, których ROI są już zapisane w pikselach pełnej rozdzielczości
+    (INI terminala) - po zmniejszeniu obrazu nie pasowałyby do niego.
+    """
+    if not IMAGE_NORMALIZE:
+        return image_data
+    return image_normalizer.normalize(image_data, resize=resize)
 
 # ===== POPRAWIONE FUNKCJE POBIERANIA TABLIC =====
-def test_plate_endpoints(token: str) -> List[Tuple[str, int, str]]:
+def test_plate_endpoints(token: str, client: Optional[NcshotClient] = None) -> List[Tuple[str, int, str]]:
     """Testuje różne możliwe endpointy dla obrazów tablic - z lepszą obsługą błędów"""
     possible_endpoints = [
         # Standardowe endpointy
@@ -646,15 +507,13 @@ def test_plate_endpoints(token: str) -> List[Tuple[str, int, str]]:
         f"/plate?token={token}&id=1"
     ]
 
+    client = client or ncshot_client
     working_endpoints = []
 
     for endpoint in possible_endpoints:
         try:
-            test_hc = httplib.HTTPConnection(NCSHOT_HOST, NCSHOT_PORT, timeout=10)
-            test_hc.request("GET", endpoint)
-            test_resp = test_hc.getresponse()
-            test_data = test_resp.read()
-            test_hc.close()
+            test_resp = client.get(endpoint, operation="probe", timeout=10)
+            test_data = test_resp.data
 
             if test_resp.status == 200:
                 if test_data and len(test_data) > 0:
@@ -677,105 +536,112 @@ def test_plate_endpoints(token: str) -> List[Tuple[str, int, str]]:
     return working_endpoints
 
 # 🔧 ULEPSZONA FUNKCJA POBIERANIA TABLIC z natychmiastowym zwolnieniem
-def get_plates_from_ncshot_enhanced_with_immediate_release(token: str, xml_content: str, parsed_xml: Dict[str, Any], image_index: int) -> List[str]:
+def fetch_plate_crop(client: NcshotClient, token: str, number: int, deadline: float) -> Optional[str]:
+    """Pobiera wycinek tablicy `number` jako data URL (None przy błędzie); timeout ograniczony terminem tokenu"""
+    plate_url = f"/vehicleplate?token={token}&number={number}"
+    remaining = deadline - time.monotonic()
+    if remaining <= 0:
+        return None
+    try:
+        logging.info(f"📸 Pobieranie tablicy {number} z: {plate_url}", extra=BATCH_LOG)
+        plate_resp = client.get(plate_url, operation="plate",
+                                timeout=min(remaining, client.timeouts.get("plate", remaining)))
+        return plate_response_to_data_url(plate_resp, number)
+    except Exception as plate_error:
+        logging.error(f"⚠ī¸ EXCEPTION tablica {number}: {plate_error}")
+        return None
+
+def plate_response_to_data_url(plate_resp, number: int) -> Optional[str]:
+    plate_data = plate_resp.data
+    if plate_resp.status == 200 and plate_data and validate_image_data(plate_data, number, is_plate=True):
+        logging.info(f"✅ Pobrano tablicę {number}: {len(plate_data)} bajtów", extra=BATCH_LOG)
+        return f"data:image/jpeg;base64,{base64.b64encode(plate_data).decode('utf-8')}"
+    if plate_resp.status != 200:
+        logging.warning(f"⚠ī¸ Tablica {number}: status={plate_resp.status}")
+    else:
+        logging.warning(f"⚠ī¸ Tablica {number} nie przeszła walidacji")
+    return None
+
+# Wspólna pula pobierania wycinków (limit per token pilnuje okno w get_plates_...) - rozmiar
+# na wszystkie jednocześnie trzymane tokeny, wątki powstają dopiero przy potrzebie
+plate_executor = ThreadPoolExecutor(
+    max_workers=max(1, NCSHOT_MAX_TOKENS * len(ncshot_backends.backends) * max(1, NCSHOT_JOB_WORKERS)
+                    * NCSHOT_PLATE_CONCURRENCY),
+    thread_name_prefix="ncshot-plate")
+
+def get_plates_from_ncshot_enhanced_with_immediate_release(token: str, xml_content: str, parsed_xml: NcshotResult, image_index: int,
+                                                           client: Optional[NcshotClient] = None) -> List[str]:
     """
-    Ulepszona funkcja pobierania tablic z NATYCHMIASTOWYM zarządzaniem pamięcią
+    Pobiera wycinki tablic tokenu: tablica 1 służy jednocześnie za test endpointu, pozostałe
+    są pobierane równolegle (najwyżej NCSHOT_PLATE_CONCURRENCY naraz). Po NCSHOT_PLATE_DEADLINE
+    sekundach niepobrane tablice dostają None, żeby token (i pamięć NCShot) został zwolniony.
     """
-    plates = []
-
-    try:
-        expected_plates = len(parsed_xml.get("vehicles", []))
-
-        if expected_plates == 0:
-            return []
-
-        # Test podstawowego endpointu
-        try:
-            test_hc = httplib.HTTPConnection(NCSHOT_HOST, NCSHOT_PORT, timeout=5)
-            test_hc.request("GET", f"/vehicleplate?token={token}&number=1")
-            test_resp = test_hc.getresponse()
-            test_data = test_resp.read()
-            test_hc.close()
-
-            if test_resp.status == 404:
-                logging.warning(f"⚠ī¸ NCShot nie udostępnia endpointów obrazów tablic (404)")
-                return [None] * expected_plates
-            elif test_resp.status >= 500:
-                logging.warning(f"⚠ī¸ NCShot ma problemy z generowaniem obrazów tablic (status: {test_resp.status})")
-                return [None] * expected_plates
-
-        except Exception as e:
-            logging.warning(f"⚠ī¸ Test endpointu tablic nieudany: {e}")
-            return [None] * expected_plates
-
-        # Pobierz obrazy tablic
-        for j in range(1, expected_plates + 1):
-            try:
-                plate_url = f"/vehicleplate?token={token}&number={j}"
-                logging.info(f"📸 Pobieranie tablicy {j} z: {plate_url}")
-
-                # 🔧 NOWE POŁĄCZENIE dla każdej tablicy (bezpieczniejsze)
-                plate_hc = httplib.HTTPConnection(NCSHOT_HOST, NCSHOT_PORT, timeout=15)
-                plate_hc.request("GET", plate_url)
-                plate_resp = plate_hc.getresponse()
-                plate_data = plate_resp.read()
-                plate_hc.close()  # 🔧 NATYCHMIAST ZAMKNIJ
-
-                if plate_resp.status == 200 and plate_data and validate_image_data(plate_data, j, is_plate=True):
-                    plate_b64 = base64.b64encode(plate_data).decode('utf-8')
-                    plate_image = f"data:image/jpeg;base64,{plate_b64}"
-                    plates.append(plate_image)
-                    logging.info(f"✅ Pobrano tablicę {j}: {len(plate_data)} bajtów")
-                else:
-                    plates.append(None)
-                    if plate_resp.status != 200:
-                        logging.warning(f"⚠ī¸ Tablica {j}: status={plate_resp.status}")
-                    else:
-                        logging.warning(f"⚠ī¸ Tablica {j} nie przeszła walidacji")
-
-                # 🔧 WYMUŚ CZYSZCZENIE po każdej tablicy
-                del plate_data
-
-            except Exception as plate_error:
-                logging.error(f"⚠ī¸ EXCEPTION tablica {j}: {plate_error}")
-                plates.append(None)
+    client = client or ncshot_client
+    expected_plates = len(parsed_xml.vehicles)
+    if expected_plates == 0:
+        return []
 
-        logging.info(f"📊 Pobrano {len([p for p in plates if p])} z {len(plates)} tablic dla obrazu {image_index}")
-        return plates
+    deadline = time.monotonic() + NCSHOT_PLATE_DEADLINE
+    plates: List[Optional[str]] = [None] * expected_plates
 
+    # Test endpointu = pobranie tablicy 1 (wynik wykorzystany, bez ponownego pobierania)
+    try:
+        probe = client.get(f"/vehicleplate?token={token}&number=1", operation="probe",
+                           timeout=min(NCSHOT_PLATE_DEADLINE, client.timeouts.get("probe", NCSHOT_PLATE_DEADLINE)))
     except Exception as e:
-        logging.error(f"⚠ī¸ Błąd analizy XML dla tablic obrazu {image_index}: {e}")
-        return []
+        logging.warning(f"⚠ī¸ Test endpointu tablic nieudany: {e}")
+        return plates
+    if probe.status == 404:
+        logging.warning(f"⚠ī¸ NCShot nie udostępnia endpointów obrazów tablic (404)")
+        return plates
+    if probe.status >= 500:
+        logging.warning(f"⚠ī¸ NCShot ma problemy z generowaniem obrazów tablic (status: {probe.status})")
+        return plates
+    plates[0] = plate_response_to_data_url(probe, 1)
+
+    # Pozostałe tablice równolegle, w oknie NCSHOT_PLATE_CONCURRENCY
+    pending_numbers = list(range(2, expected_plates + 1))
+    in_flight = {}
+    while pending_numbers or in_flight:
+        while pending_numbers and len(in_flight) < max(1, NCSHOT_PLATE_CONCURRENCY):
+            number = pending_numbers.pop(0)
+            in_flight[plate_executor.submit(fetch_plate_crop, client, token, number, deadline)] = number
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+        done, _ = wait(in_flight, timeout=remaining, return_when=FIRST_COMPLETED)
+        for future in done:
+            plates[in_flight.pop(future) - 1] = future.result()
+
+    if in_flight or pending_numbers:
+        for future in in_flight:
+            future.cancel()
+        PLATE_DEADLINE_HITS.inc()
+        logging.warning(f"⏱ī¸ Termin {NCSHOT_PLATE_DEADLINE:g}s pobierania tablic obrazu {image_index} minął - "
+                        f"pomijam {len(in_flight) + len(pending_numbers)} tablic i zwalniam token")
+
+    logging.info(f"📊 Pobrano {len([p for p in plates if p])} z {len(plates)} tablic dla obrazu {image_index}")
+    return plates
 
 # 🔧 NOWA FUNKCJA: Główna funkcja pobierania tablic (wrapper)
-def get_plates_from_ncshot_enhanced(token: str, xml_content: str, parsed_xml: Dict[str, Any], image_index: int) -> List[str]:
+def get_plates_from_ncshot_enhanced(token: str, xml_content: str, parsed_xml: NcshotResult, image_index: int,
+                                    client: Optional[NcshotClient] = None) -> List[str]:
     """
     Pobiera obrazy tablic z NCShot z lepszym zarządzaniem połączeniami
     """
-    return get_plates_from_ncshot_enhanced_with_immediate_release(token, xml_content, parsed_xml, image_index)
+    return get_plates_from_ncshot_enhanced_with_immediate_release(token, xml_content, parsed_xml, image_index, client)
 
-def assign_plate_images_to_data(detailed_plates: List[Dict[str, Any]], plate_images: List[str]) -> List[Dict[str, Any]]:
+def assign_plate_images_to_data(detailed_plates: List[DetailedPlate], plate_images: List[str]) -> List[DetailedPlate]:
     """
-    Przypisuje obrazy tablic do szczegółowych danych
+    Przypisuje obrazy tablic do szczegółowych danych (bez kopiowania danych tablicy)
     """
-    result = []
-
-    for i, plate_data in enumerate(detailed_plates):
-        enhanced_plate = plate_data.copy()
-
-        # Przypisz obraz tablicy jeśli dostępny
-        if i < len(plate_images) and plate_images[i]:
-            enhanced_plate["plate_image"] = plate_images[i]
-            enhanced_plate["has_image"] = True
-        else:
-            enhanced_plate["plate_image"] = None
-            enhanced_plate["has_image"] = False
-
-        result.append(enhanced_plate)
-
-    return result
+    return [
+        plate.with_image(plate_images[i] if i < len(plate_images) else None)
+        for i, plate in enumerate(detailed_plates)
+    ]
 
 # ===== SSH FUNKCJE =====
+@instrumented("ssh_connect")
 def create_ssh_connection(host, username, password, timeout=30):
     """Tworzy bezpieczne połączenie SSH"""
     try:
@@ -803,6 +669,7 @@ def create_ssh_connection(host, username, password, timeout=30):
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Błąd połączenia z {host}: {str(e)}")
 
+@instrumented("ssh_jump")
 def open_via_jump(device_ip: str, device_pass: Optional[str]) -> Tuple[paramiko.SSHClient, paramiko.SSHClient]:
     """Połączenie przez jump host"""
     JUMP_HOST = "10.10.33.113"
@@ -858,21 +725,50 @@ def open_via_jump(device_ip: str, device_pass: Optional[str]) -> Tuple[paramiko.
                 pass
         raise
 
-def connect_to_vm() -> paramiko.SSHClient:
-    """Połączenie bezpośrednio z maszyną wirtualną"""
+def connect_to_vm(host: Optional[str] = None) -> paramiko.SSHClient:
+    """Połączenie bezpośrednio z maszyną wirtualną (domyślnie VM_HOST)"""
     if not VM_PASS:
         raise HTTPException(status_code=500, detail="Brak konfiguracji VM_HOST_PASS")
-    return create_ssh_connection(VM_HOST, VM_USER, VM_PASS)
+    return create_ssh_connection(host or VM_HOST, VM_USER, VM_PASS)
+
+_vm_memory_ssh: Dict[str, paramiko.SSHClient] = {}
+
+def probe_ncshot_vm_memory() -> Dict[str, float]:
+    """Zajętość pamięci VM instancji NCShot (/proc/meminfo) przez utrzymywane połączenia SSH"""
+    usage = {}
+    for host in sorted({backend.host for backend in ncshot_backends.backends}):
+        vm_ssh = _vm_memory_ssh.get(host)
+        try:
+            transport = vm_ssh.get_transport() if vm_ssh else None
+            if transport is None or not transport.is_active():
+                vm_ssh = _vm_memory_ssh[host] = connect_to_vm(host)
+            stdin, stdout, stderr = vm_ssh.exec_command("cat /proc/meminfo", timeout=10)
+            used = parse_meminfo(stdout.read().decode('utf-8', 'ignore'))
+        except Exception as e:
+            logging.warning(f"⚠ī¸ Odczyt pamięci VM {host} nieudany: {getattr(e, 'detail', e)}")
+            conn = _vm_memory_ssh.pop(host, None)
+            if conn:
+                conn.close()
+            continue
+        if used is not None:
+            usage[host] = used
+    return usage
+
+def close_vm_memory_connections() -> None:
+    while _vm_memory_ssh:
+        _, vm_ssh = _vm_memory_ssh.popitem()
+        vm_ssh.close()
 
+@instrumented("ssh_exec")
 def execute_and_log(dev: paramiko.SSHClient, command: str) -> Tuple[str, str]:
-    logging.info(f"🖥ī¸ Wykonuję: {command}")
+    logging.info(f"🖥ī¸ Wykonuję: {command}", extra=SSH_LOG)
     try:
         stdin, stdout, stderr = dev.exec_command(command, timeout=30)
         stdout_str = stdout.read().decode('utf-8', 'ignore').strip()
         stderr_str = stderr.read().decode('utf-8', 'ignore').strip()
 
         if stdout_str:
-            logging.info(f"  ✅ [STDOUT]: {stdout_str[:200]}{'...' if len(stdout_str) > 200 else ''}")
+            logging.info(f"  ✅ [STDOUT]: {stdout_str[:200]}{'...' if len(stdout_str) > 200 else ''}", extra=SSH_LOG)
         if stderr_str:
             logging.warning(f"  ⚠ī¸ [STDERR]: {stderr_str[:200]}{'...' if len(stderr_str) > 200 else ''}")
 
@@ -882,256 +778,552 @@ def execute_and_log(dev: paramiko.SSHClient, command: str) -> Tuple[str, str]:
         return "", str(e)
 
 # ===== GŁÓWNA ULEPSZONA FUNKCJA NCSHOT =====
-def start_ncshot_with_config_safe(package: FullPackage, image_files: List[str]) -> Dict[str, Any]:
-    """
-    NAPRAWIONA WERSJA - zarządzanie pamięcią na podstawie starego kodu
-    """
-    logging.info(f"🚀 === NCSHOT PROFESSIONAL - NAPRAWIONA WERSJA PAMIĘCI ===")
-    logging.info(f"   🏠 VM: {NCSHOT_HOST}:{NCSHOT_PORT}")
-    logging.info(f"   🖼ī¸ Liczba obrazów: {len(image_files)}")
-    logging.info(f"   🎯 Liczba ROI: {len(package.rois)}")
+def build_ncshot_file_result(xml_content: str, parsed_xml: NcshotResult) -> Dict[str, Any]:
+    """Buduje wynik obrazu (kształt image_{i}) z XML NCShot"""
+    return {
+        "xml": xml_content,
+        "plates": [],
+        "parsed_data": parsed_xml,
+        "detailed_plates": extract_detailed_plates(parsed_xml),
+        "summary": format_ncshot_summary_enhanced(parsed_xml)
+    }
 
-    vm_ssh = None
-    try:
-        # 1. Połącz się z maszyną wirtualną przez SSH
-        vm_ssh = connect_to_vm()
-        vm_sftp = vm_ssh.open_sftp()
+def plate_data_url_to_bytes(plate: Optional[str]) -> Optional[bytes]:
+    return base64.b64decode(plate.split(',', 1)[1]) if plate else None
 
-        # 2. Wygeneruj konfigurację INI
-        ini_config = build_roi_config_ini(package)
-        logging.info(f"📋 Wygenerowana konfiguracja INI ({len(ini_config)} znaków)")
+def plate_bytes_to_data_url(plate: Optional[bytes]) -> Optional[str]:
+    return f"data:image/jpeg;base64,{base64.b64encode(plate).decode('utf-8')}" if plate else None
 
-        # 3. Skopiuj konfigurację na maszynę wirtualną
-        config_path = "/neurocar/etc/ncshot.d/tmp.ini"
-        logging.info(f"📤 Kopiuję konfigurację do: {config_path}")
+def load_cached_ncshot_result(i: int, cache_key: str, outcome: Dict[str, Any]) -> bool:
+    """Wypełnia `outcome` wynikiem z cache; zwraca False przy braku wpisu"""
+    cached = result_cache.get(cache_key)
+    if cached is None:
+        return False
 
-        execute_and_log(vm_ssh, "mkdir -p /neurocar/etc/ncshot.d")
-        vm_sftp.putfo(io.BytesIO(ini_config.encode('utf-8')), config_path)
+    logging.info(f"💾 Obraz {i}: wynik z cache - pomijam wysyłanie do NCShot")
+    parsed_xml = parse_ncshot_result(cached.xml)
+    file_result = build_ncshot_file_result(cached.xml, parsed_xml)
+    if cached.plates:
+        plates = [plate_bytes_to_data_url(p) for p in cached.plates]
+        file_result["plates"] = plates
+        file_result["detailed_plates_with_images"] = assign_plate_images_to_data(
+            file_result["detailed_plates"], plates
+        )
+    file_result["from_cache"] = True
 
-        vm_sftp.close()
-        vm_ssh.close()
-        vm_ssh = None
+    if parsed_xml.processing_successful:
+        outcome["plates"] = parsed_xml.summary["plates_detected"]
+        outcome["vehicles"] = parsed_xml.summary["vehicles_detected"]
+    outcome.update({"status": "ok", "file_result": file_result, "cache_hit": True})
+    return True
 
-        # 4. Test dostępności NCShot
-        logging.info(f"🏠 Sprawdzanie dostępności NCShot HTTP API...")
+def read_ncshot_image(image: Union[str, Path]) -> bytes:
+    """Zwraca bajty obrazu wsadu: data URL/base64 z JSON albo plik przesłany jako multipart"""
+    if isinstance(image, Path):
+        return image.read_bytes()
+    if image.startswith('data:image'):
+        header, data = image.split(',', 1)
+        return base64.b64decode(data)
+    return base64.b64decode(image)
+
+@contextmanager
+def batch_stage(batch: Dict[str, Any], name: str):
+    """Etap przetwarzania obrazu: czas (histogram /metrics + czasy wsadu w _stats) i pamięć"""
+    with timed(name, batch["timings"]), batch["memory"].stage(name):
+        yield
+
+def process_ncshot_image(i: int, image: Union[str, Path], total: int, engine: NcshotBatchEngine,
+                         batch: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Przetwarza jeden obraz wsadu NCShot: dekodowanie, PUT, parsowanie XML, tablice, zwolnienie tokenu.
+
+    `batch` zawiera konfigurację wsadu: `ini_config`, `ini_hash`, `slot`, listę `config_pushes`
+    i zbiór `config_reported` (instancje z odnotowanym wgraniem/pominięciem konfiguracji).
+    Obraz trafia do najmniej obciążonej dostępnej instancji NCShot; przy bad_alloc/5xx
+    breaker instancji zostaje otwarty, a obraz jest ponawiany na kolejnej instancji.
+
+    Zwraca {"status": "ok" | "failed" | "aborted", "file_result", "plates", "vehicles", "backend"}.
+    """
+    outcome = {"status": "failed", "file_result": None, "plates": 0, "vehicles": 0,
+               "cache_hit": False, "cache_miss": False, "backend": None}
+    try:
+        logging.info(f"🖼ī¸ === PRZETWARZANIE OBRAZU {i+1}/{total} ===", extra=BATCH_LOG)
+
+        # 🔧 BEZPIECZNE dekodowanie obrazu (poza slotem tokenu - nakłada się z innymi obrazami)
         try:
-            test_hc = httplib.HTTPConnection(NCSHOT_HOST, NCSHOT_PORT, timeout=10)
-            test_hc.request("GET", "/")
-            test_resp = test_hc.getresponse()
-            test_resp.read()  # Przeczytaj response
-            test_hc.close()
-            logging.info(f"✅ NCShot HTTP API odpowiada: {test_resp.status}")
+            with batch_stage(batch, "decode"):
+                image_data = read_ncshot_image(image)
+
+            if not validate_image_data(image_data, i):
+                return outcome
+
         except Exception as e:
-            logging.error(f"⚠ī¸ NCShot HTTP API nie odpowiada: {e}")
-            raise HTTPException(status_code=503, detail=f"NCShot nie jest dostępny: {e}")
+            logging.error(f"⚠ī¸ Błąd dekodowania obrazu {i}: {e}")
+            return outcome
+
+        # Ten sam obraz z tą samą konfiguracją INI - wynik z cache, bez PUT do NCShot
+        cache_key = None
+        if result_cache.enabled:
+            cache_key = NcshotResultCache.make_key(sha256_hex(image_data), batch["ini_hash"], NCSHOT_IMAGE_FLAGS)
+            with batch_stage(batch, "cache_lookup"):
+                hit = load_cached_ncshot_result(i, cache_key, outcome)
+            if hit:
+                NCSHOT_CACHE_HITS.inc()
+                return outcome
+            outcome["cache_miss"] = True
+
+        with engine.token_slot():
+            tried = []
+            waited = 0.0
+            while True:
+                # Wsad mógł zostać przerwany, gdy obraz czekał na slot tokenu
+                if engine.aborted:
+                    outcome["status"] = "aborted"
+                    return outcome
+
+                # Globalny limit obrazów w NCShot - ponad limit obraz czeka w kolejce
+                with admission.slot(), ncshot_backends.dispatch(exclude=tried) as backend:
+                    if backend is not None:
+                        tried.append(backend.name)
+                        outcome["backend"] = backend.name
+                        if not send_image_to_backend(backend, i, image_data, batch, cache_key, outcome):
+                            return outcome
+
+                if backend is not None:
+                    logging.warning(f"🔁 Obraz {i}: ponawiam na innej instancji NCShot (wykluczone: {tried})")
+                    continue
+
+                # Wszystkie instancje wyłączone - poczekaj na zamknięcie breakera zamiast przerywać wsad
+                delay = ncshot_backends.next_available_in()
+                if delay <= 0 or waited + delay > NCSHOT_ADMISSION_MAX_WAIT:
+                    engine.abort("brak dostępnych instancji NCShot")
+                    outcome["status"] = "aborted"
+                    return outcome
+                logging.warning(f"⏳ Obraz {i}: brak dostępnych instancji NCShot - czekam {delay:.0f}s")
+                if not engine.pause(delay):
+                    outcome["status"] = "aborted"
+                    return outcome
+                waited += delay
+                tried = []
+
+    except Exception as e:
+        logging.error(f"⚠ī¸ BŁĄD ZEWNĘTRZNY obrazu {i}: {e}")
+        outcome["status"] = "failed"
+        return outcome
+
+def send_image_to_backend(backend: NcshotBackend, i: int, image_data: bytes, batch: Dict[str, Any],
+                          cache_key: Optional[str], outcome: Dict[str, Any]) -> bool:
+    """
+    Wysyła obraz do jednej instancji NCShot i wypełnia `outcome`.
+    Zwraca True, gdy instancja zawiodła (bad_alloc/5xx, brak konfiguracji) i obraz należy ponowić gdzie indziej.
+    """
+    client = backend.client
+
+    # Konfiguracja wgrywana leniwie - tylko do instancji, które faktycznie dostają obrazy
+    try:
+        with batch_stage(batch, "config"):
+            push = ensure_backend_config(backend, batch["ini_config"], batch["ini_hash"], batch["slot"],
+                                         batch["config_reported"])
+        if push is not None:
+            batch["config_pushes"].append(push)
+    except Exception as e:
+        logging.error(f"⚠ī¸ Nie udało się wgrać konfiguracji do {backend.name}: {e}")
+        backend.record_failure(f"konfiguracja: {getattr(e, 'detail', e)}", fatal=True)
+        return True
+
+    logging.info(f"📊 Wysyłanie obrazu do {backend.name}: {len(image_data)} bajtów", extra=BATCH_LOG)
 
-        # 5. Wyślij konfigurację przez HTTP
+    # Połączenie z puli keep-alive - jedno żądanie na obraz, bez nowego połączenia
+    token = None
+    try:
+        started = time.monotonic()
         try:
-            logging.info("📤 Wysyłam konfigurację do NCShot przez HTTP API...")
-            config_hc = httplib.HTTPConnection(NCSHOT_HOST, NCSHOT_PORT, timeout=30)
-            config_hc.request("PUT", "/config/tmp", ini_config.encode('utf-8'), {
-                "Content-Type": "text/plain",
-                "Content-Length": str(len(ini_config.encode('utf-8')))
-            })
-            config_resp = config_hc.getresponse()
-            config_content = config_resp.read()
-            config_hc.close()
-
-            if config_resp.status != 200:
-                logging.error(f"⚠ī¸ NCShot odrzucił konfigurację: {config_resp.status}")
-                raise HTTPException(status_code=500, detail=f"NCShot odrzucił konfigurację")
-            else:
-                logging.info("✅ Konfiguracja zaakceptowana przez NCShot")
-        except HTTPException:
+            with batch_stage(batch, "ncshot"):
+                resp = client.put(f"/{batch['slot']}?{NCSHOT_IMAGE_FLAGS}", image_data, "image/jpeg",
+                                  operation="image")
+        except (OSError, http.client.HTTPException) as e:
+            # Brak połączenia/timeout - instancja padła w trakcie wsadu: breaker i ponowienie gdzie indziej
+            admission.record(time.monotonic() - started, overloaded=True)
+            logging.error(f"💥 Błąd połączenia z NCShot {backend.name} dla obrazu {i}: {e}")
+            backend.record_failure(str(e))
+            config_tracker.invalidate(backend.name)
+            return True
+        except Exception:
+            admission.record(time.monotonic() - started, overloaded=True)
             raise
-        except Exception as e:
-            logging.error(f"⚠ī¸ Błąd wysyłania konfiguracji przez HTTP: {e}")
-            raise HTTPException(status_code=500, detail=f"Błąd konfiguracji NCShot: {e}")
+        admission.record(time.monotonic() - started,
+                         overloaded=resp.status >= 500 or (resp.status != 200 and b"bad_alloc" in resp.data))
+
+        logging.info(f"📨 Odpowiedź dla obrazu {i}: {resp.status} {resp.reason}", extra=BATCH_LOG)
+
+        if resp.status != 200:
+            error_content = resp.data
+            logging.error(f"⚠ī¸ Błąd przetwarzania obrazu {i}: {resp.status}")
+
+            # 🔧 WAŻNE: Wyłącz instancję przy błędzie pamięci
+            if b"bad_alloc" in error_content or resp.status >= 500:
+                logging.error(f"💥 Wykryto błąd pamięci w NCShot {backend.name} - wyłączam instancję")
+                backend.record_failure(f"status {resp.status}", fatal=True)
+                # NCShot mógł zostać zrestartowany - wymuś ponowne wgranie konfiguracji
+                config_tracker.invalidate(backend.name)
+                return True
+
+            outcome["status"] = "failed"
+            return False
+
+        token = resp.getheader("ncshot-token")
+        xml_content = resp.data
 
-        # 6. GŁÓWNE PRZETWARZANIE - ALGORYTM ZE STAREGO KODU
-        result = {}
-        failed_images = 0
-        total_plates = 0
-        total_vehicles = 0
+        # 🔧 KONWERTUJ NA STRING JEŚLI TO BYTES
+        if isinstance(xml_content, bytes):
+            xml_content = xml_content.decode('utf-8')
 
-        # KLUCZOWA ZMIANA: Przetwarzaj obrazy PO JEDNYM (jak w starym kodzie)
-        for i, image_b64 in enumerate(image_files):
+        if token:
+            token_leases.acquire(backend.name, token, owner=batch["id"])
+            logging.info(f"🎫 Otrzymano token: {token}", extra=BATCH_LOG)
+
+        logging.info(f"📄 Otrzymano XML ({len(xml_content)} znaków)", extra=BATCH_LOG)
+
+        # Parsuj XML
+        with batch_stage(batch, "parse"):
+            parsed_xml = parse_ncshot_result(xml_content)
+            file_result = build_ncshot_file_result(xml_content, parsed_xml)
+        cacheable = True
+
+        # Aktualizuj statystyki
+        if parsed_xml.processing_successful:
+            outcome["plates"] = parsed_xml.summary["plates_detected"]
+            outcome["vehicles"] = parsed_xml.summary["vehicles_detected"]
+
+        # 🔧 POBIERZ TABLICE i ZWOLNIJ TOKEN od razu
+        if token:
             try:
-                logging.info(f"🖼ī¸ === PRZETWARZANIE OBRAZU {i+1}/{len(image_files)} ===")
+                with batch_stage(batch, "plates"):
+                    plates = get_plates_from_ncshot_enhanced(token, xml_content, parsed_xml, i, client)
+                file_result["plates"] = plates
+                file_result["detailed_plates_with_images"] = assign_plate_images_to_data(
+                    file_result["detailed_plates"], plates
+                )
+            except Exception as plate_error:
+                logging.error(f"⚠ī¸ Błąd pobierania tablic: {plate_error}")
+                file_result["plates"] = []
+                cacheable = False
+
+            # 🔧 NATYCHMIAST ZWOLNIJ TOKEN (krytyczne dla pamięci) - nieudane zwolnienie ponawia wątek w tle
+            with batch_stage(batch, "release"):
+                if token_leases.release(backend.name, token):
+                    logging.info(f"🗑ī¸ Token {token} zwolniony natychmiast", extra=BATCH_LOG)
+
+        backend.record_success()
+        outcome["status"] = "ok"
+        outcome["file_result"] = file_result
+
+        # Nie zapisuj wyniku, gdy żadnej tablicy nie udało się pobrać (możliwy chwilowy błąd NCShot)
+        plates = file_result["plates"]
+        if plates and not any(plates):
+            cacheable = False
+        if cache_key and cacheable:
+            result_cache.put(cache_key, xml_content, [plate_data_url_to_bytes(p) for p in plates])
 
-                # 🔧 BEZPIECZNE dekodowanie obrazu
-                try:
-                    if image_b64.startswith('data:image'):
-                        header, data = image_b64.split(',', 1)
-                        image_data = base64.b64decode(data)
-                    else:
-                        image_data = base64.b64decode(image_b64)
+        return False
 
-                    if not validate_image_data(image_data, i):
-                        failed_images += 1
-                        continue
+    except Exception as e:
+        logging.error(f"⚠ī¸ KRYTYCZNY BŁĄD obrazu {i} ({backend.name}): {e}")
+        if token:
+            # Zawsze zwolnij token nawet przy błędzie (no-op, jeśli już zwolniony)
+            if token_leases.release(backend.name, token):
+                logging.info(f"🗑ī¸ Token {token} zwolniony po błędzie")
 
-                except Exception as e:
-                    logging.error(f"⚠ī¸ Błąd dekodowania obrazu {i}: {e}")
-                    failed_images += 1
-                    continue
+        outcome["status"] = "failed"
+        return False
 
-                logging.info(f"📊 Wysyłanie obrazu: {len(image_data)} bajtów")
+_config_push_locks: Dict[Tuple[str, str], threading.Lock] = {}
+_config_push_locks_guard = threading.Lock()
 
-                # 🔧 KLUCZOWA ZMIANA: NOWE POŁĄCZENIE dla każdego obrazu (jak w starym kodzie)
-                hc = None
-                token = None
-                try:
-                    hc = httplib.HTTPConnection(NCSHOT_HOST, NCSHOT_PORT, timeout=60)
+def ensure_backend_config(backend: NcshotBackend, ini_config: str, ini_hash: str, slot: str,
+                          reported: Set[str]) -> Optional[Dict[str, Any]]:
+    """
+    Wgrywa konfigurację slotu do instancji, jeśli jeszcze jej nie ma. Wątki wsadu wysyłające
+    obrazy do tej samej instancji czekają na jedno wgranie zamiast wgrywać równolegle.
 
-                    # 🔧 BEZPIECZNE wysyłanie
-                    hc.request("PUT", "/tmp?anpr=1&mmr=1&diagnostic=1", image_data, {
-                        "Content-Type": "image/jpeg",
-                        "Content-Length": str(len(image_data))
-                    })
-                    resp = hc.getresponse()
-
-                    logging.info(f"📨 Odpowiedź dla obrazu {i}: {resp.status} {resp.reason}")
-
-                    if resp.status != 200:
-                        error_content = resp.read()
-                        hc.close()
-                        logging.error(f"⚠ī¸ Błąd przetwarzania obrazu {i}: {resp.status}")
-
-                        # 🔧 WAŻNE: Przerwij przy błędzie pamięci
-                        if b"bad_alloc" in error_content or resp.status >= 500:
-                            logging.error("💥 Wykryto błąd pamięci w NCShot - przerywam przetwarzanie")
-                            break
-
-                        failed_images += 1
-                        continue
-
-                    token = resp.getheader("ncshot-token")
-                    xml_content = resp.read()
-
-                    # 🔧 KONWERTUJ NA STRING JEŚLI TO BYTES
-                    if isinstance(xml_content, bytes):
-                        xml_content = xml_content.decode('utf-8')
-
-                    hc.close()  # 🔧 ZAMKNIJ od razu po odebraniu XML
-
-                    if token:
-                        logging.info(f"🎫 Otrzymano token: {token}")
-
-                    logging.info(f"📄 Otrzymano XML ({len(xml_content)} znaków)")
-
-                    # Parsuj XML
-                    parsed_xml = process_ncshot_result_xml_enhanced(xml_content)
-
-                    file_result = {
-                        "xml": xml_content,  # Już jest stringiem po konwersji
-                        "plates": [],
-                        "parsed_data": parsed_xml,
-                        "detailed_plates": extract_detailed_plates_from_xml(xml_content),
-                        "summary": format_ncshot_summary_enhanced(parsed_xml)
-                    }
-
-                    # Aktualizuj statystyki
-                    if parsed_xml["processing_successful"]:
-                        total_plates += parsed_xml["summary"]["plates_detected"]
-                        total_vehicles += parsed_xml["summary"]["vehicles_detected"]
-
-                    # 🔧 POBIERZ TABLICE i ZWOLNIJ TOKEN od razu
-                    if token:
-                        try:
-                            plates = get_plates_from_ncshot_enhanced(token, xml_content, parsed_xml, i)
-                            file_result["plates"] = plates
-                            file_result["detailed_plates_with_images"] = assign_plate_images_to_data(
-                                file_result["detailed_plates"], plates
-                            )
-                        except Exception as plate_error:
-                            logging.error(f"⚠ī¸ Błąd pobierania tablic: {plate_error}")
-                            file_result["plates"] = []
-
-                        # 🔧 NATYCHMIAST ZWOLNIJ TOKEN (krytyczne dla pamięci)
-                        try:
-                            release_hc = httplib.HTTPConnection(NCSHOT_HOST, NCSHOT_PORT, timeout=10)
-                            release_hc.request("GET", f"/release?token={token}")
-                            release_resp = release_hc.getresponse()
-                            release_resp.read()
-                            release_hc.close()
-                            logging.info(f"🗑ī¸ Token {token} zwolniony natychmiast")
-                        except Exception as release_error:
-                            logging.error(f"⚠ī¸ KRYTYCZNY: Błąd zwalniania tokenu {token}: {release_error}")
-                            # To jest krytyczne - token nie zwolniony = przeciek pamięci
-
-                    result[f"image_{i}"] = file_result
-
-                    # 🔧 WYMUŚ CZYSZCZENIE PAMIĘCI po każdym obrazie
-                    import gc
-                    del image_data  # Jawnie usuń duże dane
-                    gc.collect()    # Wymuś garbage collection
-
-                except Exception as e:
-                    logging.error(f"⚠ī¸ KRYTYCZNY BŁĄD obrazu {i}: {e}")
-                    if hc:
-                        try:
-                            hc.close()
-                        except:
-                            pass
-                    if token:
-                        # Zawsze próbuj zwolnić token nawet przy błędzie
-                        try:
-                            release_hc = httplib.HTTPConnection(NCSHOT_HOST, NCSHOT_PORT, timeout=5)
-                            release_hc.request("GET", f"/release?token={token}")
-                            release_resp = release_hc.getresponse()
-                            release_resp.read()
-                            release_hc.close()
-                            logging.info(f"🗑ī¸ Token {token} zwolniony po błędzie")
-                        except:
-                            logging.error(f"⚠ī¸ KRYTYCZNY: Nie udało się zwolnić tokenu {token} po błędzie")
-
-                    failed_images += 1
-                    continue
+    `reported` to instancje, dla których wsad odnotował już wgranie albo pominięcie konfiguracji.
+    Zwraca wynik push_ncshot_config (także pominięcie niezmienionej konfiguracji - raz na
+    instancję we wsadzie) albo None, gdy wsad już wie, że konfiguracja jest aktualna.
+    """
+    if backend.name in reported and config_tracker.is_current(backend.name, slot, ini_hash):
+        return None
+    with _config_push_locks_guard:
+        lock = _config_push_locks.setdefault((backend.name, slot), threading.Lock())
+    with lock:
+        first = backend.name not in reported
+        reported.add(backend.name)
+        if not first and config_tracker.is_current(backend.name, slot, ini_hash):
+            return None
+        return push_ncshot_config(backend, ini_config, ini_hash, slot)
+
+def copy_ncshot_config_to_vm(backend: NcshotBackend, ini_config: str, slot: str) -> None:
+    """Zapisuje plik INI slotu na VM instancji (SFTP)"""
+    vm_ssh = None
+    try:
+        vm_ssh = connect_to_vm(backend.host)
+        vm_sftp = vm_ssh.open_sftp()
 
-            except Exception as e:
-                logging.error(f"⚠ī¸ BŁĄD ZEWNĘTRZNY obrazu {i}: {e}")
-                failed_images += 1
-                continue
+        config_path = f"/neurocar/etc/ncshot.d/{slot}.ini"
+        logging.info(f"📤 Kopiuję konfigurację do: {backend.host}:{config_path}")
 
-        # 🔧 WYMUŚ OSTATECZNE CZYSZCZENIE PAMIĘCI
-        import gc
-        gc.collect()
-
-        logging.info(f"✅ === NCSHOT PROFESSIONAL ZAKOŃCZONY ===")
-        logging.info(f"   📊 Pomyślnie: {len(result)} obrazów")
-        logging.info(f"   ⚠ī¸ Błędy: {failed_images} obrazów")
-        logging.info(f"   🚗 Pojazdy: {total_vehicles}")
-        logging.info(f"   🷏ī¸ Tablice: {total_plates}")
-
-        # Rozszerzone statystyki
-        result["_stats"] = {
-            "processed": len(result) - 1,
-            "failed": failed_images,
-            "total": len(image_files),
-            "total_vehicles": total_vehicles,
-            "total_plates": total_plates,
-            "processing_time": datetime.now().isoformat(),
-            "success_rate": (len(result) - 1) / len(image_files) * 100 if image_files else 0,
-            "memory_management": "improved_with_immediate_token_release"
-        }
+        execute_and_log(vm_ssh, "mkdir -p /neurocar/etc/ncshot.d")
+        vm_sftp.putfo(io.BytesIO(ini_config.encode('utf-8')), config_path)
+        vm_sftp.close()
+    finally:
+        if vm_ssh:
+            vm_ssh.close()
 
-        return result
+def remove_evicted_ncshot_slots(backend: NcshotBackend, evicted: List[str]) -> None:
+    """Usuwa eksmitowane sloty z NCShot (DELETE, jeśli wersja NCShot go obsługuje) i ich pliki INI z VM"""
+    for name in evicted:
+        try:
+            delete_resp = backend.client.request("DELETE", f"/config/{name}", operation="config")
+            logging.info(f"🧹 Usunięto slot konfiguracji {name}: {delete_resp.status}")
+        except Exception as e:
+            logging.warning(f"⚠ī¸ Nie udało się usunąć slotu konfiguracji {name}: {e}")
 
+    if not NCSHOT_CONFIG_VIA_SSH:
+        return
+    vm_ssh = None
+    try:
+        vm_ssh = connect_to_vm(backend.host)
+        stale_paths = " ".join(f"/neurocar/etc/ncshot.d/{name}.ini" for name in evicted)
+        execute_and_log(vm_ssh, f"rm -f {stale_paths}")
     except Exception as e:
-        logging.error(f"⚠ī¸ KRYTYCZNY BŁĄD NCShot: {e}")
-        # 🔧 Cleanup przy błędzie
-        import gc
-        gc.collect()
-        raise e
+        logging.warning(f"⚠ī¸ Nie udało się usunąć plików eksmitowanych slotów z {backend.host}: {e}")
     finally:
         if vm_ssh:
             vm_ssh.close()
 
+def push_ncshot_config(backend: NcshotBackend, ini_config: str, ini_hash: str, slot: str = "tmp") -> Dict[str, Any]:
+    """
+    Wgrywa konfigurację INI na VM instancji (SSH/SFTP) i do NCShot (PUT /config/<slot>).
+    Oba kroki są pomijane, gdy slot NCShot ma już konfigurację o tym samym hashu.
+    Sloty eksmitowane (LRU) są usuwane dopiero po potwierdzeniu nowej konfiguracji przez NCShot.
+    """
+    if config_tracker.is_current(backend.name, slot, ini_hash):
+        saved = config_tracker.record_skip(backend.name, slot)
+        logging.info(f"⏭ī¸ Konfiguracja {ini_hash[:12]} już załadowana w {backend.name} - pomijam SSH i PUT (oszczędność {saved:.2f}s)")
+        return {"backend": backend.name, "pushed": False, "slot": slot, "hash": ini_hash, "push_time": 0.0,
+                "time_saved": saved, "evicted_slots": []}
+
+    started = time.monotonic()
+    evicted = config_slots.plan_eviction(backend.name, keep=slot)
+
+    # Skopiuj konfigurację na maszynę wirtualną
+    if NCSHOT_CONFIG_VIA_SSH:
+        copy_ncshot_config_to_vm(backend, ini_config, slot)
+
+    # Wyślij konfigurację przez HTTP
+    try:
+        logging.info(f"📤 Wysyłam konfigurację do NCShot {backend.name} przez HTTP API...")
+        config_resp = backend.client.put(f"/config/{slot}", ini_config.encode('utf-8'), "text/plain",
+                                         operation="config")
+
+        if config_resp.status != 200:
+            logging.error(f"⚠ī¸ NCShot odrzucił konfigurację: {config_resp.status}")
+            raise HTTPException(status_code=500, detail=f"NCShot odrzucił konfigurację")
+        else:
+            logging.info("✅ Konfiguracja zaakceptowana przez NCShot")
+    except HTTPException:
+        config_tracker.invalidate(backend.name, slot)
+        raise
+    except Exception as e:
+        logging.error(f"⚠ī¸ Błąd wysyłania konfiguracji przez HTTP: {e}")
+        config_tracker.invalidate(backend.name, slot)
+        raise HTTPException(status_code=500, detail=f"Błąd konfiguracji NCShot: {e}")
+
+    push_time = time.monotonic() - started
+    config_tracker.mark_pushed(backend.name, slot, ini_hash, push_time)
+
+    # Konfiguracja potwierdzona - dopiero teraz zwolnij eksmitowane sloty i usuń je z rejestru stanu
+    if evicted:
+        remove_evicted_ncshot_slots(backend, evicted)
+        config_slots.commit_eviction(backend.name, evicted)
+    return {"backend": backend.name, "pushed": True, "slot": slot, "hash": ini_hash, "push_time": push_time,
+            "time_saved": 0.0, "evicted_slots": evicted}
+
+def check_ncshot_backends() -> List[NcshotBackend]:
+    """Sprawdza równolegle wszystkie instancje NCShot; niedostępne dostają otwarty breaker"""
+    def check(backend: NcshotBackend) -> bool:
+        try:
+            test_resp = backend.client.get("/", operation="health", timeout=10)
+            logging.info(f"✅ NCShot {backend.name} odpowiada: {test_resp.status}")
+            return True
+        except Exception as e:
+            logging.error(f"⚠ī¸ NCShot {backend.name} nie odpowiada: {e}")
+            backend.record_failure(f"health: {e}", fatal=True)
+            # NCShot mógł zostać zrestartowany - załadowana konfiguracja jest nieznana
+            config_tracker.invalidate(backend.name)
+            return False
+
+    candidates = ncshot_backends.available()
+    with ThreadPoolExecutor(max_workers=max(1, len(candidates))) as executor:
+        healthy = list(executor.map(check, candidates))
+    return [backend for backend, ok in zip(candidates, healthy) if ok]
+
+def ncshot_batch_window(healthy_backends: int) -> Tuple[int, int]:
+    """Okno wsadu i limit tokenów skalowane liczbą zdrowych instancji NCShot"""
+    scale = max(1, healthy_backends)
+    return NCSHOT_BATCH_WINDOW * scale, NCSHOT_MAX_TOKENS * scale
+
+@contextmanager
+def ncshot_batch_context(package: FullPackage):
+    """
+    Przygotowanie wsadu wspólne dla wszystkich jego porcji: konfiguracja INI, slot konfiguracji
+    zarezerwowany na wszystkich instancjach (zwalniany po wyjściu z bloku) i test dostępności.
+    Zwraca (batch, zdrowe instancje).
+    """
+    config_slot = None
+    try:
+        # 1. Wygeneruj konfigurację INI i zarezerwuj slot (lokalizacja, hash INI) na wszystkich instancjach
+        ini_config = build_roi_config_ini(package)
+        ini_hash = sha256_hex(ini_config.encode('utf-8'))
+        config_slot = config_slots.slot_name(package.deployment.locationId, ini_hash)
+        for backend in ncshot_backends.backends:
+            config_slots.acquire(backend.name, package.deployment.locationId, ini_hash)
+        logging.info(f"📋 Wygenerowana konfiguracja INI ({len(ini_config)} znaków), slot: {config_slot}")
+
+        # 2. Test dostępności instancji NCShot
+        logging.info(f"🏠 Sprawdzanie dostępności NCShot HTTP API...")
+        healthy = check_ncshot_backends()
+        if not healthy:
+            raise HTTPException(status_code=503, detail="Żadna instancja NCShot nie jest dostępna")
+
+        # 3. Konfiguracja (SSH + HTTP) wgrywana leniwie przy pierwszym obrazie dla danej instancji
+        # Pamięć mierzona per etap; GC tylko po przekroczeniu progu wzrostu RSS (nie po każdym obrazie)
+        batch = {"id": uuid.uuid4().hex, "ini_config": ini_config, "ini_hash": ini_hash, "slot": config_slot, "config_pushes": [],
+                 "config_reported": set(), "memory": MemoryMonitor(NCSHOT_GC_THRESHOLD_MB * 1024 * 1024),
+                 "timings": StageTimings()}
+        yield batch, healthy
+    except Exception as e:
+        logging.error(f"⚠ī¸ KRYTYCZNY BŁĄD NCShot: {e}")
+        raise e
+    finally:
+        if config_slot:
+            for backend in ncshot_backends.backends:
+                config_slots.release(backend.name, config_slot)
+
+@instrumented("ncshot_batch")
+def start_ncshot_with_config_safe(package: FullPackage, image_files: List[Union[str, Path]],
+                                  engine: Optional[NcshotBatchEngine] = None,
+                                  on_image_result: Optional[Callable[[int, Dict[str, Any]], None]] = None) -> Dict[str, Any]:
+    """
+    NAPRAWIONA WERSJA - zarządzanie pamięcią na podstawie starego kodu
+
+    `image_files` to data URL/base64 (JSON) albo ścieżki plików przesłanych jako multipart.
+    `on_image_result(index, outcome)` jest wywoływane z wątków wsadu po każdym obrazie.
+    """
+    logging.info(f"🚀 === NCSHOT PROFESSIONAL - NAPRAWIONA WERSJA PAMIĘCI ===")
+    logging.info(f"   🏠 Instancje NCShot: {[b.name for b in ncshot_backends.backends]}")
+    logging.info(f"   🖼ī¸ Liczba obrazów: {len(image_files)}")
+    logging.info(f"   🎯 Liczba ROI: {len(package.rois)}")
+
+    with ncshot_batch_context(package) as (batch, healthy):
+        if engine is None:
+            window, max_tokens = ncshot_batch_window(len(healthy))
+            engine = NcshotBatchEngine(window=window, max_outstanding_tokens=max_tokens)
+        return run_ncshot_batch(batch, healthy, image_files, engine, on_image_result)
+
+def run_ncshot_batch(batch: Dict[str, Any], healthy: List[NcshotBackend], image_files: List[Union[str, Path]],
+                     engine: NcshotBatchEngine,
+                     on_image_result: Optional[Callable[[int, Dict[str, Any]], None]] = None) -> Dict[str, Any]:
+    """Przetwarza obrazy (wsad albo jedną porcję zadania) w przygotowanym wsadzie `ncshot_batch_context`"""
+    memory = batch["memory"]
+    timings = batch["timings"]
+    config_slot = batch["slot"]
+
+    # 4. GŁÓWNE PRZETWARZANIE - współbieżnie, okno skalowane liczbą zdrowych instancji
+    logging.info(f"   🔀 Okno wsadu: {engine.window}, maks. tokenów: {engine.max_outstanding_tokens}, "
+                 f"instancje: {[b.name for b in healthy]}")
+
+    def run_image(i: int, image: Union[str, Path]) -> Dict[str, Any]:
+        outcome = process_ncshot_image(i, image, len(image_files), engine, batch)
+        NCSHOT_IMAGES.inc(status=outcome["status"])
+        memory.maybe_collect()
+        if on_image_result:
+            try:
+                on_image_result(i, outcome)
+            except Exception as callback_error:
+                logging.error(f"⚠ī¸ Błąd publikacji wyniku obrazu {i}: {callback_error}")
+        return outcome
+
+    outcomes = engine.run(image_files, run_image)
+
+    result = {}
+    failed_images = 0
+    total_plates = 0
+    total_vehicles = 0
+    cache_hits = 0
+    cache_misses = 0
+    per_backend = {}
+
+    # Wyniki w kolejności obrazów - kształt image_{i} bez zmian
+    for i, outcome in outcomes.items():
+        # Chybienia liczone przy odczycie cache - także obrazy, które potem nie przeszły przez NCShot
+        cache_misses += outcome["cache_miss"]
+        if outcome["status"] == "ok":
+            result[f"image_{i}"] = outcome["file_result"]
+            total_plates += outcome["plates"]
+            total_vehicles += outcome["vehicles"]
+            cache_hits += outcome["cache_hit"]
+        elif outcome["status"] == "failed":
+            failed_images += 1
+        if outcome["backend"]:
+            counts = per_backend.setdefault(outcome["backend"], {"ok": 0, "failed": 0, "aborted": 0})
+            counts[outcome["status"]] += 1
+
+    logging.info(f"✅ === NCSHOT PROFESSIONAL ZAKOŃCZONY ===")
+    logging.info(f"   📊 Pomyślnie: {len(result)} obrazów")
+    logging.info(f"   ⚠ī¸ Błędy: {failed_images} obrazów")
+    logging.info(f"   🚗 Pojazdy: {total_vehicles}")
+    logging.info(f"   🷏ī¸ Tablice: {total_plates}")
+
+    # Rozszerzone statystyki (liczone przed dodaniem klucza _stats do wyniku)
+    processed = len(result)
+    result["_stats"] = {
+        "processed": processed,
+        "failed": failed_images,
+        "total": len(image_files),
+        "total_vehicles": total_vehicles,
+        "total_plates": total_plates,
+        "processing_time": datetime.now().isoformat(),
+        "success_rate": processed / len(image_files) * 100 if image_files else 0,
+        "memory_management": "improved_with_immediate_token_release",
+        "batch_engine": engine.get_stats(),
+        "admission": admission.get_stats(),
+        "memory": memory.get_stats(),
+        "stage_timings": timings.to_dict(),
+        "config_push": {
+            "slot": config_slot,
+            "pushes": batch["config_pushes"],
+            "time_saved": sum(p["time_saved"] for p in batch["config_pushes"])
+        },
+        "backends": per_backend,
+        "result_cache": {
+            "hits": cache_hits,
+            "misses": cache_misses,
+            "global": result_cache.get_stats()
+        }
+    }
+
+    return result
+
 # ===== POPRAWIONA FUNKCJA POBIERANIA OBRAZÓW Z URZĄDZENIA =====
-def fetch_images_from_device(device_ip: str, device_pass: Optional[str], count: int) -> List[Dict[str,str]]:
+@instrumented("device_fetch_images")
+def fetch_images_from_device(device_ip: str, device_pass: Optional[str], count: int,
+                             inline: bool = False) -> List[Dict[str,str]]:
     """
     POPRAWIONA: Pobiera obrazy ze WSZYSTKICH katalogów, nie tylko z najnowszego
+
+    Obrazy trafiają do magazynu galerii i są zwracane jako `id`/`url`;
+    `inline=True` dodatkowo dołącza data URL (`data`) jak w starszych wersjach.
+    Gdy INI terminala definiuje ROI (piksele pełnej rozdzielczości), obrazy nie są zmniejszane.
     """
     jump = dev = None
     try:
@@ -1139,6 +1331,10 @@ def fetch_images_from_device(device_ip: str, device_pass: Optional[str], count:
         sftp = dev.open_sftp()
         base = "/neurocar/data/deleted"
 
+        resize = not device_rois_defined(sftp)
+        if not resize:
+            logging.info("📐 Terminal ma ROI w INI - obrazy bez zmniejszania rozdzielczości")
+
         # Pobierz wszystkie katalogi
         items = sftp.listdir_attr(base)
         dirs = [d for d in items if stat.S_ISDIR(d.st_mode)]
@@ -1205,14 +1401,59 @@ def fetch_images_from_device(device_ip: str, device_pass: Optional[str], count:
         for i, file_info in enumerate(files_to_process):
             logging.info(f"   {i+1}. {file_info['folder']}/{file_info['attr'].filename}")
 
-        # 🔧 PRZETWARZANIE PLIKÓW (pozostaje bez zmian)
+        # 🔧 PRZETWARZANIE PLIKÓW: pobieranie przez SFTP nakłada się z dekompresją w puli procesów,
+        # wyniki obsługiwane w kolejności archiwów
         imgs = []
+        pending = deque()
+
+        def add_extracted_image(file_info: Dict[str, Any], future) -> None:
+            file_attr = file_info['attr']
+            folder_name = file_info['folder']
+            try:
+                extracted = future.result()
+            except Exception as extract_error:
+                archive_extractor.record_error()
+                logging.error(f"   ⚠ī¸ Błąd przy dekompresji {file_attr.filename}: {extract_error}")
+                return
+
+            if extracted is None:
+                logging.warning(f"   ⚠ī¸ Brak plików obrazów w archiwum {file_attr.filename}")
+                return
+            target_filename, image_bytes = extracted
+            original_format = os.path.splitext(target_filename)[1].lower()
+            logging.info(f"   🖼ī¸ Znaleziono obraz: {target_filename} ({original_format})")
+            if image_bytes is None:
+                logging.warning(f"   ⚠ī¸ Nie udało się wyodrębnić pliku: {target_filename}")
+                return
+
+            image_bytes = optimize_image_for_ncshot(image_bytes, resize=resize)
+
+            # WALIDACJA OBRAZU
+            if not validate_image_data(image_bytes, len(imgs)):
+                logging.warning(f"   ⚠ī¸ Odrzucono nieprawidłowy obraz: {target_filename}")
+                return
+
+            # Utwórz unikalną nazwę z informacją o katalogu
+            display_filename = f"{folder_name}_{file_attr.filename}"
+
+            stored = image_store.put(image_bytes, display_filename, source="terminal", device_ip=device_ip)
+            img = {
+                "id": stored["id"],
+                "url": f"/images/{stored['id']}",
+                "filename": display_filename,
+                "size": len(image_bytes),
+                "original_format": original_format,
+                "source_folder": folder_name,
+                "archive_name": file_attr.filename
+            }
+            if inline:
+                img["data"] = "data:image/jpeg;base64,"+base64.b64encode(image_bytes).decode('utf-8')
+            imgs.append(img)
+            logging.info(f"   ✅ Dodano obraz: {display_filename} ({len(image_bytes)} bajtów)")
+
         for i, file_info in enumerate(files_to_process):
             try:
                 file_path = file_info['full_path']
-                file_attr = file_info['attr']
-                folder_name = file_info['folder']
-
                 logging.info(f"📦 Przetwarzanie ({i+1}/{len(files_to_process)}): {file_path}")
 
                 # Pobierz plik
@@ -1221,63 +1462,19 @@ def fetch_images_from_device(device_ip: str, device_pass: Optional[str], count:
 
                 logging.info(f"   📊 Pobrano: {len(data)} bajtów")
 
-                # Wyodrębnij obraz z archiwum 7z
-                buf = io.BytesIO(data)
-                image_bytes = None
-                original_format = None
-
-                try:
-                    with py7zr.SevenZipFile(buf, mode='r') as z:
-                        file_list = z.list()
-                        target_filename = None
-
-                        # Znajdź plik obrazu w archiwum
-                        for file_info_7z in file_list:
-                            if file_info_7z.filename.lower().endswith(('.jpg', '.jpeg', '.bif', '.zur')):
-                                target_filename = file_info_7z.filename
-                                original_format = os.path.splitext(file_info_7z.filename)[1].lower()
-                                break
-
-                        if target_filename:
-                            logging.info(f"   🖼ī¸ Znaleziono obraz: {target_filename} ({original_format})")
-
-                            with tempfile.TemporaryDirectory() as temp_dir:
-                                z.extractall(path=temp_dir)
-                                temp_file_path = os.path.join(temp_dir, target_filename)
-
-                                if os.path.exists(temp_file_path):
-                                    with open(temp_file_path, 'rb') as img_file:
-                                        image_bytes = img_file.read()
-
-                                    # WALIDACJA OBRAZU
-                                    if validate_image_data(image_bytes, len(imgs)):
-                                        # Utwórz unikalną nazwę z informacją o katalogu
-                                        display_filename = f"{folder_name}_{file_attr.filename}"
-
-                                        imgs.append({
-                                            "filename": display_filename,
-                                            "data": "data:image/jpeg;base64,"+base64.b64encode(image_bytes).decode('utf-8'),
-                                            "size": len(image_bytes),
-                                            "original_format": original_format,
-                                            "source_folder": folder_name,
-                                            "archive_name": file_attr.filename
-                                        })
-                                        logging.info(f"   ✅ Dodano obraz: {display_filename} ({len(image_bytes)} bajtów)")
-                                    else:
-                                        logging.warning(f"   ⚠ī¸ Odrzucono nieprawidłowy obraz: {target_filename}")
-                                else:
-                                    logging.warning(f"   ⚠ī¸ Nie znaleziono wyodrębnionego pliku: {temp_file_path}")
-                        else:
-                            logging.warning(f"   ⚠ī¸ Brak plików obrazów w archiwum {file_attr.filename}")
-
-                except Exception as extract_error:
-                    logging.error(f"   ⚠ī¸ Błąd przy dekompresji {file_attr.filename}: {extract_error}")
-                    continue
-
+                # Wyodrębnij obraz z archiwum 7z (w pamięci, w puli procesów)
+                pending.append((file_info, archive_extractor.submit(data)))
             except Exception as file_error:
                 logging.error(f"⚠ī¸ Błąd przetwarzania pliku {file_info['full_path']}: {file_error}")
                 continue
 
+            # Ograniczenie liczby pobranych archiwów czekających na dekompresję
+            while len(pending) >= archive_extractor.max_in_flight:
+                add_extracted_image(*pending.popleft())
+
+        while pending:
+            add_extracted_image(*pending.popleft())
+
         logging.info(f"✅ Pobrano {len(imgs)} obrazów z {processed_dirs} katalogów")
 
         # Dodaj statystyki
@@ -1297,53 +1494,67 @@ def fetch_images_from_device(device_ip: str, device_pass: Optional[str], count:
         if jump:
             jump.close()
 
+def read_device_location(sftp) -> Dict[str, Any]:
+    """Konfiguracja lokalizacji terminala z location.ini i ROI z ncshot.d/<lokalizacja>.ini"""
+    with sftp.open("/neurocar/etc/location.ini") as f:
+        content = f.read().decode('utf-8')
+    cfg = configparser.ConfigParser(interpolation=None)
+    cfg.read_string(content)
+
+    out = {
+        "serialNumber": cfg.get("expect","serialno", fallback=""),
+        "locationId": cfg.get("location","client.id", fallback=""),
+        "gpsLat": cfg.get("location","default.lat", fallback=""),
+        "gpsLon": cfg.get("location","default.lon", fallback=""),
+        "backendAddr": cfg.get("location","backend.addr", fallback=""),
+        "swdallowMasks": cfg.get("location","swdallow.masks", fallback=""),
+        "nativeallowMasks": cfg.get("location","nativeallow.masks", fallback=""),
+    }
+
+    rois = []
+    if out["locationId"]:
+        p = f"/neurocar/etc/ncshot.d/{out['locationId']}.ini"
+        try:
+            with sftp.open(p) as f:
+                nc = f.read().decode('utf-8')
+            ncfg = configparser.ConfigParser(interpolation=None)
+            ncfg.read_string(nc)
+
+            for sec in ncfg.sections():
+                if sec.lower().startswith('platerecognizer-'):
+                    pts = ncfg.get(sec, 'roi', fallback='')
+                    pts_list = [{"x": float(p.split(',')[0]), "y": float(p.split(',')[1])} for p in pts.split(';')] if pts else []
+                    rois.append({
+                        "id": f"ROI-{sec.split('-')[-1].upper()}",
+                        "points": pts_list,
+                        "angle": ncfg.getfloat(sec, 'angle', fallback=0),
+                        "zoom": ncfg.getfloat(sec, 'zoom', fallback=1.0),
+                        "reflexOffsetH": ncfg.getint(sec, 'reflex.offset.h', fallback=0),
+                        "reflexOffsetV": ncfg.getint(sec, 'reflex.offset.v', fallback=0),
+                        "skewH": ncfg.getfloat(sec, 'skew.h', fallback=0),
+                        "skewV": ncfg.getfloat(sec, 'skew.v', fallback=0),
+                    })
+        except FileNotFoundError:
+            logging.warning(f"Plik ROI {p} nie został znaleziony, import bez ROI.")
+
+    out["rois"] = rois
+    return out
+
+def device_rois_defined(sftp) -> bool:
+    """Czy INI terminala definiuje ROI; przy błędzie odczytu przyjmuje, że tak (obraz bez skalowania)"""
+    try:
+        return any(roi["points"] for roi in read_device_location(sftp)["rois"])
+    except Exception as e:
+        logging.warning(f"⚠ī¸ Nie udało się odczytać ROI z INI terminala: {e}")
+        return True
+
+@instrumented("device_config")
 def get_device_config(device_ip: str, device_pass: Optional[str]) -> Dict[str, Any]:
     jump = dev = None
     try:
         jump, dev = open_via_jump(device_ip, device_pass)
         sftp = dev.open_sftp()
-        with sftp.open("/neurocar/etc/location.ini") as f:
-            content = f.read().decode('utf-8')
-        cfg = configparser.ConfigParser(interpolation=None)
-        cfg.read_string(content)
-
-        out = {
-            "serialNumber": cfg.get("expect","serialno", fallback=""),
-            "locationId": cfg.get("location","client.id", fallback=""),
-            "gpsLat": cfg.get("location","default.lat", fallback=""),
-            "gpsLon": cfg.get("location","default.lon", fallback=""),
-            "backendAddr": cfg.get("location","backend.addr", fallback=""),
-            "swdallowMasks": cfg.get("location","swdallow.masks", fallback=""),
-            "nativeallowMasks": cfg.get("location","nativeallow.masks", fallback=""),
-        }
-
-        rois = []
-        if out["locationId"]:
-            p = f"/neurocar/etc/ncshot.d/{out['locationId']}.ini"
-            try:
-                with sftp.open(p) as f:
-                    nc = f.read().decode('utf-8')
-                ncfg = configparser.ConfigParser(interpolation=None)
-                ncfg.read_string(nc)
-
-                for sec in ncfg.sections():
-                    if sec.lower().startswith('platerecognizer-'):
-                        pts = ncfg.get(sec, 'roi', fallback='')
-                        pts_list = [{"x": float(p.split(',')[0]), "y": float(p.split(',')[1])} for p in pts.split(';')] if pts else []
-                        rois.append({
-                            "id": f"ROI-{sec.split('-')[-1].upper()}",
-                            "points": pts_list,
-                            "angle": ncfg.getfloat(sec, 'angle', fallback=0),
-                            "zoom": ncfg.getfloat(sec, 'zoom', fallback=1.0),
-                            "reflexOffsetH": ncfg.getint(sec, 'reflex.offset.h', fallback=0),
-                            "reflexOffsetV": ncfg.getint(sec, 'reflex.offset.v', fallback=0),
-                            "skewH": ncfg.getfloat(sec, 'skew.h', fallback=0),
-                            "skewV": ncfg.getfloat(sec, 'skew.v', fallback=0),
-                        })
-            except FileNotFoundError:
-                logging.warning(f"Plik ROI {p} nie został znaleziony, import bez ROI.")
-
-        out["rois"] = rois
+        out = read_device_location(sftp)
         sftp.close()
         return out
     finally:
@@ -1455,13 +1666,29 @@ async def startup_event():
     """Wykonuje inicjalizację przy starcie aplikacji"""
     global app_start_time
     app_start_time = time.time()
+    # Tokeny pozostawione przez workery, które padły, zwalniane przed przyjęciem ruchu
+    await run_in_threadpool(token_leases.recover)
+    token_leases.start()
+    config_tracker.start()
+    if NCSHOT_CONFIG_VIA_SSH and VM_PASS:
+        admission.start_memory_sampler(probe_ncshot_vm_memory, NCSHOT_ADMISSION_VM_INTERVAL)
     logging.info("🎯 NCPyVisual Web Professional uruchomiona (ulepszona wersja z najlepszymi elementami)")
 
 @app.on_event("shutdown")
 async def shutdown_event():
     """Wykonuje cleanup przy wyłączaniu aplikacji"""
     logging.info("🛑 Zamykanie NCPyVisual Web Professional...")
+    ncshot_jobs.shutdown()
+    plate_executor.shutdown(wait=False, cancel_futures=True)
+    token_leases.stop()
+    config_tracker.stop()
+    admission.stop()
+    image_normalizer.shutdown()
+    archive_extractor.shutdown()
+    close_vm_memory_connections()
+    ncshot_backends.close()
     logging.info("✅ Aplikacja zamknięta")
+    shutdown_logging()
 
 # ===== ROUTES =====
 @app.get("/", response_class=HTMLResponse)
@@ -1476,11 +1703,8 @@ async def health_check():
         ncshot_status = "unknown"
         ncshot_details = {}
         try:
-            test_hc = httplib.HTTPConnection(NCSHOT_HOST, NCSHOT_PORT, timeout=5)
-            test_hc.request("GET", "/")
-            test_resp = test_hc.getresponse()
-            test_content = test_resp.read().decode('utf-8', 'ignore')
-            test_hc.close()
+            test_resp = ncshot_client.get("/", operation="health")
+            test_content = test_resp.data.decode('utf-8', 'ignore')
 
             ncshot_status = "ok" if test_resp.status == 200 else f"error_{test_resp.status}"
             ncshot_details = {
@@ -1499,7 +1723,17 @@ async def health_check():
             "ncshot_host": NCSHOT_HOST,
             "ncshot_port": NCSHOT_PORT,
             "ncshot_status": ncshot_status,
-            "ncshot_details": ncshot_details
+            "ncshot_details": ncshot_details,
+            "ncshot_pool": ncshot_client.get_stats(),
+            "ncshot_backends": ncshot_backends.get_stats(),
+            "result_cache": result_cache.get_stats(),
+            "config_state": config_tracker.get_stats(),
+            "config_slots": config_slots.get_stats(),
+            "token_leases": await run_in_threadpool(token_leases.get_stats),
+            "admission": admission.get_stats(),
+            "image_store": image_store.get_stats(),
+            "image_normalizer": image_normalizer.get_stats(),
+            "archive_extractor": archive_extractor.get_stats()
         }
 
         return {
@@ -1512,7 +1746,9 @@ async def health_check():
                 "min_image_size_bytes": MIN_IMAGE_SIZE,
                 "min_plate_size_bytes": MIN_PLATE_SIZE,
                 "max_plate_size_kb": MAX_PLATE_SIZE // 1024,
-                "max_images_per_batch": 20
+                "max_images_per_batch": NCSHOT_MAX_SYNC_IMAGES,
+                "max_images_per_job": None,
+                "job_chunk_size": NCSHOT_JOB_CHUNK_SIZE
             },
             "professional_features": {
                 "detailed_xml_parsing": True,
@@ -1547,6 +1783,7 @@ async def health_check():
                 "debug_plates_endpoint": "/debug-plates/",
                 "debug_xml_endpoint": "/debug-xml/",
                 "debug_ncshot_endpoint": "/debug-ncshot/",
+                "ncshot_jobs_endpoint": "/ncshot/jobs/",
                 "health_endpoint": "/health/"
             }
         }
@@ -1575,8 +1812,10 @@ async def debug_plates():
             "min_image_size_bytes": MIN_IMAGE_SIZE
         },
         "professional_features": {
-            "enhanced_xml_parsing": "process_ncshot_result_xml_enhanced",
-            "detailed_plates_extraction": "extract_detailed_plates_from_xml",
+            "enhanced_xml_parsing": "parse_ncshot_result",
+            "xml_parser_backend": get_xml_parser_backend(),
+            "log_sampling": log_sampler.get_stats(),
+            "detailed_plates_extraction": "extract_detailed_plates",
             "plate_image_assignment": "assign_plate_images_to_data",
             "vehicle_data_parsing": True,
             "mmr_divergence_calculation": True,
@@ -1618,34 +1857,99 @@ async def debug_plates():
         "timestamp": datetime.now().isoformat()
     }
 
+@app.get("/metrics")
+async def metrics():
+    """Metryki w formacie tekstowym Prometheus (histogramy czasów etapów, liczniki, wskaźniki)"""
+    return Response(REGISTRY.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+@app.get("/debug-memory/")
+async def debug_memory(top: int = 20, start: bool = False):
+    """RSS procesu i migawka tracemalloc na żądanie (`start=true` włącza śledzenie alokacji)"""
+    started = start_tracemalloc() if start else False
+    snapshot = await run_in_threadpool(tracemalloc_snapshot, top)
+    return {"rss": current_rss(), "tracemalloc_started": started, **snapshot}
+
+def validate_ncshot_request(body: NcshotRequest, max_images: Optional[int] = None) -> None:
+    """Wspólna walidacja żądań /ncshot/ i /ncshot/jobs/"""
+    validate_ncshot_input(body.package, len(body.image_files) + len(body.image_ids), max_images)
+
+def resolve_ncshot_images(body: NcshotRequest) -> List[Union[str, Path]]:
+    """
+    Obrazy wsadu: data URL/base64 z `image_files`, potem pliki magazynu dla `image_ids`.
+    Obrazy magazynu są przypinane (chronione przed eksmisją) - wywołujący zwalnia je
+    przez `image_store.unpin(body.image_ids)` po zakończeniu wsadu.
+    """
+    images: List[Union[str, Path]] = list(body.image_files)
+    for n, image_id in enumerate(body.image_ids):
+        path = image_store.pin(image_id)
+        if path is None:
+            image_store.unpin(body.image_ids[:n])
+            raise HTTPException(status_code=404, detail=f"Nie znaleziono obrazu {image_id} w magazynie galerii")
+        images.append(path)
+    return images
+
+def validate_ncshot_input(package: FullPackage, image_count: int, max_images: Optional[int] = None) -> None:
+    if not image_count:
+        raise HTTPException(status_code=400, detail="Wymagane są obrazy do przetworzenia.")
+
+    if not package.deployment.locationId:
+        raise HTTPException(status_code=400, detail="Wymagane jest ID lokalizacji.")
+
+    # Synchroniczne wsady zwracają wszystkie wyniki w jednej odpowiedzi - zadania (/ncshot/jobs/) bez limitu
+    if max_images is not None and image_count > max_images:
+        raise HTTPException(status_code=400, detail=f"Maksymalnie {max_images} obrazów na raz - "
+                                                    f"większe wsady przez /ncshot/jobs/ (przetwarzanie porcjami)")
+
+def parse_ncshot_package(package: str) -> FullPackage:
+    """Pakiet z pola formularza multipart (JSON jako tekst)"""
+    try:
+        return FullPackage.model_validate_json(package)
+    except ValidationError as e:
+        raise HTTPException(status_code=422, detail=f"Nieprawidłowy pakiet: {e}")
+
+async def spool_ncshot_uploads(images: List[UploadFile]) -> Tuple[str, List[Path]]:
+    """
+    Zapisuje części multipart do plików tymczasowych wsadu, kopiując je strumieniowo
+    (bez budowania base64 w pamięci). Zwraca katalog wsadu i ścieżki obrazów w kolejności.
+    """
+    os.makedirs(NCSHOT_UPLOAD_DIR, exist_ok=True)
+    spool_dir = tempfile.mkdtemp(prefix="batch-", dir=NCSHOT_UPLOAD_DIR)
+    paths = []
+    try:
+        for n, upload in enumerate(images):
+            path = Path(spool_dir) / f"image_{n}.jpg"
+            with open(path, "wb") as f:
+                while True:
+                    chunk = await upload.read(1024 * 1024)
+                    if not chunk:
+                        break
+                    f.write(chunk)
+            await upload.close()
+            paths.append(path)
+    except Exception:
+        shutil.rmtree(spool_dir, ignore_errors=True)
+        raise
+    return spool_dir, paths
+
 @app.post("/ncshot/")
 async def ncshot_endpoint(body: NcshotRequest):
     """🚀 GŁÓWNA FUNKCJONALNOŚĆ - Endpoint dla NCShot Professional z najlepszymi elementami"""
     logging.info("🚀 === URUCHAMIANIE GŁÓWNEJ FUNKCJONALNOŚCI NCSHOT PROFESSIONAL ===")
     logging.info(f"   📊 ROI: {len(body.package.rois)}")
-    logging.info(f"   🖼ī¸ Obrazy: {len(body.image_files)}")
+    logging.info(f"   🖼ī¸ Obrazy: {len(body.image_files)} (+{len(body.image_ids)} z magazynu galerii)")
 
     try:
-        if not body.image_files:
-            raise HTTPException(status_code=400, detail="Wymagane są obrazy do przetworzenia.")
+        validate_ncshot_request(body, NCSHOT_MAX_SYNC_IMAGES)
 
-        if not body.package.deployment.locationId:
-            raise HTTPException(status_code=400, detail="Wymagane jest ID lokalizacji.")
-
-        # Sprawdź liczebność obrazów (zabezpieczenie przed przeciążeniem)
-        if len(body.image_files) > 20:
-            raise HTTPException(status_code=400, detail="Maksymalnie 20 obrazów na raz (zabezpieczenie pamięci)")
-
-        # 🚀 GŁÓWNA FUNKCJONALNOŚĆ - UŻYWAMY ULEPSZONEJ WERSJI PROFESSIONAL
-        results = start_ncshot_with_config_safe(body.package, body.image_files)
-
-        # 🔧 ZABEZPIECZENIE: Upewnij się że wszystkie dane można serializować do JSON
+        # 🚀 GŁÓWNA FUNKCJONALNOŚĆ - blokujące przetwarzanie w puli wątków, pętla zdarzeń pozostaje wolna
+        images = resolve_ncshot_images(body)
         try:
-            import json
-            json.dumps(results)
-        except (TypeError, ValueError) as e:
-            logging.error(f"🔧 Błąd serializacji JSON, konwertuję: {e}")
-            results = ensure_json_serializable(results)
+            results = await run_in_threadpool(start_ncshot_with_config_safe, body.package, images)
+        finally:
+            image_store.unpin(body.image_ids)
+
+        # 🔧 ZABEZPIECZENIE: projekcja rekordów wyniku i bytes do typów JSON
+        results = ensure_json_serializable(results)
 
         logging.info(f"✅ === NCSHOT PROFESSIONAL ZAKOŃCZONY POMYŚLNIE - {len(results)-1} wyników ===")
         return JSONResponse({"results": results, "success": True})
@@ -1656,6 +1960,231 @@ async def ncshot_endpoint(body: NcshotRequest):
             raise e
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/ncshot/upload/")
+async def ncshot_upload_endpoint(package: str = Form(...), images: List[UploadFile] = File(...)):
+    """
+    Wariant /ncshot/ z surowymi obrazami JPEG jako częściami multipart/form-data
+    (pole `package` - JSON pakietu, pola `images` - pliki). Części trafiają na dysk
+    i bezpośrednio do PUT NCShot - bez base64 i walidacji wielomegabajtowych napisów.
+    """
+    pkg = parse_ncshot_package(package)
+    validate_ncshot_input(pkg, len(images), NCSHOT_MAX_SYNC_IMAGES)
+    logging.info(f"🚀 === NCSHOT PROFESSIONAL (multipart): {len(images)} obrazów, {len(pkg.rois)} ROI ===")
+
+    spool_dir, paths = await spool_ncshot_uploads(images)
+    try:
+        results = await run_in_threadpool(start_ncshot_with_config_safe, pkg, paths)
+        return JSONResponse({"results": ensure_json_serializable(results), "success": True})
+    except Exception as e:
+        logging.error(f"⚠ī¸ Błąd krytyczny NCShot (multipart): {e}\n{traceback.format_exc()}")
+        if isinstance(e, HTTPException):
+            raise e
+        raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        shutil.rmtree(spool_dir, ignore_errors=True)
+
+# ===== ZADANIA NCSHOT W TLE =====
+def run_ncshot_job(job: NcshotJob, package: FullPackage, image_files: List[Union[str, Path]]) -> Dict[str, Any]:
+    """
+    Wykonuje wsad NCShot w wątku zadania porcjami po NCSHOT_JOB_CHUNK_SIZE obrazów, publikując
+    wynik każdego obrazu od razu (do pliku wyników zadania). Wyniki porcji nie są kumulowane,
+    a przetworzone obrazy są zwalniane - pamięć nie zależy od liczby obrazów w zadaniu.
+    Slot konfiguracji i test dostępności instancji - raz na zadanie, nie na porcję.
+    """
+    chunk_size = max(1, NCSHOT_JOB_CHUNK_SIZE)
+    totals = {"processed": 0, "failed": 0, "total": len(image_files), "total_vehicles": 0, "total_plates": 0,
+              "cache_hits": 0, "cache_misses": 0, "chunks": 0}
+    chunk_stats = None
+
+    with ncshot_batch_context(package) as (batch, healthy):
+        window, max_tokens = ncshot_batch_window(len(healthy))
+        engine = ncshot_jobs.new_engine(job, window, max_tokens)
+
+        for start in range(0, len(image_files), chunk_size):
+            if engine.aborted:
+                break
+            chunk = image_files[start:start + chunk_size]
+
+            def publish(i: int, outcome: Dict[str, Any], offset: int = start) -> None:
+                file_result = outcome["file_result"]
+                job.add_image_result(offset + i, outcome["status"],
+                                     ensure_json_serializable(file_result) if file_result else None)
+
+            chunk_stats = run_ncshot_batch(batch, healthy, chunk, engine, on_image_result=publish)["_stats"]
+            for key in ("total_vehicles", "total_plates"):
+                totals[key] += chunk_stats[key]
+            totals["cache_hits"] += chunk_stats["result_cache"]["hits"]
+            totals["cache_misses"] += chunk_stats["result_cache"]["misses"]
+            totals["chunks"] += 1
+            # Obrazy porcji (data URL z JSON) nie są już potrzebne
+            image_files[start:start + chunk_size] = [None] * len(chunk)
+            if len(image_files) > chunk_size:
+                logging.info(f"📦 Zadanie {job.id}: porcja {totals['chunks']} gotowa "
+                             f"({min(start + chunk_size, len(image_files))}/{len(image_files)} obrazów)")
+
+    # Liczniki z wyników obrazów opublikowanych w zadaniu (ok / failed), nie z podsumowań porcji
+    totals["processed"] = job.completed
+    totals["failed"] = job.failed
+    totals["success_rate"] = totals["processed"] / totals["total"] * 100 if totals["total"] else 0
+    totals["batch_engine"] = engine.get_stats()
+    if chunk_stats:
+        # Stan ostatniej porcji (pamięć, czasy etapów, instancje)
+        totals["last_chunk"] = chunk_stats
+    return {"_stats": totals}
+
+def get_ncshot_job_or_404(job_id: str) -> NcshotJob:
+    job = ncshot_jobs.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail=f"Nie znaleziono zadania {job_id}")
+    return job
+
+@app.post("/ncshot/jobs/")
+async def ncshot_job_submit(body: NcshotRequest):
+    """Kolejkuje wsad NCShot i od razu zwraca identyfikator zadania"""
+    validate_ncshot_request(body)
+    images = resolve_ncshot_images(body)
+    # Obrazy trzyma już lista `images` - zadanie zwalnia je porcjami
+    body.image_files = []
+    # Obrazy magazynu pozostają przypięte do końca zadania (także anulowanego przed startem)
+    image_ids = list(body.image_ids)
+    job = ncshot_jobs.submit(
+        len(images),
+        lambda job: run_ncshot_job(job, body.package, images),
+        cleanup=lambda: image_store.unpin(image_ids)
+    )
+    return ncshot_job_links(job)
+
+@app.post("/ncshot/jobs/upload/")
+async def ncshot_job_submit_upload(package: str = Form(...), images: List[UploadFile] = File(...)):
+    """Kolejkuje wsad NCShot z obrazami przesłanymi jako multipart (jak /ncshot/upload/)"""
+    pkg = parse_ncshot_package(package)
+    validate_ncshot_input(pkg, len(images))
+    spool_dir, paths = await spool_ncshot_uploads(images)
+    job = ncshot_jobs.submit(
+        len(paths),
+        lambda job: run_ncshot_job(job, pkg, paths),
+        cleanup=lambda: shutil.rmtree(spool_dir, ignore_errors=True)
+    )
+    return ncshot_job_links(job)
+
+def ncshot_job_links(job: NcshotJob) -> Dict[str, Any]:
+    return {
+        "job_id": job.id,
+        "state": job.state,
+        "status_url": f"/ncshot/jobs/{job.id}",
+        "stream_url": f"/ncshot/jobs/{job.id}/stream",
+        "results_url": f"/ncshot/jobs/{job.id}/results",
+        "cancel_url": f"/ncshot/jobs/{job.id}/cancel"
+    }
+
+@app.get("/ncshot/jobs/")
+async def ncshot_job_list():
+    return {"jobs": ncshot_jobs.list_jobs()}
+
+@app.get("/ncshot/jobs/{job_id}")
+async def ncshot_job_status(job_id: str):
+    return get_ncshot_job_or_404(job_id).to_dict()
+
+@app.get("/ncshot/jobs/{job_id}/stream")
+async def ncshot_job_stream(job_id: str, request: Request, format: str = "ndjson", since: int = 0):
+    """
+    Strumieniuje wyniki obrazów w miarę ich powstawania jako NDJSON (domyślnie)
+    lub Server-Sent Events (`format=sse` albo `Accept: text/event-stream`).
+    `since` pozwala wznowić strumień od podanego numeru zdarzenia.
+    """
+    job = get_ncshot_job_or_404(job_id)
+    use_sse = format == "sse" or "text/event-stream" in request.headers.get("accept", "")
+
+    async def event_stream():
+        cursor = max(0, since)
+        while True:
+            events = await run_in_threadpool(job.wait_for_events, cursor, 1.0)
+            events = await run_in_threadpool(job.load_results, events)
+            for event in events:
+                payload = json.dumps(dict(event, seq=cursor))
+                cursor += 1
+                if use_sse:
+                    yield f"event: {event['type']}\ndata: {payload}\n\n"
+                else:
+                    yield payload + "\n"
+                if event["type"] in FINISHED_STATES:
+                    return
+            if not events and job.finished and cursor >= job.event_count:
+                return
+            if await request.is_disconnected():
+                return
+
+    media_type = "text/event-stream" if use_sse else "application/x-ndjson"
+    return StreamingResponse(event_stream(), media_type=media_type,
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@app.get("/ncshot/jobs/{job_id}/results")
+async def ncshot_job_results(job_id: str):
+    """Wyniki obrazów zadania zapisane dotąd na dysk (NDJSON: index, status, result)"""
+    job = get_ncshot_job_or_404(job_id)
+    if not job.results_path or not os.path.exists(job.results_path):
+        raise HTTPException(status_code=404, detail=f"Zadanie {job_id} nie ma pliku wyników")
+    return FileResponse(job.results_path, media_type="application/x-ndjson", filename=f"ncshot-{job.id}.ndjson")
+
+@app.post("/ncshot/jobs/{job_id}/cancel")
+async def ncshot_job_cancel(job_id: str):
+    """Anuluje zadanie - obrazy w locie kończą się i zwalniają tokeny, kolejne nie startują"""
+    job = get_ncshot_job_or_404(job_id)
+    cancelled = job.cancel()
+    return {"job_id": job.id, "cancelled": cancelled, "state": job.state}
+
+@app.get("/ncshot/cache/")
+async def ncshot_cache_stats():
+    """Statystyki cache wyników NCShot (trafienia, chybienia, rozmiar)"""
+    return result_cache.get_stats()
+
+@app.delete("/ncshot/cache/")
+async def ncshot_cache_clear():
+    removed = await run_in_threadpool(result_cache.clear)
+    logging.info(f"🧹 Wyczyszczono cache wyników NCShot ({removed} wpisów)")
+    return {"removed": removed, "stats": result_cache.get_stats()}
+
+@app.get("/ncshot/leases/")
+async def ncshot_token_leases():
+    """Tokeny NCShot jeszcze niezwolnione (instancja, wsad, wiek, próby zwolnienia)"""
+    leases = await run_in_threadpool(token_leases.list_leases)
+    stats = await run_in_threadpool(token_leases.get_stats)
+    return {"leases": leases, "stats": stats}
+
+# ===== MAGAZYN OBRAZÓW GALERII =====
+@app.post("/images/")
+async def image_store_upload(images: List[UploadFile] = File(...)):
+    """Dodaje obrazy z dysku do magazynu galerii; zwraca ich identyfikatory"""
+    stored = []
+    for upload in images:
+        data = await upload.read()
+        await upload.close()
+        data = await run_in_threadpool(optimize_image_for_ncshot, data)
+        if not validate_image_data(data, len(stored)):
+            raise HTTPException(status_code=400, detail=f"Nieprawidłowy obraz: {upload.filename}")
+        meta = image_store.put(data, upload.filename or f"obraz_{len(stored)}.jpg", source="disk")
+        stored.append(dict(meta, url=f"/images/{meta['id']}"))
+    return {"images": stored}
+
+@app.get("/images/")
+async def image_store_list():
+    return {"images": image_store.list_images(), "stats": image_store.get_stats()}
+
+@app.get("/images/{image_id}")
+async def image_store_get(image_id: str):
+    path = image_store.get_path(image_id)
+    if path is None:
+        raise HTTPException(status_code=404, detail=f"Nie znaleziono obrazu {image_id}")
+    # Treść pod danym id nigdy się nie zmienia
+    return FileResponse(path, media_type="image/jpeg",
+                        headers={"Cache-Control": "public, max-age=31536000, immutable"})
+
+@app.delete("/images/{image_id}")
+async def image_store_delete(image_id: str):
+    if not image_store.delete(image_id):
+        raise HTTPException(status_code=404, detail=f"Nie znaleziono obrazu {image_id}")
+    return {"deleted": image_id}
+
 @app.post("/import-from-device/")
 async def import_from_device_endpoint(req: Request):
     logging.info("Endpoint /import-from-device/ został wywołany.")
@@ -1688,7 +2217,7 @@ async def fetch_device_images_endpoint(req: Request):
             count = 50
             logging.warning(f"⚠ī¸ Ograniczono liczbę obrazów do {count} (zabezpieczenie)")
 
-        imgs = fetch_images_from_device(ip, pw, count)
+        imgs = fetch_images_from_device(ip, pw, count, inline=bool(data.get("inline", False)))
         logging.info(f"Pomyślnie pobrano {len(imgs)} obrazów.")
         return JSONResponse({"images": imgs})
     except Exception as e:
@@ -1755,8 +2284,14 @@ async def export_scene_xml(request: Request):
         if not package.deployment.locationId:
             raise HTTPException(status_code=400, detail="Wymagane ID lokalizacji")
 
-        # Opcjonalny obraz referencyjny
+        # Opcjonalny obraz referencyjny (data URL albo id z magazynu galerii)
         reference_image = data.get('reference_image', '')
+        reference_image_id = data.get('reference_image_id')
+        if reference_image_id:
+            path = image_store.get_path(reference_image_id)
+            if path is None:
+                raise HTTPException(status_code=404, detail=f"Nie znaleziono obrazu {reference_image_id}")
+            reference_image = "data:image/jpeg;base64," + base64.b64encode(path.read_bytes()).decode('utf-8')
 
         # Generuj XML
         xml_content = build_scene_xml(package, reference_image)
@@ -1835,12 +2370,10 @@ async def debug_xml_endpoint(request: Request):
 
         logging.info("🔍 === DEBUGOWANIE XML PRZEZ ENDPOINT ===")
 
-        # Debuguj strukturę
-        debug_xml_structure(xml_content)
-
-        # Sparsuj wyniki
-        parsed_results = process_ncshot_result_xml_enhanced(xml_content)
-        detailed_plates = extract_detailed_plates_from_xml(xml_content)
+        # Sparsuj wyniki (jeden przebieg, z logowaniem struktury)
+        parsed = parse_ncshot_result(xml_content, debug=True)
+        parsed_results = parsed.to_dict()
+        detailed_plates = [plate.to_dict() for plate in extract_detailed_plates(parsed)]
 
         return {
             "status": "success",
@@ -0,0 +1,136 @@
+# app/memory_monitor.py - pomiar pamięci wsadu NCShot (RSS, tracemalloc) i GC tylko po przekroczeniu progu
+
+import gc
+import logging
+import os
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional
+
+try:
+    import psutil
+except ImportError:  # psutil opcjonalny - bez niego brak pomiaru RSS (i progu GC)
+    psutil = None
+
+logger = logging.getLogger(__name__)
+
+_process = psutil.Process(os.getpid()) if psutil is not None else None
+
+
+def current_rss() -> Optional[int]:
+    """RSS procesu w bajtach (None bez psutil)"""
+    return _process.memory_info().rss if _process is not None else None
+
+
+def start_tracemalloc(frames: int = 1) -> bool:
+    """Włącza śledzenie alokacji Pythona; zwraca False, gdy było już włączone"""
+    if tracemalloc.is_tracing():
+        return False
+    tracemalloc.start(frames)
+    logger.info("🔬 Włączono tracemalloc")
+    return True
+
+
+def tracemalloc_snapshot(limit: int = 20, key_type: str = "lineno") -> Dict[str, Any]:
+    """Największe miejsca alokacji (na żądanie); wymaga włączonego tracemalloc"""
+    if not tracemalloc.is_tracing():
+        return {"tracing": False, "top": []}
+    current, peak = tracemalloc.get_traced_memory()
+    stats = tracemalloc.take_snapshot().statistics(key_type)
+    return {
+        "tracing": True,
+        "traced_current": current,
+        "traced_peak": peak,
+        "top": [{"where": str(stat.traceback), "size": stat.size, "count": stat.count} for stat in stats[:limit]],
+    }
+
+
+class MemoryMonitor:
+    """
+    Pamięć jednego wsadu NCShot: RSS na starcie/końcu, szczyt RSS (i alokacji tracemalloc,
+    gdy włączone) obserwowany na końcu każdego etapu oraz zbieranie śmieci tylko wtedy,
+    gdy RSS urósł o więcej niż `gc_threshold` bajtów od ostatniego zbierania.
+
+    Szczyt tracemalloc etapu to przyrost alokacji ponad stan z jego początku (szczyt jest zerowany
+    na starcie etapu). Obrazy wsadu działają współbieżnie, więc szczyty etapów dotyczą całego procesu.
+    """
+
+    def __init__(self, gc_threshold: int):
+        self.gc_threshold = gc_threshold
+        self._lock = threading.Lock()
+        self._collect_lock = threading.Lock()
+        self.rss_start = current_rss()
+        self._baseline = self.rss_start
+        self.rss_peak = self.rss_start
+        self.stages: Dict[str, Dict[str, Any]] = {}
+        self.collections: List[Dict[str, Any]] = []
+        self.checks = 0
+
+    @contextmanager
+    def stage(self, name: str):
+        """Mierzy czas etapu i zapisuje szczyt RSS/tracemalloc po jego zakończeniu"""
+        traced_start = None
+        if tracemalloc.is_tracing():
+            tracemalloc.reset_peak()
+            traced_start = tracemalloc.get_traced_memory()[0]
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - started
+            rss = current_rss()
+            traced = None
+            if traced_start is not None and tracemalloc.is_tracing():
+                traced = max(0, tracemalloc.get_traced_memory()[1] - traced_start)
+            with self._lock:
+                entry = self.stages.setdefault(name, {"count": 0, "time": 0.0, "rss_peak": None,
+                                                      "traced_peak": None})
+                entry["count"] += 1
+                entry["time"] += elapsed
+                if rss is not None:
+                    entry["rss_peak"] = max(entry["rss_peak"] or 0, rss)
+                    self.rss_peak = max(self.rss_peak or 0, rss)
+                if traced is not None:
+                    entry["traced_peak"] = max(entry["traced_peak"] or 0, traced)
+
+    def maybe_collect(self) -> bool:
+        """gc.collect() tylko po przekroczeniu progu wzrostu RSS; zwraca True, gdy zbierano"""
+        rss = current_rss()
+        with self._lock:
+            self.checks += 1
+            if rss is None or self.gc_threshold <= 0 or rss - self._baseline < self.gc_threshold:
+                return False
+            growth = rss - self._baseline
+        # Jeden wątek zbiera, pozostałe nie czekają
+        if not self._collect_lock.acquire(blocking=False):
+            return False
+        try:
+            started = time.perf_counter()
+            collected = gc.collect()
+            after = current_rss()
+            with self._lock:
+                self._baseline = after
+                self.collections.append({"rss_before": rss, "rss_after": after, "objects": collected,
+                                         "time": time.perf_counter() - started})
+            logger.info(f"🧹 GC po wzroście RSS o {growth / 1024 / 1024:.0f} MB: "
+                        f"{rss / 1024 / 1024:.0f} -> {after / 1024 / 1024:.0f} MB")
+            return True
+        finally:
+            self._collect_lock.release()
+
+    def get_stats(self) -> Dict[str, Any]:
+        rss_end = current_rss()
+        with self._lock:
+            return {
+                "rss_available": _process is not None,
+                "rss_start": self.rss_start,
+                "rss_end": rss_end,
+                "rss_peak": max(self.rss_peak or 0, rss_end or 0) if rss_end is not None else None,
+                "tracemalloc": tracemalloc.is_tracing(),
+                "gc_threshold": self.gc_threshold,
+                "gc_checks": self.checks,
+                "gc_collections": list(self.collections),
+                "stages": {name: dict(entry) for name, entry in self.stages.items()},
+            }
@@ -0,0 +1,196 @@
+# app/ncshot_backends.py - rejestr instancji NCShot z wyborem najmniej obciążonej
+
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterable, List, Optional
+
+from app.ncshot_client import DEFAULT_MAX_IDLE, NcshotClient
+
+logger = logging.getLogger(__name__)
+
+# Co ile sekund sprawdzać instancję, której żądanie próbne (stan półotwarty) jeszcze trwa
+HALF_OPEN_POLL_INTERVAL = 1.0
+
+
+class NcshotBackend:
+    """
+    Pojedyncza instancja NCShot: klient z pulą połączeń, licznik trzymanych tokenów
+    i circuit breaker otwierany przy bad_alloc/5xx.
+    """
+
+    def __init__(self, host: str, port: int, weight: float = 1.0, pool_size: int = 4,
+                 breaker_threshold: int = 1, breaker_cooldown: float = 60.0,
+                 pool_max_idle: float = DEFAULT_MAX_IDLE):
+        self.host = host
+        self.port = port
+        self.name = f"{host}:{port}"
+        self.weight = max(0.1, float(weight))
+        self.client = NcshotClient(host, port, pool_size=pool_size, max_idle=pool_max_idle)
+        self.breaker_threshold = max(1, int(breaker_threshold))
+        self.breaker_cooldown = breaker_cooldown
+
+        self._lock = threading.Lock()
+        self.outstanding = 0
+        self.consecutive_failures = 0
+        self.open_until = 0.0
+        self.trial_in_flight = False
+        self.last_error = None
+        self.stats = {"dispatched": 0, "succeeded": 0, "failed": 0, "breaker_trips": 0, "trials": 0}
+
+    # ----- circuit breaker -----
+    @property
+    def available(self) -> bool:
+        """Breaker zamknięty albo minął czas ochłodzenia i nie trwa żądanie próbne (stan półotwarty)"""
+        if not self.open_until:
+            return True
+        return time.monotonic() >= self.open_until and not self.trial_in_flight
+
+    def available_in(self) -> float:
+        """Sekundy do chwili, gdy instancja może przyjąć żądanie (0 - od razu)"""
+        with self._lock:
+            if not self.open_until:
+                return 0.0
+            remaining = self.open_until - time.monotonic()
+            if remaining > 0:
+                return remaining
+            return HALF_OPEN_POLL_INTERVAL if self.trial_in_flight else 0.0
+
+    def try_claim(self) -> Optional[str]:
+        """
+        Rezerwuje wysłanie żądania: "closed" przy zamkniętym breakerze, "half_open" dla jedynego
+        żądania próbnego po czasie ochłodzenia (kolejne czekają na jego wynik), None - odmowa.
+        """
+        with self._lock:
+            if not self.open_until:
+                return "closed"
+            if time.monotonic() < self.open_until or self.trial_in_flight:
+                return None
+            self.trial_in_flight = True
+            self.stats["trials"] += 1
+        logger.info(f"🔎 NCShot {self.name}: stan półotwarty - wysyłam żądanie próbne")
+        return "half_open"
+
+    def end_trial(self) -> None:
+        """Kończy żądanie próbne; bez record_success/record_failure kolejne żądanie spróbuje ponownie"""
+        with self._lock:
+            self.trial_in_flight = False
+
+    def record_success(self) -> None:
+        with self._lock:
+            self.consecutive_failures = 0
+            self.open_until = 0.0
+            self.stats["succeeded"] += 1
+
+    def record_failure(self, reason: str, fatal: bool = False) -> None:
+        """Rejestruje błąd; `fatal` (bad_alloc/5xx) i błąd żądania próbnego otwierają breaker od razu"""
+        with self._lock:
+            self.consecutive_failures += 1
+            self.stats["failed"] += 1
+            self.last_error = reason
+            if fatal or self.trial_in_flight or self.consecutive_failures >= self.breaker_threshold:
+                self.open_until = time.monotonic() + self.breaker_cooldown
+                self.stats["breaker_trips"] += 1
+                logger.error(f"💥 Circuit breaker NCShot {self.name} otwarty na {self.breaker_cooldown:.0f}s: {reason}")
+
+    # ----- obciążenie -----
+    def load(self) -> float:
+        """Obciążenie ważone: (tokeny w użyciu + 1) / waga"""
+        return (self.outstanding + 1) / self.weight
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self.stats)
+            stats.update({
+                "name": self.name,
+                "weight": self.weight,
+                "outstanding_tokens": self.outstanding,
+                "available": self.available,
+                "breaker_open_for": max(0.0, self.open_until - time.monotonic()),
+                "half_open": bool(self.open_until) and time.monotonic() >= self.open_until,
+                "trial_in_flight": self.trial_in_flight,
+                "consecutive_failures": self.consecutive_failures,
+                "last_error": self.last_error,
+            })
+        stats["pool"] = self.client.get_stats()
+        return stats
+
+
+class NcshotBackendRegistry:
+    """Zbiór instancji NCShot; obrazy trafiają do dostępnej instancji o najmniejszym obciążeniu"""
+
+    def __init__(self, backends: List[NcshotBackend]):
+        if not backends:
+            raise ValueError("Wymagana jest co najmniej jedna instancja NCShot")
+        self.backends = backends
+        self._lock = threading.Lock()
+
+    @property
+    def primary(self) -> NcshotBackend:
+        return self.backends[0]
+
+    def get(self, name: str) -> Optional[NcshotBackend]:
+        return next((b for b in self.backends if b.name == name), None)
+
+    def available(self, exclude: Iterable[str] = ()) -> List[NcshotBackend]:
+        excluded = set(exclude)
+        return [b for b in self.backends if b.available and b.name not in excluded]
+
+    def next_available_in(self) -> float:
+        """Sekundy do chwili, gdy najwcześniej któraś instancja przyjmie żądanie (0, gdy jakaś jest dostępna)"""
+        return min(b.available_in() for b in self.backends)
+
+    @contextmanager
+    def dispatch(self, exclude: Iterable[str] = ()):
+        """
+        Wybiera najmniej obciążoną dostępną instancję i liczy ją jako trzymającą token
+        do końca bloku. Zwraca None, gdy żadna instancja nie jest dostępna. Instancja
+        w stanie półotwartym dostaje tylko jedno żądanie próbne naraz.
+        """
+        backend = claim = None
+        with self._lock:
+            for candidate in sorted(self.available(exclude), key=lambda b: b.load()):
+                claim = candidate.try_claim()
+                if claim:
+                    backend = candidate
+                    backend.outstanding += 1
+                    backend.stats["dispatched"] += 1
+                    break
+        try:
+            yield backend
+        finally:
+            if backend:
+                if claim == "half_open":
+                    backend.end_trial()
+                with self._lock:
+                    backend.outstanding -= 1
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "backends": [b.get_stats() for b in self.backends],
+            "available": len(self.available()),
+            "total": len(self.backends),
+        }
+
+    def close(self) -> None:
+        for backend in self.backends:
+            backend.client.close()
+
+
+def parse_backends(spec: str, default_host: str, default_port: int, **backend_kwargs) -> List[NcshotBackend]:
+    """
+    Parsuje listę instancji w formacie `host[:port][*waga]`, rozdzielonych przecinkami,
+    np. `192.168.122.228:5543,192.168.122.229:5543*2`. Pusta lista = jedna instancja domyślna.
+    """
+    backends = []
+    for item in (part.strip() for part in (spec or "").split(",")):
+        if not item:
+            continue
+        address, _, weight = item.partition("*")
+        host, _, port = address.partition(":")
+        backends.append(NcshotBackend(host or default_host, int(port) if port else default_port,
+                                      weight=float(weight) if weight else 1.0, **backend_kwargs))
+    if not backends:
+        backends.append(NcshotBackend(default_host, default_port, **backend_kwargs))
+    return backends
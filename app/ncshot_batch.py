@@ -0,0 +1,102 @@
+# app/ncshot_batch.py - współbieżny silnik wsadowy NCShot z oknem obrazów "w locie"
+
+import contextvars
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Optional, Sequence
+
+logger = logging.getLogger(__name__)
+
+
+class NcshotBatchEngine:
+    """
+    Przetwarza obrazy wsadu współbieżnie, utrzymując najwyżej `window` obrazów w locie.
+
+    Każdy obraz przechodzi cały potok (dekodowanie, PUT, parsowanie XML, tablice,
+    zwolnienie tokenu) we własnym wątku, więc etapy kolejnych obrazów nakładają się.
+    Liczba jednocześnie trzymanych tokenów NCShot jest ograniczona osobnym semaforem,
+    a `abort()` (np. po bad_alloc) wstrzymuje uruchamianie kolejnych obrazów.
+    """
+
+    def __init__(self, window: int = 1, max_outstanding_tokens: Optional[int] = None):
+        self.window = max(1, int(window))
+        self.max_outstanding_tokens = max(1, int(max_outstanding_tokens or self.window))
+        self._token_slots = threading.BoundedSemaphore(self.max_outstanding_tokens)
+        self._abort = threading.Event()
+        self._lock = threading.Lock()
+        self.abort_reason = None
+        self.outstanding_tokens = 0
+        self.peak_outstanding_tokens = 0
+        self.peak_in_flight = 0
+
+    @property
+    def aborted(self) -> bool:
+        return self._abort.is_set()
+
+    def pause(self, seconds: float) -> bool:
+        """Czeka `seconds` (np. na zamknięcie breakera instancji); zwraca False, gdy wsad przerwano"""
+        return not self._abort.wait(seconds)
+
+    def abort(self, reason: str) -> None:
+        """Zatrzymuje uruchamianie kolejnych obrazów (obrazy w locie kończą się normalnie)"""
+        if not self._abort.is_set():
+            self.abort_reason = reason
+            self._abort.set()
+            logger.error(f"💥 Przerwanie wsadu NCShot: {reason}")
+
+    @contextmanager
+    def token_slot(self):
+        """Rezerwuje miejsce na token NCShot na czas od PUT obrazu do zwolnienia tokenu"""
+        self._token_slots.acquire()
+        with self._lock:
+            self.outstanding_tokens += 1
+            self.peak_outstanding_tokens = max(self.peak_outstanding_tokens, self.outstanding_tokens)
+        try:
+            yield
+        finally:
+            with self._lock:
+                self.outstanding_tokens -= 1
+            self._token_slots.release()
+
+    def run(self, items: Sequence[Any], process: Callable[[int, Any], Any]) -> Dict[int, Any]:
+        """
+        Uruchamia `process(index, item)` dla elementów wsadu.
+
+        Zwraca słownik {index: wynik} w kolejności indeksów; elementy nieuruchomione
+        z powodu przerwania wsadu nie mają wpisu.
+        """
+        results = {}
+        next_index = 0
+        in_flight = {}
+
+        with ThreadPoolExecutor(max_workers=self.window, thread_name_prefix="ncshot-batch") as executor:
+            while next_index < len(items) or in_flight:
+                # Dopełnij okno, dopóki wsad nie został przerwany
+                while next_index < len(items) and len(in_flight) < self.window and not self.aborted:
+                    # Każdy obraz we własnej kopii kontekstu (id korelacji zadania w logach)
+                    future = executor.submit(contextvars.copy_context().run, process, next_index, items[next_index])
+                    in_flight[future] = next_index
+                    next_index += 1
+                self.peak_in_flight = max(self.peak_in_flight, len(in_flight))
+
+                if not in_flight:
+                    break
+
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    index = in_flight.pop(future)
+                    results[index] = future.result()
+
+        return dict(sorted(results.items()))
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "window": self.window,
+            "max_outstanding_tokens": self.max_outstanding_tokens,
+            "peak_in_flight": self.peak_in_flight,
+            "peak_outstanding_tokens": self.peak_outstanding_tokens,
+            "aborted": self.aborted,
+            "abort_reason": self.abort_reason,
+        }
@@ -0,0 +1,245 @@
+# app/ncshot_client.py - wspólny klient HTTP NCShot z pulą połączeń keep-alive
+
+import http.client as httplib
+import logging
+import select
+import socket
+import threading
+import time
+from typing import Dict, Any, Optional, NamedTuple
+
+logger = logging.getLogger(__name__)
+
+# Timeouty (sekundy) dla poszczególnych operacji NCShot
+DEFAULT_TIMEOUTS = {
+    "health": 5,
+    "config": 30,
+    "image": 60,
+    "probe": 5,
+    "plate": 15,
+    "release": 10,
+    "default": 30,
+}
+
+# Błędy oznaczające, że serwer zamknął połączenie keep-alive między żądaniami
+_STALE_CONNECTION_ERRORS = (
+    httplib.RemoteDisconnected,
+    httplib.CannotSendRequest,
+    httplib.BadStatusLine,
+    BrokenPipeError,
+    ConnectionResetError,
+    ConnectionAbortedError,
+)
+
+# Metody, które można bezpiecznie wysłać ponownie - PUT obrazu/konfiguracji mógł już dotrzeć do NCShot,
+# więc ponawiamy go tylko, gdy do serwera nie trafił ani jeden bajt żądania
+_RETRYABLE_METHODS = ("GET", "HEAD")
+
+# Połączenie bezczynne dłużej (sekundy) jest zamykane zamiast ponownie używane
+DEFAULT_MAX_IDLE = 30.0
+
+
+class _PooledConnection(httplib.HTTPConnection):
+    """Połączenie z puli: pamięta, od kiedy jest bezczynne i ile bajtów bieżącego żądania wysłało"""
+
+    idle_since = 0.0
+    bytes_sent = 0
+
+    def send(self, data):
+        super().send(data)
+        self.bytes_sent += len(data) if isinstance(data, (bytes, bytearray, memoryview)) else 1
+
+
+def _connection_dropped(conn: httplib.HTTPConnection) -> bool:
+    """
+    Sprawdza bez blokowania, czy serwer zamknął bezczynne połączenie (jak urllib3):
+    gniazdo gotowe do odczytu przed wysłaniem żądania oznacza EOF albo nieoczekiwane dane.
+    """
+    sock = conn.sock
+    if sock is None:
+        return True
+    try:
+        readable, _, _ = select.select([sock], [], [], 0)
+    except (OSError, ValueError):
+        return True
+    return bool(readable)
+
+
+class NcshotResponse(NamedTuple):
+    """Odpowiedź NCShot odczytana w całości (połączenie wraca do puli)"""
+    status: int
+    reason: str
+    headers: Dict[str, str]
+    data: bytes
+
+    def getheader(self, name: str, default: Optional[str] = None) -> Optional[str]:
+        return self.headers.get(name.lower(), default)
+
+
+class NcshotClient:
+    """
+    Klient NCShot z ograniczoną pulą połączeń keep-alive.
+
+    Pula trzyma najwyżej `pool_size` połączeń; wątek, który nie dostanie
+    połączenia, czeka do `acquire_timeout` sekund. Połączenie bezczynne dłużej
+    niż `max_idle` sekund albo zamknięte już przez serwer nie jest ponownie używane.
+    """
+
+    def __init__(self, host: str, port: int, pool_size: int = 4,
+                 timeouts: Optional[Dict[str, float]] = None,
+                 acquire_timeout: float = 120.0, max_idle: float = DEFAULT_MAX_IDLE):
+        self.host = host
+        self.port = port
+        self.pool_size = max(1, int(pool_size))
+        self.timeouts = dict(DEFAULT_TIMEOUTS)
+        if timeouts:
+            self.timeouts.update(timeouts)
+        self.acquire_timeout = acquire_timeout
+        self.max_idle = max_idle
+
+        self._idle = []  # bezczynne połączenia (LIFO - najświeższe najpierw)
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(self.pool_size)
+        self._stats = {
+            "requests": 0,
+            "errors": 0,
+            "connections_created": 0,
+            "connections_reused": 0,
+            "connections_closed": 0,
+            "stale_retries": 0,
+            "stale_discarded": 0,
+            "in_use": 0,
+            "wait_time_total": 0.0,
+            "by_operation": {},
+        }
+
+    # ----- pula -----
+    def _acquire(self) -> _PooledConnection:
+        started = time.monotonic()
+        if not self._slots.acquire(timeout=self.acquire_timeout):
+            raise TimeoutError(f"Brak wolnego połączenia NCShot po {self.acquire_timeout}s")
+        with self._lock:
+            self._stats["wait_time_total"] += time.monotonic() - started
+            self._stats["in_use"] += 1
+            conn = self._idle.pop() if self._idle else None
+        if conn is not None and (time.monotonic() - conn.idle_since > self.max_idle
+                                 or _connection_dropped(conn)):
+            # Serwer mógł zamknąć połączenie po okresie bezczynności - nie wysyłamy przez nie żądania
+            conn.close()
+            conn = None
+            with self._lock:
+                self._stats["stale_discarded"] += 1
+                self._stats["connections_closed"] += 1
+        return conn or _PooledConnection(self.host, self.port)
+
+    def _release(self, conn: _PooledConnection, reusable: bool) -> None:
+        with self._lock:
+            self._stats["in_use"] -= 1
+            if reusable and conn.sock is not None:
+                conn.idle_since = time.monotonic()
+                self._idle.append(conn)
+                conn = None
+            else:
+                self._stats["connections_closed"] += 1
+        if conn is not None:
+            conn.close()
+        self._slots.release()
+
+    def _count(self, key: str, value=1) -> None:
+        with self._lock:
+            self._stats[key] += value
+
+    # ----- żądania -----
+    def request(self, method: str, path: str, body: Optional[bytes] = None,
+                headers: Optional[Dict[str, str]] = None, operation: str = "default",
+                timeout: Optional[float] = None) -> NcshotResponse:
+        """Wykonuje żądanie przez połączenie z puli i zwraca całą odpowiedź"""
+        timeout = timeout if timeout is not None else self.timeouts.get(operation, self.timeouts["default"])
+        headers = dict(headers or {})
+        if body is not None:
+            headers.setdefault("Content-Length", str(len(body)))
+
+        started = time.monotonic()
+        conn = self._acquire()
+        reusable = False
+        try:
+            for attempt in (1, 2):
+                fresh = conn.sock is None
+                conn.timeout = timeout
+                conn.bytes_sent = 0
+                try:
+                    if fresh:
+                        conn.connect()
+                        self._count("connections_created")
+                    else:
+                        conn.sock.settimeout(timeout)
+                        self._count("connections_reused")
+
+                    conn.request(method, path, body, headers)
+                    resp = conn.getresponse()
+                    data = resp.read()
+                    reusable = not resp.will_close
+                    break
+                except _STALE_CONNECTION_ERRORS:
+                    conn.close()
+                    # Ponów żądanie, gdy serwer zamknął połączenie z puli: idempotentne zawsze,
+                    # pozostałe tylko wtedy, gdy nie wysłaliśmy jeszcze żadnego bajtu
+                    if fresh or attempt == 2 or (method not in _RETRYABLE_METHODS and conn.bytes_sent):
+                        raise
+                    self._count("stale_retries")
+
+            self._record(operation, time.monotonic() - started, ok=True)
+            return NcshotResponse(
+                status=resp.status,
+                reason=resp.reason,
+                headers={k.lower(): v for k, v in resp.getheaders()},
+                data=data,
+            )
+        except Exception:
+            self._record(operation, time.monotonic() - started, ok=False)
+            raise
+        finally:
+            self._release(conn, reusable)
+
+    def get(self, path: str, operation: str = "default", timeout: Optional[float] = None) -> NcshotResponse:
+        return self.request("GET", path, operation=operation, timeout=timeout)
+
+    def put(self, path: str, body: bytes, content_type: str, operation: str = "default",
+            timeout: Optional[float] = None) -> NcshotResponse:
+        return self.request("PUT", path, body, {"Content-Type": content_type},
+                            operation=operation, timeout=timeout)
+
+    def _record(self, operation: str, elapsed: float, ok: bool) -> None:
+        with self._lock:
+            self._stats["requests"] += 1
+            if not ok:
+                self._stats["errors"] += 1
+            op = self._stats["by_operation"].setdefault(operation, {"count": 0, "errors": 0, "time_total": 0.0})
+            op["count"] += 1
+            op["time_total"] += elapsed
+            if not ok:
+                op["errors"] += 1
+
+    # ----- zarządzanie -----
+    def get_stats(self) -> Dict[str, Any]:
+        """Statystyki puli połączeń"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats["by_operation"] = {
+                name: dict(op, avg_time=op["time_total"] / op["count"] if op["count"] else 0.0)
+                for name, op in self._stats["by_operation"].items()
+            }
+            stats["idle"] = len(self._idle)
+        stats.update({"host": self.host, "port": self.port, "pool_size": self.pool_size})
+        return stats
+
+    def close(self) -> None:
+        """Zamyka wszystkie bezczynne połączenia"""
+        with self._lock:
+            idle, self._idle = self._idle, []
+            self._stats["connections_closed"] += len(idle)
+        for conn in idle:
+            try:
+                conn.close()
+            except (OSError, socket.error):
+                pass
@@ -0,0 +1,280 @@
+# app/ncshot_jobs.py - zadania NCShot w tle z postępem per obraz
+
+import contextvars
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from array import array
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional
+
+from app.ncshot_batch import NcshotBatchEngine
+
+logger = logging.getLogger(__name__)
+
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_DONE = "done"
+JOB_FAILED = "failed"
+JOB_CANCELLED = "cancelled"
+
+FINISHED_STATES = (JOB_DONE, JOB_FAILED, JOB_CANCELLED)
+
+
+class NcshotJob:
+    """
+    Pojedyncze zadanie wsadowe NCShot.
+
+    Zdarzenia (wyniki obrazów, zakończenie) są numerowane kursorem, więc klient strumienia
+    może dołączyć w dowolnym momencie i odtworzyć je od dowolnego miejsca. Z `results_dir`
+    wyniki obrazów trafiają tylko do pliku NDJSON zadania, a w pamięci zostaje jedynie
+    położenie linii w pliku (8 bajtów na obraz); zdarzenia odtwarza się z pliku
+    (`load_results()`). Bez `results_dir` zdarzenia obrazów są trzymane w liście `events`.
+    Zdarzenia zadania (`add_event`, np. zakończenie) następują po wynikach obrazów;
+    stan końcowy i jego zdarzenie ustawia razem `finish()`.
+    """
+
+    def __init__(self, total: int, results_dir: Optional[str] = None):
+        self.id = uuid.uuid4().hex
+        self.results_path = os.path.join(results_dir, f"{self.id}.ndjson") if results_dir else None
+        self._results_file = open(self.results_path, "ab") if self.results_path else None
+        self._results_size = 0
+        self.total = total
+        self.state = JOB_QUEUED
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.error = None
+        self.stats = None
+        self.completed = 0
+        self.failed = 0
+        self.engine = None
+        self.events: List[Dict[str, Any]] = []
+        self._result_offsets = array("Q")
+        self._cond = threading.Condition()
+        self._cancel_requested = False
+
+    # ----- zdarzenia -----
+    @property
+    def event_count(self) -> int:
+        return len(self._result_offsets) + len(self.events)
+
+    def add_event(self, event: Dict[str, Any]) -> None:
+        with self._cond:
+            self.events.append(event)
+            self._cond.notify_all()
+
+    def add_image_result(self, index: int, status: str, result: Optional[Dict[str, Any]]) -> None:
+        """Publikuje wynik pojedynczego obrazu (wywoływane z wątków wsadu)"""
+        with self._cond:
+            if status == "ok":
+                self.completed += 1
+            elif status == "failed":
+                self.failed += 1
+            if self._results_file:
+                line = json.dumps({"index": index, "status": status, "result": result}).encode("utf-8") + b"\n"
+                self._results_file.write(line)
+                self._results_file.flush()
+                self._result_offsets.append(self._results_size)
+                self._results_size += len(line)
+            else:
+                self.events.append({"type": "image", "index": index, "key": f"image_{index}",
+                                    "status": status, "result": result})
+            self._cond.notify_all()
+
+    def _events_from(self, cursor: int) -> List[Dict[str, Any]]:
+        """Zdarzenia od `cursor`; wyniki obrazów z pliku jako położenie linii (`result_offset`, `result_size`)"""
+        on_disk = len(self._result_offsets)
+        events = []
+        for n in range(cursor, on_disk):
+            start = self._result_offsets[n]
+            end = self._result_offsets[n + 1] if n + 1 < on_disk else self._results_size
+            events.append({"type": "image", "result_offset": start, "result_size": end - start})
+        return events + self.events[max(0, cursor - on_disk):]
+
+    def load_results(self, events: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Uzupełnia zdarzenia obrazów o wyniki zapisane w pliku NDJSON zadania"""
+        if not self.results_path or not any("result_offset" in event for event in events):
+            return events
+        loaded = []
+        with open(self.results_path, "rb") as f:
+            for event in events:
+                if "result_offset" in event:
+                    f.seek(event["result_offset"])
+                    record = json.loads(f.read(event["result_size"]))
+                    event = {"type": "image", "index": record["index"], "key": f"image_{record['index']}",
+                             "status": record["status"], "result": record["result"]}
+                loaded.append(event)
+        return loaded
+
+    def finish(self, state: str, stats: Optional[Dict[str, Any]] = None, error: Optional[str] = None) -> None:
+        """
+        Kończy zadanie: stan końcowy i zdarzenie zakończenia pod jedną blokadą - czytelnik,
+        który widzi `finished`, widzi też zdarzenie zakończenia (ze statystykami i błędem).
+        """
+        with self._cond:
+            if self._results_file:
+                self._results_file.close()
+                self._results_file = None
+            self.stats = stats
+            self.error = error
+            self.finished_at = time.time()
+            self.events.append({"type": state, "stats": stats, "error": error})
+            self.state = state
+            self._cond.notify_all()
+
+    def close_results(self) -> None:
+        with self._cond:
+            if self._results_file:
+                self._results_file.close()
+                self._results_file = None
+
+    def remove_results(self) -> None:
+        self.close_results()
+        if self.results_path:
+            try:
+                os.remove(self.results_path)
+            except FileNotFoundError:
+                pass
+
+    def wait_for_events(self, cursor: int, timeout: float = 1.0) -> List[Dict[str, Any]]:
+        """Zwraca zdarzenia od `cursor`, czekając do `timeout` sekund na nowe"""
+        with self._cond:
+            if cursor >= self.event_count and self.state not in FINISHED_STATES:
+                self._cond.wait(timeout)
+            return self._events_from(cursor)
+
+    # ----- stan -----
+    @property
+    def finished(self) -> bool:
+        return self.state in FINISHED_STATES
+
+    def cancel(self) -> bool:
+        """Zatrzymuje uruchamianie kolejnych obrazów; obrazy w locie kończą się i zwalniają tokeny"""
+        if self.finished:
+            return False
+        self._cancel_requested = True
+        if self.engine:
+            self.engine.abort("anulowano przez użytkownika")
+        return True
+
+    @property
+    def cancel_requested(self) -> bool:
+        return self._cancel_requested
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "job_id": self.id,
+            "state": self.state,
+            "total": self.total,
+            "completed": self.completed,
+            "failed": self.failed,
+            "progress": (self.completed + self.failed) / self.total * 100 if self.total else 0,
+            "events": self.event_count,
+            "results_on_disk": self.results_path is not None,
+            "error": self.error,
+            "stats": self.stats,
+            "created_at": datetime.fromtimestamp(self.created_at).isoformat(),
+            "started_at": datetime.fromtimestamp(self.started_at).isoformat() if self.started_at else None,
+            "finished_at": datetime.fromtimestamp(self.finished_at).isoformat() if self.finished_at else None,
+        }
+
+
+class NcshotJobManager:
+    """Kolejka zadań NCShot wykonywanych na puli wątków poza pętlą zdarzeń"""
+
+    def __init__(self, workers: int = 2, ttl: float = 3600.0, results_dir: Optional[str] = None):
+        self.ttl = ttl
+        self.results_dir = results_dir
+        if results_dir:
+            os.makedirs(results_dir, exist_ok=True)
+            # Pliki wyników zadań poprzednich procesów - zadania nie przetrwały restartu
+            for name in os.listdir(results_dir):
+                path = os.path.join(results_dir, name)
+                if name.endswith(".ndjson") and time.time() - os.path.getmtime(path) > ttl:
+                    os.remove(path)
+        self._executor = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="ncshot-job")
+        self._jobs: Dict[str, NcshotJob] = {}
+        self._lock = threading.Lock()
+
+    def submit(self, total: int, run: Callable[[NcshotJob], Dict[str, Any]],
+               cleanup: Optional[Callable[[], None]] = None) -> NcshotJob:
+        """
+        Kolejkuje zadanie. `run(job)` wykonuje przetwarzanie i zwraca słownik wyników
+        z kluczem `_stats`; wyniki obrazów publikuje przez `job.add_image_result`.
+        `cleanup()` jest wywoływane po zakończeniu zadania, także anulowanego przed startem.
+        """
+        self._prune()
+        job = NcshotJob(total, results_dir=self.results_dir)
+        with self._lock:
+            self._jobs[job.id] = job
+        # Kontekst (id korelacji żądania) przechodzi do wątku zadania
+        self._executor.submit(contextvars.copy_context().run, self._execute, job, run, cleanup)
+        logger.info(f"📥 Zadanie NCShot {job.id} w kolejce ({total} obrazów)")
+        return job
+
+    def _execute(self, job: NcshotJob, run: Callable[[NcshotJob], Dict[str, Any]],
+                 cleanup: Optional[Callable[[], None]] = None) -> None:
+        try:
+            self._run_job(job, run)
+        finally:
+            if cleanup:
+                try:
+                    cleanup()
+                except Exception as e:
+                    logger.warning(f"⚠ī¸ Błąd sprzątania po zadaniu NCShot {job.id}: {e}")
+
+    def _run_job(self, job: NcshotJob, run: Callable[[NcshotJob], Dict[str, Any]]) -> None:
+        if job.cancel_requested:
+            job.finish(JOB_CANCELLED)
+            return
+
+        job.state = JOB_RUNNING
+        job.started_at = time.time()
+        state, stats, error = JOB_FAILED, None, None
+        try:
+            stats = run(job).get("_stats")
+            state = JOB_CANCELLED if job.cancel_requested else JOB_DONE
+        except Exception as e:
+            logger.error(f"⚠ī¸ Zadanie NCShot {job.id} nieudane: {e}")
+            error = getattr(e, "detail", None) or str(e)
+        finally:
+            job.finish(state, stats, error)
+            logger.info(f"🏁 Zadanie NCShot {job.id}: {job.state}")
+
+    def new_engine(self, job: NcshotJob, window: int, max_outstanding_tokens: Optional[int] = None) -> NcshotBatchEngine:
+        """Tworzy silnik wsadu powiązany z zadaniem (anulowanie zadania przerywa wsad)"""
+        engine = NcshotBatchEngine(window=window, max_outstanding_tokens=max_outstanding_tokens)
+        job.engine = engine
+        if job.cancel_requested:
+            engine.abort("anulowano przez użytkownika")
+        return engine
+
+    def get(self, job_id: str) -> Optional[NcshotJob]:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def list_jobs(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            jobs = list(self._jobs.values())
+        return [job.to_dict() for job in jobs]
+
+    def _prune(self) -> None:
+        """Usuwa zakończone zadania starsze niż TTL"""
+        now = time.time()
+        with self._lock:
+            expired = [job_id for job_id, job in self._jobs.items()
+                       if job.finished and job.finished_at and now - job.finished_at > self.ttl]
+            for job_id in expired:
+                self._jobs.pop(job_id).remove_results()
+
+    def shutdown(self) -> None:
+        with self._lock:
+            jobs = list(self._jobs.values())
+        for job in jobs:
+            job.cancel()
+        self._executor.shutdown(wait=False)
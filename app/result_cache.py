@@ -0,0 +1,243 @@
+# app/result_cache.py - dyskowy cache wyników NCShot adresowany treścią
+
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional
+
+try:
+    import fcntl
+except ImportError:  # Windows - blokada tylko w obrębie procesu
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+
+def sha256_hex(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+class CachedResult:
+    """Wpis cache: surowy XML NCShot i wycinki tablic (None gdy tablica nie miała obrazu)"""
+
+    __slots__ = ("xml", "plates")
+
+    def __init__(self, xml: str, plates: List[Optional[bytes]]):
+        self.xml = xml
+        self.plates = plates
+
+
+class NcshotResultCache:
+    """
+    Cache wyników NCShot na dysku, kluczowany (SHA obrazu, SHA konfiguracji INI, flagi NCShot).
+
+    Każdy wpis to katalog `<klucz>/` z plikami `result.xml`, `plate_<n>.jpg` i `meta.json`.
+    Katalog jest wspólny dla workerów uvicorn: wpis zapisany przez inny worker jest przejmowany
+    do indeksu przy pierwszym odczycie, a limit `max_bytes` dotyczy całego katalogu - eksmisja
+    (LRU wg czasu modyfikacji katalogu wpisu) skanuje katalog pod blokadą flock.
+    """
+
+    def __init__(self, directory: str, max_bytes: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entries: Dict[str, Dict[str, float]] = {}  # klucz -> {"size", "atime"}
+        self._stats = {"hits": 0, "misses": 0, "stores": 0, "evictions": 0, "errors": 0}
+        if self.enabled:
+            os.makedirs(directory, exist_ok=True)
+            self._scan()
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    @staticmethod
+    def make_key(image_sha: str, ini_sha: str, flags: str) -> str:
+        return sha256_hex(f"{image_sha}:{ini_sha}:{flags}".encode("utf-8"))
+
+    def _entry_dir(self, key: str) -> str:
+        return os.path.join(self.directory, key)
+
+    @staticmethod
+    def _entry_size(path: str) -> int:
+        return sum(entry.stat().st_size for entry in os.scandir(path) if entry.is_file())
+
+    def _read_directory(self) -> Dict[str, Dict[str, float]]:
+        """
+        Wpisy aktualnie na dysku (także zapisane przez inne workery); rozmiar liczony
+        tylko dla wpisów spoza indeksu, pozostałe biorą go z indeksu
+        """
+        with self._lock:
+            known = {key: entry["size"] for key, entry in self._entries.items()}
+        entries = {}
+        for name in os.listdir(self.directory):
+            if name.startswith("."):  # pliki tymczasowe i blokada
+                continue
+            path = self._entry_dir(name)
+            try:
+                if not os.path.isfile(os.path.join(path, "meta.json")):
+                    continue
+                size = known[name] if name in known else self._entry_size(path)
+                entries[name] = {"size": size, "atime": os.path.getmtime(path)}
+            except OSError:  # wpis usunięty w trakcie skanowania przez inny worker
+                continue
+        return entries
+
+    def _scan(self) -> None:
+        """Odtwarza indeks wpisów z dysku (po restarcie aplikacji)"""
+        self._entries = self._read_directory()
+        logger.info(f"💾 Cache wyników NCShot: {len(self._entries)} wpisów w {self.directory}")
+
+    def _adopt(self, key: str) -> bool:
+        """Dodaje do indeksu wpis zapisany na dysku przez inny worker; False, gdy go nie ma"""
+        path = self._entry_dir(key)
+        try:
+            if not os.path.isfile(os.path.join(path, "meta.json")):
+                return False
+            entry = {"size": self._entry_size(path), "atime": os.path.getmtime(path)}
+        except OSError:
+            return False
+        with self._lock:
+            self._entries.setdefault(key, entry)
+        return True
+
+    @contextmanager
+    def _directory_lock(self):
+        """Wyłączna blokada katalogu cache między workerami (eksmisja, czyszczenie)"""
+        with open(os.path.join(self.directory, ".lock"), "a") as f:
+            if fcntl:
+                fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+
+    # ----- odczyt / zapis -----
+    def get(self, key: str) -> Optional[CachedResult]:
+        if not self.enabled:
+            return None
+        with self._lock:
+            known = key in self._entries
+        if not known and not self._adopt(key):
+            with self._lock:
+                self._stats["misses"] += 1
+            return None
+        path = self._entry_dir(key)
+        try:
+            with open(os.path.join(path, "meta.json"), encoding="utf-8") as f:
+                meta = json.load(f)
+            with open(os.path.join(path, "result.xml"), encoding="utf-8") as f:
+                xml = f.read()
+            plates = []
+            for name in meta["plates"]:
+                if name is None:
+                    plates.append(None)
+                else:
+                    with open(os.path.join(path, name), "rb") as f:
+                        plates.append(f.read())
+            now = time.time()
+            os.utime(path, (now, now))
+            with self._lock:
+                self._stats["hits"] += 1
+                if key in self._entries:
+                    self._entries[key]["atime"] = now
+            return CachedResult(xml, plates)
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning(f"⚠ī¸ Uszkodzony wpis cache {key[:12]}: {e}")
+            with self._lock:
+                self._stats["misses"] += 1
+                self._stats["errors"] += 1
+            self._remove(key)
+            return None
+
+    def put(self, key: str, xml: str, plates: List[Optional[bytes]]) -> None:
+        if not self.enabled:
+            return
+        try:
+            # Zapis do katalogu tymczasowego i atomowa zmiana nazwy - brak częściowych wpisów
+            tmp_dir = tempfile.mkdtemp(prefix=".tmp-", dir=self.directory)
+            names = []
+            with open(os.path.join(tmp_dir, "result.xml"), "w", encoding="utf-8") as f:
+                f.write(xml)
+            for n, plate in enumerate(plates, start=1):
+                if plate is None:
+                    names.append(None)
+                    continue
+                name = f"plate_{n}.jpg"
+                with open(os.path.join(tmp_dir, name), "wb") as f:
+                    f.write(plate)
+                names.append(name)
+            with open(os.path.join(tmp_dir, "meta.json"), "w", encoding="utf-8") as f:
+                json.dump({"plates": names, "created_at": time.time()}, f)
+
+            size = sum(entry.stat().st_size for entry in os.scandir(tmp_dir) if entry.is_file())
+            target = self._entry_dir(key)
+            if os.path.exists(target):
+                # Ten sam wynik zapisał już inny worker - wystarczy go zaindeksować
+                shutil.rmtree(tmp_dir, ignore_errors=True)
+                self._adopt(key)
+                return
+            os.rename(tmp_dir, target)
+
+            with self._lock:
+                self._entries[key] = {"size": size, "atime": time.time()}
+                self._stats["stores"] += 1
+            self._evict()
+        except OSError as e:
+            logger.warning(f"⚠ī¸ Nie udało się zapisać wpisu cache {key[:12]}: {e}")
+            with self._lock:
+                self._stats["errors"] += 1
+
+    # ----- eksmisja -----
+    def _evict(self) -> None:
+        """Utrzymuje cały katalog (wpisy wszystkich workerów) w limicie `max_bytes`"""
+        with self._directory_lock():
+            entries = self._read_directory()
+            total = sum(e["size"] for e in entries.values())
+            victims = []
+            for key, entry in sorted(entries.items(), key=lambda kv: kv[1]["atime"]):
+                if total <= self.max_bytes:
+                    break
+                victims.append(key)
+                total -= entry["size"]
+            for key in victims:
+                entries.pop(key)
+                shutil.rmtree(self._entry_dir(key), ignore_errors=True)
+            with self._lock:
+                self._entries = entries
+                self._stats["evictions"] += len(victims)
+
+    def _remove(self, key: str) -> None:
+        with self._lock:
+            self._entries.pop(key, None)
+        shutil.rmtree(self._entry_dir(key), ignore_errors=True)
+
+    def clear(self) -> int:
+        if not self.enabled:
+            return 0
+        with self._directory_lock():
+            keys = list(self._read_directory())
+            for key in keys:
+                self._remove(key)
+        return len(keys)
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._stats)
+            stats["entries"] = len(self._entries)
+            stats["size_bytes"] = sum(e["size"] for e in self._entries.values())
+        lookups = stats["hits"] + stats["misses"]
+        stats.update({
+            "enabled": self.enabled,
+            "directory": self.directory,
+            "max_bytes": self.max_bytes,
+            "hit_rate": stats["hits"] / lookups * 100 if lookups else 0.0,
+        })
+        return stats
@@ -0,0 +1,308 @@
+# app/token_leases.py - rejestr dzierżaw tokenów NCShot z ponawianiem zwolnień w tle
+
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, List, Optional
+
+try:
+    import fcntl
+except ImportError:  # Windows - blokada tylko w obrębie procesu
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# release_fn(backend, token) -> True gdy NCShot zwolnił token (lub go już nie zna)
+ReleaseFn = Callable[[str, str], bool]
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _process_start(pid: int) -> Optional[int]:
+    """Czas startu procesu w tikach od uruchomienia systemu (Linux); None gdy nieznany"""
+    try:
+        with open(f"/proc/{pid}/stat", encoding="ascii", errors="replace") as f:
+            stat = f.read()
+        return int(stat.rsplit(")", 1)[1].split()[19])
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+class TokenLeaseRegistry:
+    """
+    Każdy token NCShot jest dzierżawą: instancja, właściciel (wsad), czas pobrania.
+
+    Dzierżawy procesu są trzymane w pamięci - pobranie i zwolnienie tokenu przy obrazie
+    nie dotyka pliku. Wątek sprzątający co `reap_interval` sekund zapisuje je do pliku JSON
+    (z blokadą flock) wspólnego dla workerów uvicorn i przejmuje dzierżawy procesów, które
+    padły (przy starcie następnego workera - `recover()`). Po awarii procesu niezwolnione
+    mogą zostać tylko tokeny pobrane w ostatnich `reap_interval` sekundach.
+    Właścicielem dzierżawy jest instancja rejestru (losowy identyfikator z chwili startu),
+    a nie sam PID - w kontenerze uvicorn po restarcie zwykle dostaje ten sam PID (często 1),
+    więc dzierżawy poprzedniego procesu o tym samym PID są obce i trafiają do zwolnienia.
+    Nieudane zwolnienie nie kończy się wyciekiem: wątek sprzątający ponawia je
+    z wykładniczym odstępem, a dzierżawy starsze niż `max_age` zwalnia wymuszenie.
+    """
+
+    def __init__(self, state_file: str, release_fn: ReleaseFn, max_age: float = 120.0,
+                 retry_base: float = 1.0, retry_max: float = 60.0, reap_interval: float = 2.0):
+        self.state_file = state_file
+        self.release_fn = release_fn
+        self.max_age = max_age
+        self.retry_base = retry_base
+        self.retry_max = retry_max
+        self.reap_interval = reap_interval
+        self.pid = os.getpid()
+        self.pid_start = _process_start(self.pid)
+        self.instance = uuid.uuid4().hex
+        self._lock = threading.Lock()
+        self._file_lock = threading.Lock()
+        self._leases: Dict[str, Dict[str, Any]] = {}
+        self._version = 0
+        self._synced_version = -1
+        self._stop = threading.Event()
+        self._reaper: Optional[threading.Thread] = None
+        self._stats = {"acquired": 0, "released": 0, "release_failures": 0, "reaped": 0,
+                       "forced": 0, "recovered": 0, "syncs": 0}
+        directory = os.path.dirname(state_file)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def _key(backend: str, token: str) -> str:
+        return f"{backend}|{token}"
+
+    def _owner_alive(self, lease: Dict[str, Any]) -> bool:
+        """Czy proces obcej dzierżawy nadal działa"""
+        pid = lease["pid"]
+        if pid == self.pid:
+            # Nasz PID, ale inna instancja - poprzedni proces z tym PID już nie działa
+            return False
+        if not _pid_alive(pid):
+            return False
+        # PID mógł zostać ponownie przydzielony innemu procesowi
+        started = lease.get("pid_start")
+        return started is None or _process_start(pid) in (None, started)
+
+    def _read_state(self) -> Dict[str, Dict[str, Any]]:
+        """Odczyt pliku dzierżaw z blokadą współdzieloną - nie czeka na pozostałych czytających"""
+        try:
+            with open(self.state_file, encoding="utf-8") as f:
+                if fcntl:
+                    fcntl.flock(f, fcntl.LOCK_SH)
+                try:
+                    content = f.read()
+                finally:
+                    if fcntl:
+                        fcntl.flock(f, fcntl.LOCK_UN)
+            return json.loads(content) if content.strip() else {}
+        except (FileNotFoundError, ValueError):
+            return {}
+
+    @contextmanager
+    def _locked_state(self):
+        """Otwiera plik dzierżaw z wyłączną blokadą i zapisuje go po wyjściu z bloku"""
+        with self._file_lock:
+            with open(self.state_file, "a+", encoding="utf-8") as f:
+                if fcntl:
+                    fcntl.flock(f, fcntl.LOCK_EX)
+                try:
+                    f.seek(0)
+                    content = f.read()
+                    try:
+                        state = json.loads(content) if content.strip() else {}
+                    except ValueError:
+                        logger.warning(f"⚠ī¸ Uszkodzony plik dzierżaw tokenów {self.state_file} - resetuję")
+                        state = {}
+                    before = json.dumps(state, sort_keys=True)
+                    yield state
+                    if json.dumps(state, sort_keys=True) != before:
+                        f.seek(0)
+                        f.truncate()
+                        json.dump(state, f)
+                        f.flush()
+                finally:
+                    if fcntl:
+                        fcntl.flock(f, fcntl.LOCK_UN)
+
+    # ----- dzierżawy -----
+    def acquire(self, backend: str, token: str, owner: str) -> None:
+        """Rejestruje token otrzymany z NCShot (przed pobieraniem tablic)"""
+        with self._lock:
+            self._leases[self._key(backend, token)] = {
+                "backend": backend, "token": token, "owner": owner, "instance": self.instance,
+                "pid": self.pid, "pid_start": self.pid_start, "acquired_at": time.time(),
+                "state": "held", "attempts": 0, "next_attempt": 0.0, "last_error": None,
+            }
+            self._version += 1
+            self._stats["acquired"] += 1
+
+    def release(self, backend: str, token: str) -> bool:
+        """
+        Zwalnia token od razu; przy błędzie dzierżawa przechodzi w stan "pending"
+        i zwolnienie ponowi wątek sprzątający. Zwraca True, gdy token zwolniono teraz.
+        """
+        key = self._key(backend, token)
+        with self._lock:
+            lease = self._leases.get(key)
+            if lease is None or lease["state"] == "releasing":
+                return lease is None
+            lease["state"] = "releasing"
+            self._version += 1
+            lease = dict(lease)
+        return self._attempt_release(key, lease)
+
+    def _attempt_release(self, key: str, lease: Dict[str, Any]) -> bool:
+        error = None
+        try:
+            released = self.release_fn(lease["backend"], lease["token"])
+        except Exception as e:
+            released, error = False, str(e)
+
+        with self._lock:
+            if released:
+                self._leases.pop(key, None)
+            elif key in self._leases:
+                entry = self._leases[key]
+                entry["attempts"] += 1
+                entry["state"] = "pending"
+                entry["last_error"] = error or "odmowa zwolnienia"
+                delay = min(self.retry_max, self.retry_base * 2 ** (entry["attempts"] - 1))
+                entry["next_attempt"] = time.time() + delay
+            self._version += 1
+            self._stats["released" if released else "release_failures"] += 1
+        if not released:
+            logger.warning(f"⚠ī¸ Nie udało się zwolnić tokenu {lease['token']} ({lease['backend']}): "
+                           f"{error or 'odmowa'} - ponowię w tle")
+        return released
+
+    # ----- plik wspólny dla workerów -----
+    def sync(self, take_over: bool = True) -> Dict[str, Dict[str, Any]]:
+        """
+        Zapisuje dzierżawy procesu do pliku jednym zapisem i (przy `take_over`) przejmuje
+        dzierżawy procesów, które już nie działają. Zwraca przejęte dzierżawy.
+        """
+        with self._lock:
+            version = self._version
+            own = {key: dict(lease) for key, lease in self._leases.items()}
+        if not take_over and version == self._synced_version:
+            return {}
+
+        taken = {}
+        with self._locked_state() as state:
+            for key, lease in list(state.items()):
+                if key in own:
+                    continue
+                if lease.get("instance") == self.instance:
+                    del state[key]  # zwolniona od ostatniego zapisu
+                elif take_over and not self._owner_alive(lease):
+                    # Worker, który padł (także w trakcie zwalniania)
+                    logger.warning(f"♻ī¸ Przejmuję token {lease['token']} ({lease['backend']}) "
+                                   f"po zakończonym procesie {lease['pid']}")
+                    lease.update(instance=self.instance, pid=self.pid, pid_start=self.pid_start,
+                                 state="releasing")
+                    taken[key] = dict(lease)
+            state.update(own)
+
+        with self._lock:
+            for key, lease in taken.items():
+                self._leases.setdefault(key, lease)
+            self._stats["recovered"] += len(taken)
+            self._stats["syncs"] += 1
+        self._synced_version = version
+        return taken
+
+    # ----- sprzątanie -----
+    def reap(self, recover: bool = False) -> int:
+        """Ponawia zaległe zwolnienia; zwraca liczbę zwolnionych tokenów"""
+        now = time.time()
+        leases = {}
+        if not recover:
+            with self._lock:
+                for key, lease in self._leases.items():
+                    if lease["state"] == "pending" and lease["next_attempt"] <= now:
+                        pass
+                    elif lease["state"] == "held" and now - lease["acquired_at"] > self.max_age:
+                        # Wsad trzyma token zbyt długo
+                        self._stats["forced"] += 1
+                        logger.warning(f"⏱ī¸ Token {lease['token']} ({lease['backend']}) trzymany "
+                                       f"{now - lease['acquired_at']:.0f}s przez {lease['owner']} - zwalniam")
+                    else:
+                        continue
+                    lease["state"] = "releasing"
+                    leases[key] = dict(lease)
+                if leases:
+                    self._version += 1
+        leases.update(self.sync())
+
+        released = 0
+        for key, lease in leases.items():
+            if self._attempt_release(key, lease):
+                released += 1
+        if released:
+            with self._lock:
+                self._stats["reaped"] += released
+        return released
+
+    def recover(self) -> int:
+        """Przy starcie: zwalnia tokeny pozostawione przez procesy, które już nie działają"""
+        released = self.reap(recover=True)
+        if released:
+            logger.info(f"♻ī¸ Zwolniono {released} tokenów NCShot po poprzednich procesach")
+        return released
+
+    def start(self) -> None:
+        if self._reaper and self._reaper.is_alive():
+            return
+        self._stop.clear()
+        self._reaper = threading.Thread(target=self._run, name="ncshot-token-reaper", daemon=True)
+        self._reaper.start()
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.reap_interval):
+            try:
+                self.reap()
+            except Exception as e:
+                logger.error(f"⚠ī¸ Błąd sprzątania tokenów NCShot: {e}")
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._reaper:
+            self._reaper.join(timeout=self.reap_interval + 1)
+        # Niezwolnione dzierżawy zostają w pliku - przejmie je następny proces
+        self.sync(take_over=False)
+
+    # ----- stan -----
+    def list_leases(self) -> List[Dict[str, Any]]:
+        """Dzierżawy wszystkich workerów (pozostałych z pliku, bieżącego procesu z pamięci)"""
+        now = time.time()
+        leases = [dict(lease) for lease in self._read_state().values()
+                  if lease.get("instance") != self.instance]
+        with self._lock:
+            leases.extend(dict(lease) for lease in self._leases.values())
+        return sorted((dict(lease, age=now - lease["acquired_at"]) for lease in leases),
+                      key=lambda lease: lease["acquired_at"])
+
+    def get_stats(self) -> Dict[str, Any]:
+        leases = self.list_leases()
+        with self._lock:
+            stats = dict(self._stats)
+        stats.update({
+            "outstanding": len(leases),
+            "pending_release": sum(1 for lease in leases if lease["state"] == "pending"),
+            "oldest_age": max((lease["age"] for lease in leases), default=0.0),
+            "max_age": self.max_age,
+        })
+        return stats
@@ -0,0 +1,200 @@
+# app/xml_tools.py - narzędzia parsera XML NCShot: zgodność backendów, parsowanie archiwum do JSONL, benchmark
+
+import argparse
+import json
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import List, Optional
+
+from app import logic
+from app.logic import (available_xml_parser_backends, compare_xml_parser_backends, get_anomaly_log_interval,
+                       get_xml_parser_backend, parse_many, parse_ncshot_result,
+                       process_ncshot_result_xml_enhanced, set_anomaly_log_interval)
+
+
+def iter_xml_files(paths: List[str]):
+    """Pliki *.xml z podanych plików i katalogów (rekurencyjnie, np. cache wyników NCShot)"""
+    for path in map(Path, paths):
+        if path.is_dir():
+            yield from sorted(path.rglob("*.xml"))
+        elif path.is_file():
+            yield path
+
+
+def run_parity_check(paths: List[str]) -> int:
+    """Porównuje backendy parsera na korpusie zapisanych odpowiedzi NCShot"""
+    if "lxml" not in available_xml_parser_backends():
+        print("⚠ī¸ lxml niedostępny - brak czego porównywać")
+        return 1
+    checked = mismatches = 0
+    for path in iter_xml_files(paths):
+        checked += 1
+        difference = compare_xml_parser_backends(path.read_text(encoding="utf-8", errors="replace"))
+        if difference:
+            mismatches += 1
+            print(f"⚠ī¸ {path}: {difference}")
+    print(f"{'✅' if not mismatches else '⚠ī¸'} Zgodność parserów: {checked - mismatches}/{checked} plików identycznych")
+    return 1 if mismatches or not checked else 0
+
+
+def run_parse_to_jsonl(paths: List[str], output: Optional[str], workers: Optional[int], chunk_size: int,
+                       ordered: bool, backend: Optional[str]) -> int:
+    """Parsuje pliki XML (np. archiwum odpowiedzi NCShot) i zapisuje wyniki jako JSONL"""
+    files = list(iter_xml_files(paths))
+    texts = (path.read_text(encoding="utf-8", errors="replace") for path in files)
+    out = open(output, "w", encoding="utf-8") if output else sys.stdout
+    started = datetime.now()
+    errors = 0
+    try:
+        for index, result in parse_many(texts, workers=workers, chunk_size=chunk_size,
+                                        ordered=ordered, backend=backend):
+            errors += bool(result.get("error"))
+            out.write(json.dumps({"file": str(files[index]), "result": result}, ensure_ascii=False) + "\n")
+    finally:
+        if output:
+            out.close()
+    elapsed = (datetime.now() - started).total_seconds()
+    print(f"✅ Sparsowano {len(files)} plików XML w {elapsed:.2f}s (błędy: {errors})", file=sys.stderr)
+    return 0
+
+
+def build_noisy_ncshot_xml(vehicles: int = 20) -> str:
+    """Odpowiedź z nieliczbowymi polami (jak z rozkalibrowanej kamery) do benchmarku anomalii"""
+    exdata = "".join(f"""
+  <exdata>
+    <data name="plate" source="anpr"><value name="country">PL</value><value name="symbol">WX{n:05d}</value>
+      <value name="level">n/a</value><value name="doubleline">?</value></data>
+    <data name="vehicle" source="mmr"><value name="direction">--</value><value name="speed">brak</value>
+      <value name="estimatedspeed">NaN km/h</value><value name="mmrpatternindex">x</value>
+      <value name="mmrpatterndivergence">-</value></data>
+  </exdata>""" for n in range(vehicles))
+    return f"<result>{exdata}\n</result>"
+
+
+def run_anomaly_benchmark(iterations: int) -> int:
+    """
+    Czas parsowania zaszumionego XML przy logowaniu każdej niesparsowanej wartości (dawne
+    zachowanie) i przy liczeniu anomalii z ograniczonym logiem. Logowanie skonfigurowane
+    jak w app/main.py: poziom DEBUG, strumień + plik.
+    """
+    xml_content = build_noisy_ncshot_xml()
+    handler_dir = tempfile.mkdtemp(prefix="ncshot-bench-")
+    devnull = open(os.devnull, "w")
+    handlers = [logging.StreamHandler(devnull), logging.FileHandler(os.path.join(handler_dir, "bench.log"))]
+    formatter = logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    parser_logger = logging.getLogger(logic.__name__)
+    saved = (parser_logger.handlers[:], parser_logger.level, parser_logger.propagate, get_anomaly_log_interval())
+    for handler in handlers:
+        handler.setFormatter(formatter)
+    parser_logger.handlers[:] = handlers
+    parser_logger.setLevel(logging.DEBUG)
+    parser_logger.propagate = False
+    timings = {}
+    try:
+        for label, interval in (("per_field_log", 0), ("counted", 60.0)):
+            set_anomaly_log_interval(interval)
+            parse_ncshot_result(xml_content)  # rozgrzewka
+            started = time.perf_counter()
+            for _ in range(iterations):
+                result = parse_ncshot_result(xml_content)
+            timings[label] = (time.perf_counter() - started) / iterations * 1e6
+    finally:
+        parser_logger.handlers[:], level, parser_logger.propagate, interval = saved
+        parser_logger.setLevel(level)
+        set_anomaly_log_interval(interval)
+        for handler in handlers:
+            handler.close()
+        devnull.close()
+        shutil.rmtree(handler_dir, ignore_errors=True)
+
+    print(f"📊 Zaszumiony XML: {len(xml_content)} B, {result.metadata['anomalies']['bad_fields']} "
+          f"niesparsowanych pól, {iterations} iteracji")
+    print(f"   Log każdej wartości: {timings['per_field_log']:.1f} µs/dokument")
+    print(f"   Liczniki anomalii:   {timings['counted']:.1f} µs/dokument "
+          f"({timings['per_field_log'] / timings['counted']:.1f}x szybciej)")
+    return 0
+
+
+SAMPLE_NCSHOT_XML = """<?xml version="1.0"?>
+<result>
+  <timestamp><date>2024-05-06</date><time>12:34:56</time><ms>789</ms></timestamp>
+  <exdata>
+    <data name="plate" source="anpr"><value name="country">PL</value><value name="symbol">WX12345</value><value name="level">87.5</value></data>
+    <data name="platetrace" source="anpr"><value name="points">1,2</value></data>
+    <data name="vehicle" source="mmr"><value name="speed">54.2</value><value name="manufacturer">Skoda</value><value name="model">Octavia</value><value name="mmrpatterndivergence">0.3</value></data>
+    <data name="neuralnet"><value name="signature">c2lnbmF0dXJl</value></data>
+  </exdata>
+  <exdata>
+    <data name="zur" source="radar"><value name="speed">53</value></data>
+  </exdata>
+</result>"""
+
+
+def run_selftest() -> int:
+    print("🧪 Uruchamianie testów parsera XML NCShot...")
+
+    # Test z pustym XML
+    test_empty = ""
+    result = process_ncshot_result_xml_enhanced(test_empty)
+    print("✅ Test pustego XML:")
+    print(f"   Status: {result['processing_successful']}")
+    print(f"   Błąd: {result['error']}")
+
+    # Test przykładowej odpowiedzi NCShot
+    result = process_ncshot_result_xml_enhanced(SAMPLE_NCSHOT_XML)
+    assert result["summary"]["plates_detected"] == 1 and result["summary"]["vehicles_detected"] == 1
+    assert result["signature"] == "c2lnbmF0dXJl" and result["radar_data"] == {"speed": "53"}
+    assert result["metadata"]["anomalies"]["bad_fields"] == 0
+    print(f"✅ Test przykładowego XML ({get_xml_parser_backend()}): {result['summary']}")
+
+    # Niesparsowane pola są liczone w metadanych
+    anomalies = process_ncshot_result_xml_enhanced(build_noisy_ncshot_xml(vehicles=2))["metadata"]["anomalies"]
+    assert anomalies["bad_fields"] == 14 and anomalies["fields"]["plate.level"] == 2, anomalies
+    print(f"✅ Test anomalii: {anomalies['bad_fields']} niesparsowanych pól")
+
+    # Zgodność backendów
+    if "lxml" in available_xml_parser_backends():
+        for xml_content in (SAMPLE_NCSHOT_XML, "<result/>", "<result><exdata>"):
+            difference = compare_xml_parser_backends(xml_content)
+            assert difference is None, difference
+        print("✅ Backendy lxml i stdlib dają identyczne wyniki")
+
+    print("\n🎉 Testy zakończone pomyślnie!")
+    return 0
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m app.xml_tools", description="Narzędzia parsera XML NCShot")
+    commands = parser.add_subparsers(dest="command")
+    commands.add_parser("selftest", help="testy parsera (domyślnie)")
+    parity = commands.add_parser("parity", help="porównanie backendów lxml i stdlib na zapisanych odpowiedziach")
+    parity.add_argument("paths", nargs="+", help="pliki XML lub katalogi (np. cache/ncshot_results)")
+    parse = commands.add_parser("parse", help="parsowanie plików XML na puli procesów do JSONL")
+    parse.add_argument("paths", nargs="+", help="pliki XML lub katalogi")
+    parse.add_argument("-o", "--output", help="plik JSONL (domyślnie stdout)")
+    parse.add_argument("-w", "--workers", type=int, default=None, help="liczba procesów (domyślnie liczba CPU)")
+    parse.add_argument("--chunk-size", type=int, default=16, help="liczba dokumentów w paczce dla procesu")
+    parse.add_argument("--unordered", action="store_true", help="zapisuj wyniki w kolejności ukończenia")
+    parse.add_argument("--backend", choices=["auto", "lxml", "stdlib"], default=None, help="backend parsera XML")
+    bench = commands.add_parser("bench-anomalies", help="benchmark parsowania XML z niesparsowanymi polami")
+    bench.add_argument("-n", "--iterations", type=int, default=500, help="liczba parsowań na wariant")
+    args = parser.parse_args(argv)
+
+    if args.command == "parity":
+        return run_parity_check(args.paths)
+    if args.command == "parse":
+        return run_parse_to_jsonl(args.paths, args.output, args.workers, args.chunk_size,
+                                  not args.unordered, args.backend)
+    if args.command == "bench-anomalies":
+        return run_anomaly_benchmark(args.iterations)
+    return run_selftest()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
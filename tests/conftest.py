@@ -0,0 +1,62 @@
+import os
+
+import pytest
+
+from app.config_slots import NcshotConfigSlotManager
+from app.config_state import NcshotConfigTracker
+from app.fake_ncshot import start_fake_ncshot
+from app.ncshot_backends import NcshotBackend, NcshotBackendRegistry
+from app.result_cache import NcshotResultCache
+
+
+@pytest.fixture(scope="session")
+def ncshot_main(tmp_path_factory):
+    """app.main z plikami stanu, cache i logiem w katalogu tymczasowym; konfiguracja NCShot tylko przez HTTP"""
+    pytest.importorskip("fastapi")
+    pytest.importorskip("paramiko")
+    root = tmp_path_factory.mktemp("ncpyvisual")
+    env = {
+        "LOG_FILE": str(root / "ncpyvisual.log"),
+        "NCSHOT_CACHE_DIR": str(root / "ncshot_results"),
+        "NCSHOT_CONFIG_STATE_FILE": str(root / "ncshot_config_state.json"),
+        "NCSHOT_LEASE_STATE_FILE": str(root / "ncshot_token_leases.json"),
+        "NCSHOT_JOB_RESULTS_DIR": str(root / "ncshot_jobs"),
+        "NCSHOT_UPLOAD_DIR": str(root / "ncshot_uploads"),
+        "IMAGE_STORE_DIR": str(root / "images"),
+        "NCSHOT_CONFIG_VIA_SSH": "0",
+        "NCSHOT_ADMISSION_VM_INTERVAL": "0",
+        "ARCHIVE_EXTRACT_WORKERS": "0",
+    }
+    for name, value in env.items():
+        os.environ.setdefault(name, value)
+    from app import main
+    return main
+
+
+@pytest.fixture
+def pipeline(ncshot_main, tmp_path, monkeypatch):
+    """Potok NCShot z app.main skierowany do zastępców NCShot; `start(n)` uruchamia n instancji"""
+    main = ncshot_main
+    servers = []
+    tracker = NcshotConfigTracker(str(tmp_path / "ncshot_config_state.json"))
+    monkeypatch.setattr(main, "config_tracker", tracker)
+    monkeypatch.setattr(main, "config_slots", NcshotConfigSlotManager(tracker))
+    monkeypatch.setattr(main, "result_cache", NcshotResultCache(str(tmp_path / "ncshot_results"), 0))
+
+    def start(count=1, **state_kwargs):
+        backends = []
+        for _ in range(count):
+            server = start_fake_ncshot(**state_kwargs)
+            servers.append(server)
+            backend = NcshotBackend("127.0.0.1", server.server_address[1], pool_size=2)
+            backend.fake = server
+            backends.append(backend)
+        monkeypatch.setattr(main, "ncshot_backends", NcshotBackendRegistry(backends))
+        return backends
+
+    main.start = start
+    yield main
+    del main.start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
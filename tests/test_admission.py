@@ -0,0 +1,92 @@
+import threading
+import time
+
+import pytest
+
+from app.admission import AdmissionController, parse_meminfo
+
+
+def test_success_increases_limit_additively_up_to_max():
+    admission = AdmissionController(min_limit=1, max_limit=4, initial=2, cooldown=0)
+    admission.record(1.0)
+    assert admission.limit == pytest.approx(2.5)
+
+    # Około +1 na pełne okno udanych żądań, nigdy ponad max_limit
+    for _ in range(50):
+        admission.record(1.0)
+    assert admission.limit == 4
+    assert admission.get_stats()["increases"] == 6
+
+
+def test_overload_halves_limit_down_to_min():
+    admission = AdmissionController(min_limit=2, max_limit=16, cooldown=0)
+    admission.record(1.0, overloaded=True)
+    assert admission.limit == 8
+
+    for _ in range(10):
+        admission.record(1.0, overloaded=True)
+    assert admission.limit == 2
+    stats = admission.get_stats()
+    assert (stats["overloads"], stats["decreases"]) == (11, 3)
+    assert stats["overload_rate"] == 1.0
+
+
+def test_latency_spike_decreases_limit():
+    admission = AdmissionController(max_limit=8, latency_target=2.0, cooldown=0)
+    admission.record(1.0)
+    assert admission.limit == 8
+
+    admission.record(5.0)
+    assert admission.limit == 4
+    assert admission.get_stats()["overloads"] == 0
+    assert "opóźnienie" in admission.get_stats()["last_decrease_reason"]
+
+
+def test_cooldown_limits_decreases_per_wave_of_errors():
+    admission = AdmissionController(max_limit=8, cooldown=60)
+    for _ in range(5):
+        admission.record(1.0, overloaded=True)
+    assert admission.limit == 4
+    assert admission.get_stats()["decreases"] == 1
+
+
+def test_vm_memory_pressure_decreases_and_blocks_increase():
+    admission = AdmissionController(max_limit=8, initial=4, memory_high=0.8, cooldown=0)
+    admission.update_memory("vm", 0.9)
+    assert admission.limit == 2
+
+    admission.record(1.0)
+    assert admission.limit == 2
+    admission.update_memory("vm", 0.5)
+    admission.record(1.0)
+    assert admission.limit == 2.5
+
+
+def test_slot_queues_above_limit_and_admits_after_increase():
+    admission = AdmissionController(min_limit=1, max_limit=2, initial=1, cooldown=0)
+    admitted = threading.Event()
+
+    def second():
+        with admission.slot():
+            admitted.set()
+
+    with admission.slot():
+        thread = threading.Thread(target=second)
+        thread.start()
+        deadline = time.monotonic() + 5
+        while admission.waiting == 0 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert not admitted.is_set()
+        # Udane żądanie podnosi limit do 2 - czekający obraz wchodzi od razu
+        admission.record(1.0)
+        assert admitted.wait(5)
+    thread.join(5)
+
+    stats = admission.get_stats()
+    assert (stats["admitted"], stats["queued"], stats["in_flight"]) == (2, 1, 0)
+
+
+def test_parse_meminfo():
+    text = "MemTotal:       1000 kB\nMemFree:         100 kB\nMemAvailable:    250 kB\n"
+    assert parse_meminfo(text) == pytest.approx(0.75)
+    assert parse_meminfo("MemFree: 1 kB\n") is None
@@ -0,0 +1,34 @@
+import io
+
+import pytest
+
+py7zr = pytest.importorskip("py7zr")
+
+from app.archive_extract import ArchiveExtractor, extract_first_image
+
+
+def make_archive(files):
+    buffer = io.BytesIO()
+    with py7zr.SevenZipFile(buffer, mode="w") as archive:
+        for name, data in files.items():
+            archive.writestr(data, name)
+    return buffer.getvalue()
+
+
+def test_extract_first_image_skips_other_files():
+    data = make_archive({"info.txt": b"opis", "foto.jpg": b"\xff\xd8jpeg", "foto2.jpg": b"\xff\xd8drugi"})
+    assert extract_first_image(data) == ("foto.jpg", b"\xff\xd8jpeg")
+
+
+def test_extract_without_image():
+    assert extract_first_image(make_archive({"info.txt": b"opis"})) is None
+
+
+def test_process_pool_uses_spawn():
+    extractor = ArchiveExtractor(workers=1)
+    try:
+        future = extractor.submit(make_archive({"foto.jpg": b"\xff\xd8jpeg"}))
+        assert future.result(timeout=60) == ("foto.jpg", b"\xff\xd8jpeg")
+        assert extractor._executor._mp_context.get_start_method() == "spawn"
+    finally:
+        extractor.shutdown()
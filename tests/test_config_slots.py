@@ -0,0 +1,72 @@
+import time
+
+import pytest
+
+from app.config_slots import NcshotConfigSlotManager
+from app.config_state import NcshotConfigTracker
+
+INSTANCE = "127.0.0.1:5543"
+
+
+def make_manager_for(tracker, instance, slots=("nc_a_1", "nc_b_2")):
+    for slot in slots:
+        tracker.mark_pushed(instance, slot, slot, 0.1)
+    with tracker._locked_state() as state:
+        for entry in state[instance].values():
+            entry["last_used"] = time.time() - 3600
+    return NcshotConfigSlotManager(tracker, max_slots=2, min_idle=60), tracker
+
+
+def make_manager(tmp_path):
+    return make_manager_for(NcshotConfigTracker(str(tmp_path / "ncshot_config_state.json")), INSTANCE)
+
+
+@pytest.fixture
+def ncshot(pipeline, monkeypatch):
+    """push_ncshot_config z app.main na zastępcy NCShot z dwoma starymi slotami i limitem dwóch slotów"""
+    backend, = pipeline.start()
+    manager, _ = make_manager_for(pipeline.config_tracker, backend.name)
+    monkeypatch.setattr(pipeline, "config_slots", manager)
+    for slot in ("nc_a_1", "nc_b_2"):
+        backend.fake.state.configs[slot] = b"[old]"
+    return pipeline, backend
+
+
+def test_plan_eviction_has_no_side_effects(tmp_path):
+    manager, tracker = make_manager(tmp_path)
+    assert manager.plan_eviction(INSTANCE, keep="nc_c_3") == ["nc_a_1"]
+    assert set(tracker.slots(INSTANCE)) == {"nc_a_1", "nc_b_2"}
+    assert manager.get_stats()["evicted"] == 0
+
+
+def test_failed_push_keeps_victims(ncshot):
+    main, backend = ncshot
+    backend.fake.shutdown()
+    backend.fake.server_close()
+    backend.client.close()
+
+    with pytest.raises(main.HTTPException):
+        main.push_ncshot_config(backend, "[new]", "nc_c_3", "nc_c_3")
+
+    tracker = main.config_tracker
+    assert {"nc_a_1", "nc_b_2"} <= set(tracker.slots(backend.name))
+    assert tracker.is_current(backend.name, "nc_a_1", "nc_a_1")
+    assert main.config_slots.get_stats()["evicted"] == 0
+
+
+def test_successful_push_forgets_victims(ncshot):
+    main, backend = ncshot
+    push = main.push_ncshot_config(backend, "[new]", "nc_c_3", "nc_c_3")
+
+    assert push["pushed"] and push["evicted_slots"] == ["nc_a_1"]
+    assert set(main.config_tracker.slots(backend.name)) == {"nc_b_2", "nc_c_3"}
+    assert sorted(backend.fake.state.configs) == ["nc_b_2", "nc_c_3"]
+    assert main.config_slots.get_stats()["evicted"] == 1
+
+
+def test_leased_slot_is_not_evicted(tmp_path):
+    manager, _ = make_manager(tmp_path)
+    manager.acquire(INSTANCE, "a", "1")
+    slot = manager.slot_name("a", "1")
+    assert slot == "nc_a_1"
+    assert manager.plan_eviction(INSTANCE, keep="nc_c_3") == ["nc_b_2"]
@@ -0,0 +1,68 @@
+import threading
+import time
+
+import pytest
+
+from app.config_state import NcshotConfigTracker, fcntl
+
+INSTANCE = "127.0.0.1:5543"
+
+
+@pytest.fixture
+def tracker(tmp_path):
+    tracker = NcshotConfigTracker(str(tmp_path / "ncshot_config_state.json"), cache_ttl=60.0)
+    tracker.mark_pushed(INSTANCE, "nc_a_1", "hash-a", 0.5)
+    return tracker
+
+
+def test_invalidate_visible_immediately(tracker):
+    assert tracker.is_current(INSTANCE, "nc_a_1", "hash-a")
+    tracker.invalidate(INSTANCE, "nc_a_1")
+    assert not tracker.is_current(INSTANCE, "nc_a_1", "hash-a")
+
+
+def test_change_by_other_worker_visible(tracker, tmp_path):
+    assert tracker.is_current(INSTANCE, "nc_a_1", "hash-a")
+    other = NcshotConfigTracker(str(tmp_path / "ncshot_config_state.json"))
+    other.mark_pushed(INSTANCE, "nc_a_1", "hash-other", 0.5)
+    assert tracker.is_current(INSTANCE, "nc_a_1", "hash-other")
+
+
+def test_touch_written_on_flush(tracker):
+    before = tracker.slots(INSTANCE)["nc_a_1"]["last_used"]
+    time.sleep(0.01)
+    tracker.touch(INSTANCE, "nc_a_1")
+    writes = tracker.get_stats()["state_writes"]
+    assert tracker.flush() == 1
+    assert tracker.get_stats()["state_writes"] == writes + 1
+    assert tracker.slots(INSTANCE)["nc_a_1"]["last_used"] > before
+
+
+@pytest.mark.skipif(fcntl is None, reason="wymaga flock")
+def test_concurrent_checks_do_not_wait_for_file_lock(tracker):
+    assert tracker.is_current(INSTANCE, "nc_a_1", "hash-a")
+    reads = tracker.get_stats()["state_reads"]
+    done = []
+
+    def worker():
+        for _ in range(500):
+            assert tracker.is_current(INSTANCE, "nc_a_1", "hash-a")
+            tracker.touch(INSTANCE, "nc_a_1")
+        done.append(True)
+
+    # Inny worker trzyma wyłączną blokadę pliku stanu przez cały czas działania wątków
+    with open(tracker.state_file, "a+") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            threads = [threading.Thread(target=worker) for _ in range(8)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join(10)
+            assert len(done) == 8
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+    stats = tracker.get_stats()
+    assert stats["state_reads"] == reads
+    assert stats["pending_touches"] == 1
@@ -0,0 +1,66 @@
+import io
+
+import pytest
+
+Image = pytest.importorskip("PIL.Image")
+
+from app.image_normalize import ImageNormalizer
+
+DEVICE_INI = "[location]\nclient.id = WLK.1.079\n"
+ROI_INI = "[platerecognizer-main]\nroi = 2900,1200;3100,1200;3100,1500;2900,1500\n"
+
+
+def jpeg(width, height):
+    out = io.BytesIO()
+    Image.new("RGB", (width, height), (90, 120, 150)).save(out, format="JPEG", quality=80)
+    return out.getvalue()
+
+
+def size_of(data):
+    with Image.open(io.BytesIO(data)) as image:
+        return image.size
+
+
+class FakeSftp:
+    """Pliki terminala odczytywane przez SFTP"""
+
+    def __init__(self, files):
+        self.files = files
+
+    def open(self, path):
+        if path not in self.files:
+            raise FileNotFoundError(path)
+        return io.BytesIO(self.files[path].encode("utf-8"))
+
+
+@pytest.fixture
+def normalizer():
+    normalizer = ImageNormalizer(max_dim=2560, workers=1)
+    yield normalizer
+    normalizer.shutdown()
+
+
+def test_large_image_downscaled_unless_size_kept(normalizer):
+    data = jpeg(3200, 1800)
+    assert size_of(normalizer.normalize(data)) == (2560, 1440)
+    # Ta sama treść bez skalowania - osobny wpis w cache, wymiary bez zmian
+    assert size_of(normalizer.normalize(data, resize=False)) == (3200, 1800)
+    assert normalizer.get_stats()["resized"] == 1
+
+
+def test_terminal_image_with_ini_roi_keeps_full_resolution(ncshot_main, monkeypatch):
+    main = ncshot_main
+    monkeypatch.setattr(main, "IMAGE_NORMALIZE", True)
+    files = {"/neurocar/etc/location.ini": DEVICE_INI}
+    assert not main.device_rois_defined(FakeSftp(files))
+
+    files["/neurocar/etc/ncshot.d/WLK.1.079.ini"] = ROI_INI
+    sftp = FakeSftp(files)
+    assert main.device_rois_defined(sftp)
+    roi = main.read_device_location(sftp)["rois"][0]
+    assert max(point["x"] for point in roi["points"]) == 3100
+
+    # ROI z INI (x do 3100) mieści się w obrazie przekazanym do galerii i NCShot
+    data = jpeg(3200, 1800)
+    assert size_of(main.optimize_image_for_ncshot(data, resize=not main.device_rois_defined(sftp))) == (3200, 1800)
+    assert size_of(main.optimize_image_for_ncshot(data)) == (2560, 1440)
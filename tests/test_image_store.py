@@ -0,0 +1,46 @@
+from app.image_store import ImageStore
+
+
+def image(n):
+    return b"\xff\xd8" + bytes([n]) * 1000 + b"\xff\xd9"
+
+
+def test_eviction_skips_pinned_images(tmp_path):
+    store = ImageStore(str(tmp_path), max_bytes=2500)
+    first = store.put(image(1), "a.jpg")["id"]
+    assert store.pin(first) is not None
+
+    store.put(image(2), "b.jpg")
+    third = store.put(image(3), "c.jpg")["id"]
+
+    # Najdawniej używany obraz jest przypięty przez zadanie - eksmitowany zostaje kolejny
+    assert store.get_path(first) is not None
+    assert store.get_path(third) is not None
+    assert len(store.list_images()) == 2
+    assert store.get_stats()["pinned"] == 1
+
+    store.unpin([first])
+    store.put(image(4), "d.jpg")
+    assert store.get_path(first) is None
+    assert store.get_stats()["pinned"] == 0
+
+
+def test_pins_are_reference_counted(tmp_path):
+    store = ImageStore(str(tmp_path), max_bytes=1100)
+    image_id = store.put(image(1), "a.jpg")["id"]
+    store.pin(image_id)
+    store.pin(image_id)
+
+    store.unpin([image_id])
+    store.put(image(2), "b.jpg")
+    assert store.get_path(image_id) is not None
+
+    store.unpin([image_id])
+    store.put(image(3), "c.jpg")
+    assert store.get_path(image_id) is None
+
+
+def test_pin_missing_image(tmp_path):
+    store = ImageStore(str(tmp_path), max_bytes=10000)
+    assert store.pin("0" * 64) is None
+    assert store.get_stats()["pinned"] == 0
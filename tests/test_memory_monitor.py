@@ -0,0 +1,38 @@
+import tracemalloc
+
+import pytest
+
+from app.memory_monitor import MemoryMonitor
+
+
+@pytest.fixture
+def tracing():
+    started = not tracemalloc.is_tracing()
+    if started:
+        tracemalloc.start()
+    yield
+    if started:
+        tracemalloc.stop()
+
+
+def test_stage_traced_peaks_are_per_stage(tracing):
+    monitor = MemoryMonitor(gc_threshold=0)
+    with monitor.stage("large"):
+        data = bytearray(8 * 1024 * 1024)
+        del data
+    with monitor.stage("small"):
+        data = bytearray(256 * 1024)
+        del data
+
+    stages = monitor.get_stats()["stages"]
+    assert stages["large"]["traced_peak"] >= 8 * 1024 * 1024
+    assert 256 * 1024 <= stages["small"]["traced_peak"] < 1024 * 1024
+
+
+def test_stage_without_tracemalloc():
+    if tracemalloc.is_tracing():
+        pytest.skip("tracemalloc włączony przez inny test")
+    monitor = MemoryMonitor(gc_threshold=0)
+    with monitor.stage("parse"):
+        pass
+    assert monitor.get_stats()["stages"]["parse"]["traced_peak"] is None
@@ -0,0 +1,71 @@
+import threading
+import time
+
+from app.ncshot_backends import HALF_OPEN_POLL_INTERVAL, NcshotBackend, NcshotBackendRegistry
+
+
+def tripped_registry(cooldown: float = 0.05) -> NcshotBackendRegistry:
+    backend = NcshotBackend("127.0.0.1", 5543, breaker_cooldown=cooldown)
+    backend.record_failure("std::bad_alloc", fatal=True)
+    time.sleep(cooldown * 2)
+    return NcshotBackendRegistry([backend])
+
+
+def test_half_open_lets_single_trial_through_concurrent_callers():
+    registry = tripped_registry()
+    callers = 16
+    barrier = threading.Barrier(callers)
+    trial_started = threading.Event()
+    finish_trial = threading.Event()
+    dispatched = []
+
+    def caller():
+        barrier.wait()
+        with registry.dispatch() as backend:
+            dispatched.append(backend)
+            if backend is not None:
+                trial_started.set()
+                finish_trial.wait(5)
+
+    threads = [threading.Thread(target=caller) for _ in range(callers)]
+    for thread in threads:
+        thread.start()
+    assert trial_started.wait(5)
+    time.sleep(0.05)
+    finish_trial.set()
+    for thread in threads:
+        thread.join(5)
+
+    assert sum(backend is not None for backend in dispatched) == 1
+    assert dispatched.count(None) == callers - 1
+    assert registry.primary.stats["trials"] == 1
+
+
+def test_trial_in_flight_blocks_others_until_success():
+    registry = tripped_registry()
+    with registry.dispatch() as trial:
+        assert trial is registry.primary
+        assert registry.available() == []
+        assert registry.next_available_in() == HALF_OPEN_POLL_INTERVAL
+        with registry.dispatch() as other:
+            assert other is None
+        trial.record_success()
+    with registry.dispatch() as first, registry.dispatch() as second:
+        assert first is second is registry.primary
+
+
+def test_trial_failure_reopens_breaker():
+    registry = tripped_registry()
+    with registry.dispatch() as trial:
+        trial.record_failure("timeout")
+    assert registry.available() == []
+    assert registry.next_available_in() > 0.0
+
+
+def test_trial_without_result_allows_next_probe():
+    registry = tripped_registry()
+    with registry.dispatch() as trial:
+        assert trial is not None
+    with registry.dispatch() as retry:
+        assert retry is registry.primary
+    assert registry.primary.stats["trials"] == 2
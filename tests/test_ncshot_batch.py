@@ -0,0 +1,77 @@
+import threading
+import time
+
+from app.ncshot_batch import NcshotBatchEngine
+
+
+def test_in_flight_bounded_by_window():
+    engine = NcshotBatchEngine(window=3, max_outstanding_tokens=3)
+    running = []
+    lock = threading.Lock()
+    peak = [0]
+
+    def process(i, item):
+        with lock:
+            running.append(i)
+            peak[0] = max(peak[0], len(running))
+        time.sleep(0.02)
+        with lock:
+            running.remove(i)
+        return item * 2
+
+    results = engine.run(list(range(12)), process)
+
+    assert results == {i: i * 2 for i in range(12)}
+    assert peak[0] <= 3
+    assert engine.peak_in_flight <= engine.window
+
+
+def test_outstanding_tokens_bounded_by_semaphore():
+    engine = NcshotBatchEngine(window=6, max_outstanding_tokens=2)
+    holders = []
+    lock = threading.Lock()
+    peak = [0]
+
+    def process(i, item):
+        with engine.token_slot():
+            with lock:
+                holders.append(i)
+                peak[0] = max(peak[0], len(holders))
+            time.sleep(0.02)
+            with lock:
+                holders.remove(i)
+        return i
+
+    engine.run(list(range(12)), process)
+
+    assert peak[0] <= 2
+    assert engine.peak_outstanding_tokens <= engine.max_outstanding_tokens
+    assert engine.outstanding_tokens == 0
+
+
+def test_abort_stops_starting_new_items():
+    engine = NcshotBatchEngine(window=2)
+    started = []
+
+    def process(i, item):
+        started.append(i)
+        if i == 1:
+            engine.abort("bad_alloc")
+        time.sleep(0.02)
+        return i
+
+    results = engine.run(list(range(10)), process)
+
+    # Obrazy w locie w chwili przerwania kończą się normalnie, kolejne nie startują
+    assert engine.aborted
+    assert engine.abort_reason == "bad_alloc"
+    assert max(started) <= 2
+    assert sorted(results) == sorted(started)
+    assert engine.get_stats()["aborted"] is True
+
+
+def test_pause_returns_false_after_abort():
+    engine = NcshotBatchEngine()
+    assert engine.pause(0) is True
+    engine.abort("test")
+    assert engine.pause(5) is False
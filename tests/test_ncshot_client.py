@@ -0,0 +1,80 @@
+import http.client as httplib
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from app import ncshot_client
+from app.ncshot_client import NcshotClient
+
+
+class ClosingHandler(BaseHTTPRequestHandler):
+    """Odpowiada jak keep-alive, ale zamyka połączenie po każdej odpowiedzi (jak NCShot po restarcie)"""
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def _reply(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        if length:
+            self.rfile.read(length)
+        self.server.requests.append(self.command)
+        self.send_response(200)
+        self.send_header("Content-Length", "2")
+        self.end_headers()
+        self.wfile.write(b"ok")
+        self.close_connection = True
+
+    do_GET = do_PUT = _reply
+
+
+@pytest.fixture
+def server():
+    srv = ThreadingHTTPServer(("127.0.0.1", 0), ClosingHandler)
+    srv.requests = []
+    thread = threading.Thread(target=srv.serve_forever, daemon=True)
+    thread.start()
+    yield srv
+    srv.shutdown()
+    srv.server_close()
+
+
+def test_get_retried_on_stale_connection(server, monkeypatch):
+    monkeypatch.setattr(ncshot_client, "_connection_dropped", lambda conn: False)
+    client = NcshotClient("127.0.0.1", server.server_port, pool_size=1)
+    assert client.get("/").status == 200
+    assert client.get("/").status == 200
+    assert client.get_stats()["stale_retries"] == 1
+    assert server.requests == ["GET", "GET"]
+
+
+def test_put_after_server_dropped_idle_connection(server):
+    client = NcshotClient("127.0.0.1", server.server_port, pool_size=1)
+    assert client.get("/").status == 200
+    time.sleep(0.2)  # serwer zamyka bezczynne połączenie
+    assert client.put("/image", b"data", "image/jpeg").status == 200
+    stats = client.get_stats()
+    assert stats["stale_discarded"] == 1
+    assert stats["stale_retries"] == 0
+    assert server.requests == ["GET", "PUT"]
+
+
+def test_idle_connection_over_cap_not_reused(server, monkeypatch):
+    monkeypatch.setattr(ncshot_client, "_connection_dropped", lambda conn: False)
+    client = NcshotClient("127.0.0.1", server.server_port, pool_size=1, max_idle=0)
+    assert client.get("/").status == 200
+    assert client.put("/image", b"data", "image/jpeg").status == 200
+    assert client.get_stats()["stale_discarded"] == 1
+
+
+def test_put_not_retried_after_bytes_sent(server, monkeypatch):
+    monkeypatch.setattr(ncshot_client, "_connection_dropped", lambda conn: False)
+    client = NcshotClient("127.0.0.1", server.server_port, pool_size=1)
+    assert client.get("/").status == 200
+    time.sleep(0.2)
+    with pytest.raises((httplib.HTTPException, ConnectionError)):
+        client.put("/image", b"data", "image/jpeg")
+    assert client.get_stats()["stale_retries"] == 0
+    assert server.requests == ["GET"]
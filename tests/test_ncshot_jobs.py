@@ -0,0 +1,182 @@
+import asyncio
+import json
+import os
+import threading
+import time
+
+import pytest
+
+from app.ncshot_jobs import JOB_CANCELLED, JOB_DONE, NcshotJob, NcshotJobManager
+
+
+def wait_finished(job, timeout=5.0):
+    """Czeka na zdarzenie zakończenia zadania"""
+    deadline = time.monotonic() + timeout
+    while not (job.events and job.events[-1]["type"] == job.state) and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert job.finished
+
+
+@pytest.fixture
+def manager(tmp_path):
+    manager = NcshotJobManager(workers=1, ttl=3600, results_dir=str(tmp_path))
+    yield manager
+    manager.shutdown()
+
+
+def test_cancel_before_start_runs_cleanup_only(manager):
+    gate = threading.Event()
+    manager.submit(1, lambda job: gate.wait(5) and {"_stats": None})
+    ran, cleaned = [], threading.Event()
+    job = manager.submit(3, lambda job: ran.append(job.id) or {"_stats": None}, cleanup=cleaned.set)
+    assert job.cancel()
+    gate.set()
+    wait_finished(job)
+
+    assert job.state == JOB_CANCELLED
+    assert ran == []
+    assert cleaned.wait(5)
+    assert [event["type"] for event in job.wait_for_events(0)] == [JOB_CANCELLED]
+    assert not job.cancel()
+
+
+def test_cancel_mid_run_stops_new_images(manager):
+    started = threading.Event()
+
+    def run(job):
+        engine = manager.new_engine(job, window=1)
+
+        def process(i, item):
+            job.add_image_result(i, "ok", {"n": i})
+            started.set()
+            time.sleep(0.05)
+            return i
+
+        engine.run(list(range(50)), process)
+        return {"_stats": {"processed": job.completed}}
+
+    job = manager.submit(50, run)
+    assert started.wait(5)
+    job.cancel()
+    wait_finished(job)
+
+    assert job.state == JOB_CANCELLED
+    assert 1 <= job.completed < 50
+    assert job.wait_for_events(0)[-1]["type"] == JOB_CANCELLED
+
+
+def test_results_on_disk_replayed_from_cursor(tmp_path):
+    job = NcshotJob(3, results_dir=str(tmp_path))
+    for i, status in enumerate(["ok", "failed", "ok"]):
+        job.add_image_result(i, status, {"n": i} if status == "ok" else None)
+    job.add_event({"type": JOB_DONE, "stats": None, "error": None})
+
+    # Wyniki obrazów nie są trzymane w pamięci - tylko położenie linii w pliku
+    assert job.events == [{"type": JOB_DONE, "stats": None, "error": None}]
+    assert job.event_count == 4
+
+    events = job.load_results(job.wait_for_events(1))
+    assert [(e["type"], e.get("index"), e.get("status"), e.get("result")) for e in events] == [
+        ("image", 1, "failed", None),
+        ("image", 2, "ok", {"n": 2}),
+        (JOB_DONE, None, None, None),
+    ]
+    assert job.load_results(job.wait_for_events(0))[0]["key"] == "image_0"
+    assert (job.completed, job.failed) == (2, 1)
+
+
+def test_results_in_memory_without_results_dir():
+    job = NcshotJob(1)
+    job.add_image_result(0, "ok", {"n": 0})
+    assert job.load_results(job.wait_for_events(0)) == [
+        {"type": "image", "index": 0, "key": "image_0", "status": "ok", "result": {"n": 0}}]
+
+
+def test_prune_removes_expired_jobs_and_results(tmp_path):
+    manager = NcshotJobManager(workers=1, ttl=0.05, results_dir=str(tmp_path))
+    try:
+        def run(job):
+            job.add_image_result(0, "ok", {"n": 0})
+            return {"_stats": None}
+
+        job = manager.submit(1, run)
+        wait_finished(job)
+        assert os.path.exists(job.results_path)
+
+        time.sleep(0.1)
+        manager.submit(0, lambda job: {"_stats": None})
+        assert manager.get(job.id) is None
+        assert not os.path.exists(job.results_path)
+    finally:
+        manager.shutdown()
+
+
+class SlowClose:
+    """Plik wyników, którego zamknięcie trwa dłużej niż jedno odpytanie strumienia"""
+
+    def __init__(self, f, delay):
+        self.f = f
+        self.delay = delay
+
+    def write(self, data):
+        return self.f.write(data)
+
+    def flush(self):
+        self.f.flush()
+
+    def close(self):
+        time.sleep(self.delay)
+        self.f.close()
+
+
+def test_finished_job_always_has_terminal_event(manager):
+    # Strumień sprawdza `finished` bez blokady - stan końcowy nie może wyprzedzić zdarzenia
+    release = threading.Event()
+
+    def run(job):
+        job._results_file = SlowClose(job._results_file, 0.5)
+        release.wait(5)
+        return {"_stats": {"processed": 0}}
+
+    job = manager.submit(0, run)
+    release.set()
+    seen = []
+    deadline = time.monotonic() + 5
+    while not seen and time.monotonic() < deadline:
+        if job.finished:
+            seen.append([event["type"] for event in job.events])
+    assert seen == [[JOB_DONE]]
+
+
+class FakeRequest:
+    headers = {}
+
+    async def is_disconnected(self):
+        return False
+
+
+def test_stream_ends_with_terminal_event_when_job_finishes_between_polls(ncshot_main, manager, monkeypatch):
+    main = ncshot_main
+    monkeypatch.setattr(main, "ncshot_jobs", manager)
+    release = threading.Event()
+
+    def run(job):
+        job._results_file = SlowClose(job._results_file, 1.5)
+        job.add_image_result(0, "ok", {"n": 0})
+        release.wait(5)
+        return {"_stats": {"processed": 1}}
+
+    job = manager.submit(1, run)
+
+    async def read_stream():
+        response = await main.ncshot_job_stream(job.id, FakeRequest())
+        lines = []
+        async for chunk in response.body_iterator:
+            lines.append(json.loads(chunk))
+            if len(lines) == 1:
+                release.set()
+        return lines
+
+    lines = asyncio.run(read_stream())
+    assert [line["type"] for line in lines] == ["image", JOB_DONE]
+    assert lines[-1]["stats"] == {"processed": 1}
@@ -0,0 +1,122 @@
+import base64
+import json
+import time
+
+from app.memory_monitor import MemoryMonitor
+from app.metrics import StageTimings
+from app.ncshot_batch import NcshotBatchEngine
+from app.ncshot_jobs import JOB_DONE, NcshotJobManager
+from app.result_cache import NcshotResultCache
+
+INI = "[general]\nlocation=test\n"
+IMAGE = b"\xff\xd8" + bytes(range(256)) * 8 + b"\xff\xd9"
+
+
+def make_batch(main, slot="nc_test_1"):
+    return {"id": "test", "ini_config": INI, "ini_hash": main.sha256_hex(INI.encode("utf-8")), "slot": slot,
+            "config_pushes": [], "config_reported": set(), "memory": MemoryMonitor(0), "timings": StageTimings()}
+
+
+def stop(backend):
+    """Zatrzymuje zastępcę NCShot instancji i zamyka jej bezczynne połączenia"""
+    backend.fake.shutdown()
+    backend.fake.server_close()
+    backend.client.close()
+
+
+def data_url(image):
+    return "data:image/jpeg;base64," + base64.b64encode(image).decode("ascii")
+
+
+def test_transport_error_trips_breaker_and_retries_elsewhere(pipeline):
+    dying, healthy = pipeline.start(2)
+    batch = make_batch(pipeline)
+    pipeline.ensure_backend_config(dying, INI, batch["ini_hash"], batch["slot"], set())
+    stop(dying)
+
+    engine = NcshotBatchEngine(window=1, max_outstanding_tokens=1)
+    outcome = pipeline.process_ncshot_image(0, data_url(IMAGE), 1, engine, batch)
+
+    assert outcome["status"] == "ok"
+    assert outcome["backend"] == healthy.name
+    assert dying.get_stats()["breaker_trips"] == 1
+    assert not dying.available
+
+
+def make_package(main, location="test"):
+    roi = main.RoiData(id="roi1", points=[{"x": 0, "y": 0}, {"x": 100, "y": 0}, {"x": 100, "y": 50}])
+    return main.FullPackage(rois=[roi], deployment=main.DeploymentConfig(locationId=location))
+
+
+def test_unchanged_config_reported_as_skip(pipeline):
+    backend, = pipeline.start()
+    package = make_package(pipeline)
+
+    first = pipeline.start_ncshot_with_config_safe(package, [data_url(IMAGE)] * 3)["_stats"]["config_push"]
+    second = pipeline.start_ncshot_with_config_safe(package, [data_url(IMAGE)] * 3)["_stats"]["config_push"]
+
+    assert [push["pushed"] for push in first["pushes"]] == [True]
+    assert [push["pushed"] for push in second["pushes"]] == [False]
+    assert second["time_saved"] > 0
+    assert second["time_saved"] == first["pushes"][0]["push_time"]
+    assert backend.fake.state.get_stats()["config_pushes"] == 1
+    assert pipeline.config_tracker.get_stats()["skips"] == 1
+
+
+def test_chunked_job_spills_results_and_prepares_batch_once(pipeline, tmp_path, monkeypatch):
+    backend, = pipeline.start()
+    package = make_package(pipeline)
+    manager = NcshotJobManager(workers=1, ttl=3600, results_dir=str(tmp_path / "jobs"))
+    monkeypatch.setattr(pipeline, "ncshot_jobs", manager)
+    monkeypatch.setattr(pipeline, "NCSHOT_JOB_CHUNK_SIZE", 2)
+    checks = []
+    check = pipeline.check_ncshot_backends
+    monkeypatch.setattr(pipeline, "check_ncshot_backends", lambda: checks.append(1) or check())
+
+    try:
+        images = [data_url(IMAGE)] * 5
+        job = manager.submit(len(images), lambda job: pipeline.run_ncshot_job(job, package, images))
+        deadline = time.monotonic() + 10
+        while not (job.events and job.events[-1]["type"] == job.state) and time.monotonic() < deadline:
+            time.sleep(0.01)
+    finally:
+        manager.shutdown()
+
+    assert job.state == JOB_DONE, job.error
+    assert job.stats["chunks"] == 3
+    assert (job.stats["processed"], job.failed) == (5, 0)
+    # Test dostępności i rezerwacja slotu raz na zadanie, nie na porcję
+    assert len(checks) == 1
+    assert pipeline.config_slots.get_stats()["acquired"] == 1
+    assert pipeline.config_slots.get_stats()["leased"] == []
+    assert backend.fake.state.get_stats()["config_pushes"] == 1
+    # Obrazy porcji zwolnione, wyniki obrazów tylko w pliku zadania
+    assert images == [None] * 5
+    assert [event["type"] for event in job.events] == [JOB_DONE]
+    with open(job.results_path, encoding="utf-8") as f:
+        assert len(f.read().splitlines()) == 5
+    events = job.load_results(job.wait_for_events(0))
+    assert sorted(event["key"] for event in events[:-1]) == [f"image_{i}" for i in range(5)]
+    assert json.dumps(events)
+
+
+def test_cache_misses_include_images_failed_in_ncshot(pipeline, tmp_path, monkeypatch):
+    pipeline.start()
+    cache = NcshotResultCache(str(tmp_path / "cache"), 64 * 1024 * 1024)
+    monkeypatch.setattr(pipeline, "result_cache", cache)
+    package = make_package(pipeline)
+    failing = IMAGE[:-2] + b"\x00\xff\xd9"
+    send = pipeline.send_image_to_backend
+
+    def send_or_fail(backend, i, image_data, batch, cache_key, outcome):
+        if image_data == failing:
+            return False  # status "failed" bez wyniku
+        return send(backend, i, image_data, batch, cache_key, outcome)
+
+    monkeypatch.setattr(pipeline, "send_image_to_backend", send_or_fail)
+    pipeline.start_ncshot_with_config_safe(package, [data_url(IMAGE)])
+    stats = pipeline.start_ncshot_with_config_safe(package, [data_url(IMAGE), data_url(failing)])["_stats"]
+
+    assert (stats["processed"], stats["failed"]) == (1, 1)
+    assert (stats["result_cache"]["hits"], stats["result_cache"]["misses"]) == (1, 1)
+    assert (cache.get_stats()["hits"], cache.get_stats()["misses"]) == (1, 2)
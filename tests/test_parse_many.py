@@ -0,0 +1,46 @@
+from app.logic import parse_many
+
+SYMBOL_XML = '<result><exdata><data name="plate" source="anpr"><value name="symbol">{}</value></data></exdata></result>'
+
+
+def documents(count):
+    return [SYMBOL_XML.format(f"WX{n:05d}") for n in range(count)]
+
+
+def symbols(results):
+    return [(index, result["plates"][0]["symbol"]) for index, result in results]
+
+
+def test_ordered_output_matches_input():
+    docs = documents(50)
+    results = list(parse_many(docs, workers=2, chunk_size=3, ordered=True, backend="stdlib"))
+    assert symbols(results) == [(n, f"WX{n:05d}") for n in range(50)]
+
+
+def test_unordered_output_has_every_document_once():
+    docs = documents(50)
+    results = list(parse_many(docs, workers=2, chunk_size=3, ordered=False, backend="stdlib"))
+    assert sorted(symbols(results)) == [(n, f"WX{n:05d}") for n in range(50)]
+
+
+def test_in_process_parsing():
+    assert symbols(parse_many(documents(3), workers=1, backend="stdlib")) == [(0, "WX00000"), (1, "WX00001"),
+                                                                              (2, "WX00002")]
+
+
+def test_ordered_buffer_bounded_by_window():
+    # Pierwsza paczka parsuje się długo - pozostałe nie mogą w tym czasie wczytać całego wejścia
+    slow = "<result>" + "<exdata><data name='x'><value name='v'>1</value></data></exdata>" * 60000 + "</result>"
+    docs = [slow] + documents(400)
+    consumed = []
+
+    def reader():
+        for doc in docs:
+            consumed.append(doc)
+            yield doc
+
+    results = parse_many(reader(), workers=2, chunk_size=1, ordered=True, backend="stdlib")
+    first_index, _ = next(results)
+    assert first_index == 0
+    assert len(consumed) <= 2 * 2  # okno: 2 * workers paczek po jednym dokumencie
+    assert [index for index, _ in results] == list(range(1, 401))
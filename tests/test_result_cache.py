@@ -0,0 +1,81 @@
+import os
+
+from app.result_cache import NcshotResultCache
+
+XML = "<result>" + "x" * 1000 + "</result>"
+PLATE = b"\xff\xd8" + b"p" * 500 + b"\xff\xd9"
+
+
+def make_cache(tmp_path, max_bytes=1024 * 1024):
+    return NcshotResultCache(str(tmp_path / "cache"), max_bytes)
+
+
+def test_hit_and_miss(tmp_path):
+    cache = make_cache(tmp_path)
+    key = NcshotResultCache.make_key("img", "ini", "anpr=1")
+    assert cache.get(key) is None
+
+    cache.put(key, XML, [PLATE, None])
+    cached = cache.get(key)
+    assert cached.xml == XML
+    assert cached.plates == [PLATE, None]
+    assert cache.get(NcshotResultCache.make_key("img", "other-ini", "anpr=1")) is None
+
+    stats = cache.get_stats()
+    assert (stats["hits"], stats["misses"], stats["stores"]) == (1, 2, 1)
+
+
+def test_entry_written_by_another_worker_is_adopted(tmp_path):
+    writer, reader = make_cache(tmp_path), make_cache(tmp_path)
+    writer.put("k1", XML, [PLATE])
+
+    assert reader.get("k1").xml == XML
+    assert reader.get_stats()["entries"] == 1
+
+    # Drugi zapis tego samego klucza tylko indeksuje istniejący wpis
+    reader.put("k2", XML, [])
+    writer.put("k2", XML, [PLATE])
+    assert writer.get("k2").plates == []
+
+
+def test_eviction_removes_least_recently_used(tmp_path):
+    cache = make_cache(tmp_path, max_bytes=5000)
+    for n, key in enumerate(["a", "b", "c"]):
+        cache.put(key, XML, [PLATE])
+        os.utime(os.path.join(cache.directory, key), (1000 + n, 1000 + n))
+    assert cache.get("a") is not None  # "a" staje się najświeższy
+
+    cache.put("d", XML, [PLATE])
+
+    assert cache.get("b") is None
+    assert {key for key in "acd" if cache.get(key)} == set("acd")
+    assert cache.get_stats()["evictions"] == 1
+
+
+def test_size_cap_shared_between_workers(tmp_path):
+    first, second = make_cache(tmp_path, max_bytes=5000), make_cache(tmp_path, max_bytes=5000)
+    for n, key in enumerate(["a", "b", "c"]):
+        first.put(key, XML, [PLATE])
+        os.utime(os.path.join(first.directory, key), (1000 + n, 1000 + n))
+
+    second.put("d", XML, [PLATE])
+
+    entries = [name for name in os.listdir(first.directory) if not name.startswith(".")]
+    assert sorted(entries) == ["b", "c", "d"]
+    assert first.get("a") is None
+
+
+def test_clear_removes_entries_of_all_workers(tmp_path):
+    first, second = make_cache(tmp_path), make_cache(tmp_path)
+    first.put("a", XML, [])
+    second.put("b", XML, [])
+    assert first.clear() == 2
+    assert second.get("b") is None
+
+
+def test_disabled_cache(tmp_path):
+    cache = make_cache(tmp_path, max_bytes=0)
+    cache.put("a", XML, [])
+    assert cache.get("a") is None
+    assert cache.clear() == 0
+    assert not os.path.exists(cache.directory)
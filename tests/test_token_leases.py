@@ -0,0 +1,140 @@
+import json
+import os
+import subprocess
+import sys
+import threading
+
+import pytest
+
+from app.token_leases import TokenLeaseRegistry, _process_start, fcntl
+
+
+class FakeNcshot:
+    def __init__(self, fail_first: int = 0):
+        self.released = []
+        self.fail_first = fail_first
+        self._lock = threading.Lock()
+
+    def release(self, backend: str, token: str) -> bool:
+        with self._lock:
+            if self.fail_first:
+                self.fail_first -= 1
+                return False
+            self.released.append(token)
+            return True
+
+
+def file_tokens(state_file: str):
+    with open(state_file, encoding="utf-8") as f:
+        return sorted(lease["token"] for lease in json.load(f).values())
+
+
+def dead_pid() -> int:
+    process = subprocess.Popen([sys.executable, "-c", "pass"])
+    process.wait()
+    return process.pid
+
+
+@pytest.fixture
+def state_file(tmp_path):
+    return str(tmp_path / "ncshot_token_leases.json")
+
+
+def test_failed_release_retried_by_reaper(state_file):
+    ncshot = FakeNcshot(fail_first=1)
+    leases = TokenLeaseRegistry(state_file, ncshot.release, retry_base=0.0)
+    leases.acquire("vm:5543", "t1", owner="batch")
+    assert not leases.release("vm:5543", "t1")
+    assert leases.get_stats()["pending_release"] == 1
+    assert leases.reap() == 1
+    assert ncshot.released == ["t1"]
+    assert leases.list_leases() == []
+
+
+def test_leases_of_dead_worker_recovered(state_file):
+    crashed = TokenLeaseRegistry(state_file, FakeNcshot().release)
+    crashed.pid = dead_pid()
+    crashed.acquire("vm:5543", "t1", owner="batch")
+    crashed.sync(take_over=False)
+
+    ncshot = FakeNcshot()
+    leases = TokenLeaseRegistry(state_file, ncshot.release)
+    assert leases.recover() == 1
+    assert ncshot.released == ["t1"]
+    assert leases.get_stats()["recovered"] == 1
+    leases.sync()
+    assert leases.list_leases() == []
+
+
+def test_leases_of_previous_process_with_same_pid_released(state_file):
+    # Restart kontenera: nowy proces uvicorn dostaje ten sam PID co poprzedni
+    previous = TokenLeaseRegistry(state_file, FakeNcshot().release)
+    previous.acquire("vm:5543", "t1", owner="batch")
+    previous.sync(take_over=False)
+
+    ncshot = FakeNcshot()
+    leases = TokenLeaseRegistry(state_file, ncshot.release)
+    assert leases.pid == previous.pid
+    assert leases.recover() == 1
+    assert ncshot.released == ["t1"]
+    leases.sync()
+    assert file_tokens(state_file) == []
+
+
+def test_leases_of_live_worker_left_alone(state_file):
+    other = TokenLeaseRegistry(state_file, FakeNcshot().release)
+    other.pid = os.getppid()
+    other.pid_start = _process_start(other.pid)
+    other.acquire("vm:5543", "t1", owner="batch")
+    other.sync(take_over=False)
+
+    ncshot = FakeNcshot()
+    leases = TokenLeaseRegistry(state_file, ncshot.release)
+    assert leases.recover() == 0
+    assert ncshot.released == []
+    assert [lease["token"] for lease in leases.list_leases()] == ["t1"]
+
+
+def test_short_leases_never_written(state_file):
+    leases = TokenLeaseRegistry(state_file, FakeNcshot().release)
+    leases.acquire("vm:5543", "t1", owner="batch")
+    leases.acquire("vm:5543", "t2", owner="batch")
+    assert leases.release("vm:5543", "t1")
+    leases.sync()
+    assert file_tokens(state_file) == ["t2"]
+    assert leases.release("vm:5543", "t2")
+    leases.sync()
+    assert file_tokens(state_file) == []
+
+
+@pytest.mark.skipif(fcntl is None, reason="wymaga flock")
+def test_concurrent_workers_do_not_wait_for_file_lock(state_file):
+    ncshot = FakeNcshot()
+    leases = TokenLeaseRegistry(state_file, ncshot.release)
+    done = []
+
+    def worker(n: int):
+        for i in range(200):
+            token = f"{n}-{i}"
+            leases.acquire("vm:5543", token, owner=f"batch-{n}")
+            assert leases.release("vm:5543", token)
+        done.append(n)
+
+    # Inny worker trzyma wyłączną blokadę pliku dzierżaw przez cały czas działania wątków
+    with open(state_file, "a+") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            threads = [threading.Thread(target=worker, args=(n,)) for n in range(8)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join(10)
+            assert len(done) == 8
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+    assert len(ncshot.released) == 8 * 200
+    stats = leases.get_stats()
+    assert stats["acquired"] == stats["released"] == 8 * 200
+    assert stats["syncs"] == 0
+    assert stats["outstanding"] == 0
@@ -0,0 +1,49 @@
+from pathlib import Path
+
+import pytest
+
+from app.logic import available_xml_parser_backends, compare_xml_parser_backends, process_ncshot_result_xml_enhanced
+
+# Korpus odpowiedzi NCShot: typowe, wielopojazdowe, z niesparsowanymi polami, puste, ucięte,
+# z komentarzami/zagnieżdżeniami i z zadeklarowanym kodowaniem innym niż UTF-8
+FIXTURES = sorted((Path(__file__).parent / "fixtures" / "ncshot_xml").glob("*.xml"))
+BACKENDS = available_xml_parser_backends()
+
+needs_lxml = pytest.mark.skipif("lxml" not in BACKENDS, reason="wymaga lxml")
+
+
+def read_fixture(name):
+    return (Path(__file__).parent / "fixtures" / "ncshot_xml" / name).read_text(encoding="utf-8")
+
+
+@needs_lxml
+@pytest.mark.parametrize("path", FIXTURES, ids=lambda path: path.name)
+def test_backends_agree_on_recorded_responses(path):
+    assert compare_xml_parser_backends(path.read_text(encoding="utf-8")) is None
+
+
+@pytest.mark.parametrize("backend", BACKENDS)
+def test_single_vehicle_response(backend):
+    result = process_ncshot_result_xml_enhanced(read_fixture("single_vehicle_radar.xml"), backend=backend)
+    assert result["summary"]["plates_detected"] == 1 and result["summary"]["vehicles_detected"] == 1
+    assert result["signature"] == "c2lnbmF0dXJl" and result["radar_data"] == {"speed": "53"}
+    assert result["metadata"]["anomalies"]["bad_fields"] == 0
+
+
+@pytest.mark.parametrize("backend", BACKENDS)
+def test_nested_exdata_ignored(backend):
+    result = process_ncshot_result_xml_enhanced(read_fixture("comments_nested_variants.xml"), backend=backend)
+    assert [plate["symbol"] for plate in result["plates"]] == ["KR 4XY12", "KR4XY12"]
+    assert result["summary"]["exdata_count"] == 3
+
+
+@pytest.mark.parametrize("backend", BACKENDS)
+def test_unparsable_fields_counted(backend):
+    anomalies = process_ncshot_result_xml_enhanced(read_fixture("noisy_fields.xml"), backend=backend)["metadata"]["anomalies"]
+    assert anomalies["bad_fields"] == 21 and anomalies["fields"]["plate.level"] == 3
+
+
+@pytest.mark.parametrize("backend", BACKENDS)
+def test_truncated_response_is_parse_error(backend):
+    result = process_ncshot_result_xml_enhanced(read_fixture("truncated.xml"), backend=backend)
+    assert result["error"] and result["error_details"]["error_type"] == "xml_parse_error"